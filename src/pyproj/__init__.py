@@ -18,13 +18,17 @@ from .norms import (
   str_list,
   nonempty_str_list,
   norm_bool,
+  norm_workers,
+  norm_jobs,
   norm_path,
   norm_path_to_os,
   norm_mode,
   norm_zip_external_attr,
   norm_data,
+  norm_stream,
   b64_nopad,
   hash_sha256,
+  HashReader,
   email_encode_items,
   TimeEncode )
 
@@ -74,6 +78,7 @@ from .dist_file import (
   dist_source_dummy,
   dist_source_targz,
   dist_binary_wheel,
+  dist_binary_metadata,
   dist_binary_editable,
   FileOutsideRootError,
   dist_iter,
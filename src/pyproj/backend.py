@@ -34,8 +34,11 @@ from . import (
   PyProjBase,
   dist_source_targz,
   dist_binary_wheel,
+  dist_binary_metadata,
   dist_binary_editable)
-from .cache import cache_dir
+from .cache import (
+  cache_dir,
+  HashCache )
 
 #===============================================================================
 def _reraise_known_errors(func):
@@ -182,7 +185,10 @@ def build_sdist(
   with dist_source_targz(
     pkg_info = pyproj.pkg_info,
     outdir = dist_directory,
-    logger = pyproj.logger ) as dist:
+    logger = pyproj.logger,
+    compresslevel = pyproj.source.compress_level,
+    workers = pyproj.backend_settings.workers,
+    hash_cache = HashCache() if pyproj.backend_settings.hash_cache else None ) as dist:
 
     pyproj.dist_source_copy(
       dist = dist )
@@ -211,19 +217,13 @@ def prepare_metadata_for_build_wheel(
     config_settings = config_settings,
     editable = _editable)
 
-  # TODO: abstract 'wheel metadata' from needing to actually make a dummy wheel file
-  with dist_binary_wheel(
+  with dist_binary_metadata(
     pkg_info = pyproj.pkg_info,
     outdir = metadata_directory,
     logger = pyproj.logger ) as dist:
 
     pass
 
-
-  import zipfile
-  with zipfile.ZipFile( dist.outpath ) as fp:
-    fp.extractall(metadata_directory)
-
   # NOTE: dist_info_path is a POSIX path, need to convert to OS path first
   # PIP assums the return value is a string
   return os.fspath(Path(dist.dist_info_path))
@@ -259,7 +259,13 @@ def build_wheel(
       pyproj.binary.get('build_suffix', None) ),
     compat = pyproj.binary.compat_tags,
     outdir = wheel_directory,
-    logger = pyproj.logger ) as dist:
+    logger = pyproj.logger,
+    workers = pyproj.backend_settings.workers,
+    compresslevel = pyproj.binary.compress_level,
+    compress_rules = [(c.glob, c.level) for c in pyproj.binary.compress],
+    compress_detect = pyproj.binary.compress_detect,
+    hash_cache = HashCache() if pyproj.backend_settings.hash_cache else None,
+    incremental = pyproj.backend_settings.incremental ) as dist:
 
     pyproj.dist_binary_copy(
       dist = dist )
@@ -1,5 +1,6 @@
 
 from .builder import Builder
+from .jobserver import JobServer
 from .process import process
 from .download import download
 from .meson import meson
@@ -2,12 +2,21 @@ from __future__ import annotations
 import os
 import os.path as osp
 import sys
+import select
 import tempfile
 import sysconfig
+import platform
 import re
 from copy import copy
 import shutil
 import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+  ThreadPoolExecutor,
+  wait,
+  FIRST_COMPLETED)
 from logging import Logger
 from pathlib import Path
 from difflib import Differ
@@ -29,8 +38,25 @@ from ..template import (
   template_substitute,
   Namespace)
 from ..pptoml import pyproj_targets
+from ..norms import norm_workers
+from ..cache import BuildCache
+from .jobserver import (
+  JobServer,
+  jobserver_style)
 
 ERROR_REC = re.compile(r"error:", re.I)
+# time (seconds) between checks that a running command has been cancelled
+CANCEL_POLL_INTERVAL = 0.1
+# minimum time (seconds) between lines of output of a command given to the logger
+PROGRESS_INTERVAL = 30.0
+# maximum length (bytes) of a line of output that is scanned, the rest is only logged
+OUTPUT_LINE_MAX = 2**14
+# size (bytes) of chunks of output read from a command
+OUTPUT_BUFSIZE = 2**16
+# time (seconds) to wait for the output of a command to be closed after it exits
+PUMP_JOIN_TIMEOUT = 5.0
+# time (seconds) to wait for a cancelled command to exit before it is killed
+TERMINATE_TIMEOUT = 5.0
 
 pyexe = sys.executable
 
@@ -49,10 +75,76 @@ _sysconfig_vars_alt = {
 
 _sysconfig_vars = _sysconfig_vars_alt|sysconfig.get_config_vars()
 
+#===============================================================================
+def platform_abi() -> str:
+  """Machine architecture and binary interface of the Python environment, which
+  is not distinguished by ``sys.platform`` (e.g. x86_64 and aarch64 linux)
+  """
+  return ', '.join([
+    sysconfig.get_platform(),
+    platform.machine(),
+    f"soabi={sysconfig.get_config_var('SOABI')}",
+    f"ext_suffix={sysconfig.get_config_var('EXT_SUFFIX')}"])
+
 #===============================================================================
 class BuildCommandError(ValidationError):
   pass
 
+#===============================================================================
+def target_depends(targets: pyproj_targets) -> dict[int, set[int]]:
+  """Indices of the targets that each target depends on, from ``depends_on``
+  """
+  names = {}
+
+  for i, target in enumerate(targets):
+    if not (name := target.name):
+      continue
+
+    with validating(key = f"tool.pyproj.targets[{i}].name"):
+      if name in names:
+        raise ValidationError(
+          f"Target name {name!r} already used by targets[{names[name]}]")
+
+    names[name] = i
+
+  depends = {}
+
+  for i, target in enumerate(targets):
+    deps = depends[i] = set()
+
+    for k, name in enumerate(target.depends_on):
+      with validating(key = f"tool.pyproj.targets[{i}].depends_on[{k}]"):
+        if name not in names:
+          raise ValidationError(f"Target name not found: {name!r}")
+
+        deps.add(names[name])
+
+  return depends
+
+#===============================================================================
+def target_order(depends: dict[int, set[int]]) -> list[int]:
+  """Order to run targets after their dependencies, otherwise in the order given
+  """
+  remaining = {i: set(deps) for i, deps in depends.items()}
+  order = []
+
+  while remaining:
+    # lowest index that does not depend on any target not yet run
+    i = next((i for i in sorted(remaining) if not remaining[i]), None)
+
+    if i is None:
+      cycle = sorted(remaining)
+      raise ValidationError(
+        f"Targets have circular 'depends_on': {', '.join(f'targets[{i}]' for i in cycle)}")
+
+    order.append(i)
+    del remaining[i]
+
+    for deps in remaining.values():
+      deps.discard(i)
+
+  return order
+
 #===============================================================================
 class Builder:
   """Run build setup, compile, install commands
@@ -63,6 +155,17 @@ class Builder:
     Path to root project directory
   targets:
   logger:
+  editable:
+  workers:
+    Number of targets that may be run concurrently, which must not share a
+    ``build_dir`` or ``prefix`` unless ordered by ``depends_on``.
+  build_cache:
+    If given, :class:`BuildCache <partis.pyproj.cache.BuildCache>` used to
+    restore the installed files of targets with unchanged configuration and source files.
+  jobs:
+    If non-zero, the total number of jobs run by all targets, shared through a
+    :class:`JobServer` given to their commands. Otherwise, a jobserver inherited
+    through ``MAKEFLAGS`` is used (if any).
 
   """
   #-----------------------------------------------------------------------------
@@ -71,13 +174,28 @@ class Builder:
     root: str | Path,
     targets: pyproj_targets,
     logger: Logger,
-    editable: bool):
+    editable: bool,
+    workers: int = 1,
+    build_cache: BuildCache|None = None,
+    jobs: int = 0):
 
     root = resolve(Path(root))
 
     self.pyproj = pyproj
     self.root = root
     self.editable = editable
+    self.workers = norm_workers(workers)
+    self.build_cache = build_cache
+    self.jobs = jobs
+    self.jobserver = None
+    # whether the one job that does not need a token is in use
+    self._job_implicit = False
+    self._lock = threading.Lock()
+    self._depends = {}
+    self._exclude = []
+    self._keys = {}
+    # targets whose prefix is not written by any other target
+    self._owned = set()
     # isolate (shallow) changes to targets
     self.targets = [copy(v) for v in targets]
     self.clean_dirs = [False]*len(self.targets)
@@ -110,14 +228,31 @@ class Builder:
 
   #-----------------------------------------------------------------------------
   def build_targets(self):
+    """Runs all enabled targets, after the targets each depends on
+
+    Targets are prepared (paths and templates evaluated) in the order given,
+    then run in an order consistent with their ``depends_on``.
+    If ``workers > 1``, targets that do not depend on each other are run
+    concurrently by a pool of threads, where the commands of each target are run
+    from its ``work_dir`` instead of changing the working directory of the process.
+    The first target to fail cancels all targets not yet complete.
+    """
+    python = f"PYTHON={sys.implementation.name}, {sys.version}, api={str(sys.api_version)}"
+    platform = f"PLATFORM={sys.platform}, {platform_abi()}"
+    packages = "PACKAGES=\n  " + '\n  '.join(self.pyproj.env_pkgs)
+
     status_content = '\n'.join([
       f"HEAD={self.pyproj.commit}",
       f"PPTOML_CHECKSUM={self.pyproj.pptoml_checksum}",
-      f"PYTHON={sys.implementation.name}, {sys.version}, api={str(sys.api_version)}",
-      f"PLATFORM={sys.platform}",
+      python,
+      platform,
       # must depend on sys.path, since that is where build dependencies are configured
       "SYSPATH=\n  " + '\n  '.join(sys.path),
-      "PACKAGES=\n  " + '\n  '.join(self.pyproj.env_pkgs)])
+      packages])
+
+    # NOTE: the build cache does not depend on sys.path, which differs between
+    # isolated build environments with the same packages installed
+    build_env = [python, platform, packages]
 
     status_files = set()
     exclusive = {
@@ -142,6 +277,11 @@ class Builder:
       if missing:
         raise ValidationError(f"Exclusive group {missing} does not have an enabled target")
 
+    depends = target_depends(self.targets)
+    # check for circular dependencies before anything is run
+    order = target_order(depends)
+    jobs = {}
+
     for i, target in enumerate(self.targets):
       if not target.enabled:
         self.logger.info(f"Skipping targets[{i}], disabled for environment markers")
@@ -150,183 +290,428 @@ class Builder:
       if (group := target.exclusive) and (group_idx := exclusive.get(group)) != i:
         self.logger.warning(
           f"Skipping targets[{i}], exclusive group {group!r} already satisfied by targets[{group_idx}]")
+        continue
 
-      # each target isolated (shallow) changes to namespace
-      namespace = copy(self.namespace)
+      jobs[i] = self._build_prep(i, target, status_content, status_files)
+      jobs[i]['config'] = {
+        'build_env': build_env,
+        'entry': target.entry,
+        'editable': self.editable,
+        **{k: target[k] for k in (
+          'work_dir', 'src_dir', 'build_dir', 'prefix', 'options', 'env',
+          'setup_args', 'compile_args', 'install_args')}}
+
+    # targets that are skipped are not run, but the targets they depend on
+    # are still run first
+    for i in order:
+      depends[i] = set().union(*[
+        {j} if j in jobs else depends[j]
+        for j in depends[i]])
+
+    depends = {i: depends[i] for i in jobs}
+    self._depends = depends
+    # outputs of the build are not inputs (source files) of any target
+    self._exclude = [self.root/'build', self.root/'build'/'logs', self.root/'dist', self.tmpdir] + [
+      jobs[i]['target'][k] for i in jobs for k in ('build_dir', 'prefix')]
+    # NOTE: installed files cannot be attributed to a target if its prefix is
+    # shared with (or inside the directories of) another target
+    self._owned = {
+      i for i in jobs
+      if not any(
+        subdir(jobs[j]['target'][k], jobs[i]['target'].prefix, check = False)
+        for j in jobs if j != i
+        for k in ('build_dir', 'prefix'))}
+
+    if self.jobs:
+      style = jobserver_style()
+      self.jobserver = JobServer.create(self.jobs, self.tmpdir, style = style)
+
+      if self.jobserver is None:
+        self.logger.warning("Jobserver not supported on this platform, 'jobs' is ignored")
+      else:
+        self.logger.info(f"Jobserver ({style}) for {self.jobs} jobs")
+
+    else:
+      self.jobserver = JobServer.from_makeflags(os.environ.get('MAKEFLAGS', ''))
+
+      if self.jobserver is not None:
+        self.logger.info("Using jobserver from MAKEFLAGS")
 
-      # check paths
-      for k in ('work_dir', 'src_dir', 'build_dir', 'prefix'):
-        with validating(key = f"tool.pyproj.targets[{i}].{k}"):
-          rel_path = target[k]
-          rel_path = template_substitute(rel_path, namespace)
+    try:
+      if self.workers > 1 and len(jobs) > 1:
+        self._check_concurrent(jobs, depends)
+        self._build_parallel(jobs, depends)
 
-          if rel_path.is_absolute():
-            abs_path = rel_path
-          else:
-            abs_path = self.root/rel_path
+      else:
+        for i in target_order(depends):
+          self._build_run(i, **jobs[i])
 
-          abs_path = resolve(abs_path)
+    finally:
+      if self.jobserver is not None:
+        self.jobserver.close()
+        self.jobserver = None
 
-          if not (subdir(self.root, abs_path, check=False) or subdir(self.tmpdir, abs_path, check=False)):
-            raise FileOutsideRootError(
-              f"Must be within project root directory or tmpdir:"
-              f"file = \"{abs_path}\",  root = \"{self.root}\"")
+      if self.build_cache is not None:
+        self.build_cache.prune()
 
-          if k in ('build_dir', 'prefix') and subdir(abs_path, self.root, check=False):
-            raise ValidPathError(
-              f"'{k}' cannot be project root directory:"
-              f"file = \"{abs_path}\",  root = \"{self.root}\"")
+  #-----------------------------------------------------------------------------
+  def _build_prep(self, i, target, status_content, status_files) -> dict:
+    """Evaluates paths, options, and templates of a target to be run
+    """
+    # each target isolated (shallow) changes to namespace
+    namespace = copy(self.namespace)
+
+    # check paths
+    for k in ('work_dir', 'src_dir', 'build_dir', 'prefix'):
+      with validating(key = f"tool.pyproj.targets[{i}].{k}"):
+        rel_path = target[k]
+        rel_path = template_substitute(rel_path, namespace)
+
+        if rel_path.is_absolute():
+          abs_path = rel_path
+        else:
+          abs_path = self.root/rel_path
+
+        abs_path = resolve(abs_path)
+
+        if not (subdir(self.root, abs_path, check=False) or subdir(self.tmpdir, abs_path, check=False)):
+          raise FileOutsideRootError(
+            f"Must be within project root directory or tmpdir:"
+            f"file = \"{abs_path}\",  root = \"{self.root}\"")
+
+        if k in ('build_dir', 'prefix') and subdir(abs_path, self.root, check=False):
+          raise ValidPathError(
+            f"'{k}' cannot be project root directory:"
+            f"file = \"{abs_path}\",  root = \"{self.root}\"")
 
-          target[k] = abs_path
-          namespace[k] = abs_path
+        target[k] = abs_path
+        namespace[k] = abs_path
 
-      src_dir = target.src_dir
-      build_dir = target.build_dir
-      prefix = target.prefix
-      work_dir = target.work_dir
+    build_dir = target.build_dir
+    prefix = target.prefix
 
-      with validating(key = f"tool.pyproj.targets[{i}].src_dir"):
-        if not src_dir.exists():
-          raise ValidPathError(f"Source directory not found: {src_dir}")
+    with validating(key = f"tool.pyproj.targets[{i}]"):
+      if subdir(build_dir, prefix, check=False):
+        raise ValidPathError(
+          f"'prefix' cannot be inside 'build_dir', which will be cleaned: {build_dir} > {prefix}")
 
-        if not src_dir.is_dir():
-          raise ValidPathError(f"Source directory not a directory: {src_dir}")
+    status_file = build_dir/'.pyproj_status'
+    build_dirty = build_dir.exists() and any(build_dir.iterdir())
+    build_clean = not self.editable and target.build_clean
 
-      with validating(key = f"tool.pyproj.targets[{i}]"):
-        if subdir(build_dir, prefix, check=False):
-          raise ValidPathError(
-            f"'prefix' cannot be inside 'build_dir', which will be cleaned: {build_dir} > {prefix}")
+    if status_file not in status_files:
+      status_files.add(status_file)
 
-      status_file = build_dir/'.pyproj_status'
-      build_dirty = build_dir.exists() and any(build_dir.iterdir())
-      build_clean = not self.editable and target.build_clean
+      if build_dirty and status_file.is_file():
 
-      if status_file not in status_files:
-        status_files.add(status_file)
+        if build_clean:
+          self.logger.info(
+            f"Cleaning previous build_dir: {build_dir}")
 
-        if build_dirty and status_file.is_file():
+          shutil.rmtree(build_dir)
+          build_dirty = False
 
-          if build_clean:
-            self.logger.info(
-              f"Cleaning previous build_dir: {build_dir}")
+        elif status_content != (_status_content := status_file.read_text()):
+          diff = Differ().compare(
+            _status_content.splitlines(),
+            status_content.splitlines())
 
-            shutil.rmtree(build_dir)
-            build_dirty = False
+          diff = [v.rstrip() for v in diff if v[0] != ' ']
 
-          elif status_content != (_status_content := status_file.read_text()):
-            diff = Differ().compare(
-              _status_content.splitlines(),
-              status_content.splitlines())
+          self.logger.info(
+            f"Change in environment detected, cleaning previous build_dir: {build_dir}\n"
+            + '\n'.join(diff))
 
-            diff = [v.rstrip() for v in diff if v[0] != ' ']
+          shutil.rmtree(build_dir)
+          build_dirty = False
 
-            self.logger.info(
-              f"Change in environment detected, cleaning previous build_dir: {build_dir}\n"
-              + '\n'.join(diff))
+      if build_clean and build_dirty:
+        raise ValidPathError(
+          f"'build_dir' is not empty, please remove manually."
+          f" If this was intended, set 'build_clean = false': {build_dir}")
 
-            shutil.rmtree(build_dir)
-            build_dirty = False
+      status_file.parent.mkdir(parents=True, exist_ok=True)
+      status_file.write_text(status_content)
 
-        if build_clean and build_dirty:
-          raise ValidPathError(
-            f"'build_dir' is not empty, please remove manually."
-            f" If this was intended, set 'build_clean = false': {build_dir}")
-
-        status_file.parent.mkdir(parents=True, exist_ok=True)
-        status_file.write_text(status_content)
-
-      # create output directories
-      target.prefix.mkdir(parents=True, exist_ok=True)
-
-      with validating(key = f"tool.pyproj.targets[{i}].options"):
-        # original target options remain until evaluated
-        options = target.options
-
-        # top-level options updated in order of appearance
-        _options = {}
-        namespace['options'] = _options
-
-        for k,v in options.items():
-          v = template_substitute(v, namespace)
-          # update target
-          options[k] = v
-          # update
-          _options[k] = v
-
-      with validating(key = f"tool.pyproj.targets[{i}].env"):
-        # original target options remain until evaluated
-        env = target.env
-
-        # top-level options updated in order of appearance
-        # copy of environment dict, each target isolated changes
-        _env = copy(namespace['env'])
-        namespace['env'] = _env
-
-        for k,v in env.items():
-          v = template_substitute(v, namespace)
-          env[k] = v
-          _env[k] = v
-
-      for attr in ['setup_args', 'compile_args', 'install_args']:
-        with validating(key = f"tool.pyproj.targets[{i}].{attr}"):
-          value = target[attr]
-          value = template_substitute(value, namespace)
-
-          target[attr] = value
-          namespace[attr] = value
-
-      entry_point = EntryPoint(
-        pyproj = self,
-        root = self.root,
-        name = f"tool.pyproj.targets[{i}]",
-        logger = self.logger,
-        entry = target.entry)
-
-      log_dir = self.root/'build'/'logs'
-
-      log_dir.mkdir(parents=True, exist_ok=True)
-
-      runner = ProcessRunner(
-        logger=self.logger,
-        log_dir=log_dir,
-        target_name=f"target_{i:02d}",
-        env=_env)
-
-      self.logger.info('\n'.join([
-        f"targets[{i}]:",
-        f"  work_dir: {work_dir}",
-        f"  src_dir: {src_dir}",
-        f"  build_dir: {build_dir}",
-        f"  prefix: {prefix}",
-        f"  log_dir: {log_dir}",
-        "  options: " + ('\n' if target.options else 'none') + '\n'.join([
-          f"    {k}: {v}" for k,v in target.options.items()]),
-        "  env: " + ('\n' if target.env else 'default') + '\n'.join([
-          f"    {k}: {v}" for k,v in target.env.items()])]))
+    # create output directories
+    target.prefix.mkdir(parents=True, exist_ok=True)
 
-      cwd = os.getcwd()
+    with validating(key = f"tool.pyproj.targets[{i}].options"):
+      # original target options remain until evaluated
+      options = target.options
+
+      # top-level options updated in order of appearance
+      _options = {}
+      namespace['options'] = _options
+
+      for k,v in options.items():
+        v = template_substitute(v, namespace)
+        # update target
+        options[k] = v
+        # update
+        _options[k] = v
 
-      # allow cleaning once the target is validated
-      self.clean_dirs[i] = True
+    with validating(key = f"tool.pyproj.targets[{i}].env"):
+      # original target options remain until evaluated
+      env = target.env
+
+      # top-level options updated in order of appearance
+      # copy of environment dict, each target isolated changes
+      _env = copy(namespace['env'])
+      namespace['env'] = _env
+
+      for k,v in env.items():
+        v = template_substitute(v, namespace)
+        env[k] = v
+        _env[k] = v
+
+    for attr in ['setup_args', 'compile_args', 'install_args']:
+      with validating(key = f"tool.pyproj.targets[{i}].{attr}"):
+        value = target[attr]
+        value = template_substitute(value, namespace)
+
+        target[attr] = value
+        namespace[attr] = value
+
+    entry_point = EntryPoint(
+      pyproj = self,
+      root = self.root,
+      name = f"tool.pyproj.targets[{i}]",
+      logger = self.logger,
+      entry = target.entry)
+
+    return {
+      'target': target,
+      'entry_point': entry_point,
+      'env': _env,
+      'build_dirty': build_dirty}
+
+  #-----------------------------------------------------------------------------
+  def _build_run(self, i, target, entry_point, env, build_dirty, config, cancel = None):
+    """Runs the entry point of a prepared target, or restores its prefix from
+    the build cache
+
+    If ``cancel`` is given, the commands of the target are run from its
+    ``work_dir`` (without changing the working directory of the process), and
+    are terminated when ``cancel`` is set.
+    """
+    src_dir = target.src_dir
+    build_dir = target.build_dir
+    prefix = target.prefix
+    work_dir = target.work_dir
+
+    # NOTE: checked when run, since the source may be created by a dependency
+    with validating(key = f"tool.pyproj.targets[{i}].src_dir"):
+      if not src_dir.exists():
+        raise ValidPathError(f"Source directory not found: {src_dir}")
+
+      if not src_dir.is_dir():
+        raise ValidPathError(f"Source directory not a directory: {src_dir}")
+
+    log_dir = self.root/'build'/'logs'
+
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    if (jobserver := self.jobserver) is not None:
+      env['MAKEFLAGS'] = jobserver.makeflags(env.get('MAKEFLAGS', ''))
+
+    runner = ProcessRunner(
+      logger=self.logger,
+      log_dir=log_dir,
+      target_name=f"target_{i:02d}",
+      env=env,
+      cwd=None if cancel is None else work_dir,
+      cancel=cancel,
+      pass_fds=jobserver.fds if jobserver is not None else (),
+      progress_interval=PROGRESS_INTERVAL)
+
+    self.logger.info('\n'.join([
+      f"targets[{i}]:",
+      f"  work_dir: {work_dir}",
+      f"  src_dir: {src_dir}",
+      f"  build_dir: {build_dir}",
+      f"  prefix: {prefix}",
+      f"  log_dir: {log_dir}",
+      "  options: " + ('\n' if target.options else 'none') + '\n'.join([
+        f"    {k}: {v}" for k,v in target.options.items()]),
+      "  env: " + ('\n' if target.env else 'default') + '\n'.join([
+        f"    {k}: {v}" for k,v in target.env.items()])]))
+
+    # allow cleaning once the target is validated
+    self.clean_dirs[i] = True
+
+    kwargs = dict(
+      options = target.options,
+      work_dir = work_dir,
+      src_dir = src_dir,
+      build_dir = build_dir,
+      prefix = prefix,
+      setup_args = target.setup_args,
+      compile_args = target.compile_args,
+      install_args = target.install_args,
+      build_clean = not build_dirty,
+      runner = runner)
+
+    if (build_cache := self.build_cache) is None:
+      self._build_entry(entry_point, kwargs, work_dir, cancel)
+      return
+
+    # NOTE: the key of a target depends on those of its dependencies, instead of
+    # their outputs (which are excluded from the source files)
+    config = config|{'depends': sorted(self._keys[j] for j in self._depends[i])}
+    key = build_cache.key(
+      config,
+      src_dir,
+      self._exclude,
+      aliases = {'root': self.root, 'tmpdir': self.tmpdir})
+    self._keys[i] = key
+
+    if i not in self._owned:
+      self.logger.info(
+        f"Not caching targets[{i}], prefix is shared with another target: {prefix}")
+      self._build_entry(entry_point, kwargs, work_dir, cancel)
+      return
+
+    if build_cache.restore(key, prefix):
+      self.logger.info(f"Restored targets[{i}] prefix from build cache: {key}")
+      return
+
+    self._build_entry(entry_point, kwargs, work_dir, cancel)
+
+    # NOTE: all files in the prefix are cached (not only those changed by this
+    # run), except within the build_dir, logs, and directories of other targets
+    if not build_cache.store(key, prefix, self._exclude):
+      self.logger.info(f"Not caching targets[{i}], no files installed in prefix: {prefix}")
+
+  #-----------------------------------------------------------------------------
+  def _build_entry(self, entry_point, kwargs, work_dir, cancel):
+    token = self._job_acquire(cancel)
+
+    try:
+      if cancel is not None:
+        entry_point(**kwargs)
+        return
+
+      cwd = os.getcwd()
 
       try:
         os.chdir(work_dir)
-
-        entry_point(
-          options = target.options,
-          work_dir = work_dir,
-          src_dir = src_dir,
-          build_dir = build_dir,
-          prefix = prefix,
-          setup_args = target.setup_args,
-          compile_args = target.compile_args,
-          install_args = target.install_args,
-          build_clean = not build_dirty,
-          runner = runner)
+        entry_point(**kwargs)
 
       finally:
         os.chdir(cwd)
 
+    finally:
+      self._job_release(token)
+
+  #-----------------------------------------------------------------------------
+  def _job_acquire(self, cancel) -> bool:
+    """Waits for a job slot to run a target, when there is a jobserver
+
+    Returns
+    -------
+    True if a token was read from the jobserver, instead of using the one
+    implicit job of this process.
+    """
+    if self.jobserver is None:
+      return False
+
+    while True:
+      with self._lock:
+        if not self._job_implicit:
+          self._job_implicit = True
+          return False
+
+      if self.jobserver.acquire(timeout = CANCEL_POLL_INTERVAL):
+        return True
+
+      if cancel is not None and cancel.is_set():
+        raise BuildCommandError("Cancelled waiting for jobserver")
+
+  #-----------------------------------------------------------------------------
+  def _job_release(self, token: bool):
+    if self.jobserver is None:
+      return
+
+    if token:
+      self.jobserver.release()
+      return
+
+    with self._lock:
+      self._job_implicit = False
+
+  #-----------------------------------------------------------------------------
+  def _check_concurrent(self, jobs: dict[int, dict], depends: dict[int, set[int]]):
+    """Checks that targets which may run at the same time (neither depends on
+    the other) do not share a ``build_dir`` or ``prefix``
+    """
+    # all targets that must complete before each target is run
+    ancestors = {}
+
+    for i in target_order(depends):
+      ancestors[i] = set().union(*[{j}|ancestors[j] for j in depends[i]])
+
+    for i in jobs:
+      for j in jobs:
+        if j <= i or j in ancestors[i] or i in ancestors[j]:
+          continue
+
+        for k in ('build_dir', 'prefix'):
+          with validating(key = f"tool.pyproj.targets[{j}].{k}"):
+            if jobs[i]['target'][k] == jobs[j]['target'][k]:
+              raise ValidPathError(
+                f"Same '{k}' as targets[{i}], which may run concurrently unless"
+                f" one is in the 'depends_on' of the other: {jobs[j]['target'][k]}")
+
+  #-----------------------------------------------------------------------------
+  def _build_parallel(self, jobs: dict[int, dict], depends: dict[int, set[int]]):
+    """Runs prepared targets in a pool of threads as their dependencies complete
+    """
+    dependents = {i: [] for i in jobs}
+
+    for i, deps in depends.items():
+      for j in deps:
+        dependents[j].append(i)
+
+    remaining = {i: len(deps) for i, deps in depends.items()}
+    ready = [i for i, n in remaining.items() if n == 0]
+    running = {}
+    cancel = threading.Event()
+
+    self.logger.info(f"Running {len(jobs)} targets with {self.workers} workers")
+
+    with ThreadPoolExecutor(
+        max_workers = self.workers,
+        thread_name_prefix = 'build_target') as executor:
+
+      try:
+        while ready or running:
+          for i in sorted(ready):
+            running[executor.submit(self._build_run, i, **jobs[i], cancel = cancel)] = i
+
+          ready = []
+          done, _ = wait(running, return_when = FIRST_COMPLETED)
+
+          for future in sorted(done, key = running.get):
+            i = running.pop(future)
+            # raises the first error of any target
+            future.result()
+
+            for j in dependents[i]:
+              remaining[j] -= 1
+
+              if remaining[j] == 0:
+                ready.append(j)
+
+      except BaseException:
+        # fail fast, running commands are terminated and the rest are not started
+        cancel.set()
+
+        for future in running:
+          future.cancel()
+
+        raise
+
   #-----------------------------------------------------------------------------
   def build_clean(self):
     ...
@@ -344,18 +729,47 @@ class Builder:
 
 #===============================================================================
 class ProcessRunner:
+  """Runs the commands of a target, with output written to a log file per command
+
+  Parameters
+  ----------
+  logger:
+  log_dir:
+    Directory of log files
+  target_name:
+    Prefix of log files
+  env:
+    Environment of commands
+  cwd:
+    If given, the working directory of commands, otherwise that of the process.
+  cancel:
+    If given, running commands are terminated (and no more are started) once set.
+  pass_fds:
+    File descriptors inherited by commands (e.g. of a :class:`JobServer`)
+  progress_interval:
+    If given, the minimum time (seconds) between lines of output given to the
+    logger while a command is running.
+  """
   #-----------------------------------------------------------------------------
   def __init__(self,
       logger,
       log_dir: Path,
       target_name: str,
-      env: dict):
+      env: dict,
+      cwd: Path|None = None,
+      cancel: threading.Event|None = None,
+      pass_fds: tuple[int, ...] = (),
+      progress_interval: float|None = None):
 
     self.logger = logger
     self.log_dir = log_dir
     self.target_name = target_name
     self.commands = {}
     self.env = env
+    self.cwd = cwd
+    self.cancel = cancel
+    self.pass_fds = tuple(pass_fds)
+    self.progress_interval = progress_interval
 
   #-----------------------------------------------------------------------------
   def run(self, args: list, env: dict = None):
@@ -363,6 +777,11 @@ class ProcessRunner:
       raise ValueError(f"Command for {self.target_name} is empty.")
 
     cmd_exec = args[0]
+
+    if self.cwd is not None and osp.dirname(cmd_exec) and not osp.isabs(cmd_exec):
+      # NOTE: relative to the working directory of the command, not of the process
+      cmd_exec = osp.join(self.cwd, cmd_exec)
+
     cmd_exec_src = shutil.which(cmd_exec)
 
     if cmd_exec_src is None:
@@ -383,48 +802,256 @@ class ProcessRunner:
 
     stdout_file = self.log_dir/f"{run_id}.log"
 
+    if self.cancel is not None and self.cancel.is_set():
+      raise BuildCommandError(f"Cancelled {run_id!r}")
+
+    self.logger.info(f"Running {run_id!r}: "+' '.join(args))
+
+    monitor = OutputMonitor()
+    returncode = self._run_monitored(args, stdout_file, monitor, run_id)
+
+    if returncode:
+      e = subprocess.CalledProcessError(returncode, args)
+
+      raise BuildCommandError(
+        str(e),
+        extra=monitor.report(stdout_file)) from None
+
+  #-----------------------------------------------------------------------------
+  def _run_monitored(self,
+      args: list,
+      stdout_file: Path,
+      monitor: OutputMonitor,
+      run_id: str) -> int:
+    """Runs a command, with output written to the log file (and scanned) as it
+    is read, polling for cancellation while waiting for it to complete
+    """
+    fp = open(stdout_file, 'wb')
+
     try:
-      self.logger.info(f"Running {run_id!r}: "+' '.join(args))
+      proc = subprocess.Popen(
+        args,
+        shell=False,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=self.env,
+        cwd=self.cwd,
+        pass_fds=self.pass_fds)
+
+    except BaseException:
+      fp.close()
+      raise
+
+    stop = threading.Event()
+    pump = threading.Thread(
+      target=self._pump,
+      args=(proc.stdout, fp, monitor, run_id, stop),
+      name=f"pump_{run_id}",
+      daemon=True)
+
+    pump.start()
+    # time to wait for the rest of the output after the command exits
+    timeout = PUMP_JOIN_TIMEOUT
 
-      with open(stdout_file, 'wb') as fp:
-        subprocess.run(
-          args,
-          shell=False,
-          stdout=fp,
-          stderr=subprocess.STDOUT,
-          check=True,
-          env=self.env)
+    try:
+      while True:
+        try:
+          returncode = proc.wait(timeout=CANCEL_POLL_INTERVAL)
+          break
 
-    except subprocess.CalledProcessError as e:
+        except subprocess.TimeoutExpired:
+          if self.cancel is not None and self.cancel.is_set():
+            self.logger.warning(f"Terminating {run_id!r}, cancelled by failure of another target")
+            timeout = 0.0
+            proc.terminate()
 
+            try:
+              proc.wait(timeout=TERMINATE_TIMEOUT)
 
-      num_windows = 20
-      window_size = 5
-      with open(stdout_file, 'rb') as fp:
-        lines = [
-          (lineno,line)
-          for lineno,line in enumerate(fp.read().decode('utf-8', errors='replace').splitlines())]
+            except subprocess.TimeoutExpired:
+              self.logger.warning(f"Killing {run_id!r}, not terminated after {TERMINATE_TIMEOUT}s")
+              proc.kill()
+              proc.wait()
 
-      suspect_linenos = [
-        lineno
-        for lineno,line in lines
-        if ERROR_REC.search(line)]
+            raise BuildCommandError(f"Cancelled {run_id!r}") from None
 
-      # suspect_linenos = suspect_linenos[:num_windows]
+    except BaseException:
+      if proc.poll() is None:
+        timeout = 0.0
+        proc.kill()
+        proc.wait()
+
+      raise
+
+    finally:
+      # NOTE: the output may be held open by another process started by the
+      # command (e.g. a compiler server), which is not waited on indefinitely.
+      # The output is closed by the pump when it stops.
+      pump.join(timeout)
+
+      if pump.is_alive():
+        if timeout:
+          self.logger.warning(
+            f"Output of {run_id!r} still open after it exited, remaining output is not scanned")
+
+        stop.set()
+        monitor.close()
+        pump.join(2*CANCEL_POLL_INTERVAL)
+
+    return returncode
+
+  #-----------------------------------------------------------------------------
+  def _pump(self, stream, fp, monitor: OutputMonitor, run_id: str, stop: threading.Event):
+    """Copies output of a command into its log file, splitting it into lines
+    given to the monitor and (rate limited) to the logger, until the output is
+    closed or ``stop`` is set
+
+    Only the first :data:`OUTPUT_LINE_MAX` bytes of each line are scanned.
+    """
+    interval = self.progress_interval
+    last_progress = time.monotonic()
+    fd = stream.fileno()
+    # NOTE: reads are polled so that a stop is noticed even if the output is
+    # never closed (not possible for pipes on windows)
+    poll = os.name == 'posix'
+    # start of the current line, not yet scanned
+    buf = bytearray()
+    # whether the start of the current line was already scanned
+    scanned = False
+
+    def feed(data):
+      nonlocal last_progress
+
+      line = bytes(data[:OUTPUT_LINE_MAX]).decode('utf-8', errors='replace').rstrip('\r')
+      monitor.feed(line)
+
+      if interval is not None and (now := time.monotonic()) - last_progress >= interval:
+        last_progress = now
+        self.logger.info(f"{run_id}: {line}")
+
+    with fp, stream:
+      try:
+        while not stop.is_set():
+          if poll and not select.select([fd], [], [], CANCEL_POLL_INTERVAL)[0]:
+            continue
 
-      extra = [
+          if not (chunk := os.read(fd, OUTPUT_BUFSIZE)):
+            break
+
+          fp.write(chunk)
+          *lines, rest = chunk.split(b'\n')
+
+          for line in lines:
+            if not scanned:
+              buf += line[:OUTPUT_LINE_MAX]
+              feed(buf)
+
+            buf.clear()
+            scanned = False
+
+          if not scanned:
+            buf += rest[:OUTPUT_LINE_MAX]
+
+            if len(buf) >= OUTPUT_LINE_MAX:
+              feed(buf)
+              buf.clear()
+              scanned = True
+
+        if buf and not scanned and not stop.is_set():
+          # last line without a newline
+          feed(buf)
+
+      except (OSError, ValueError):
+        # output closed after giving up on the command
+        pass
+
+#===============================================================================
+class OutputMonitor:
+  """Scans lines of output of a command as they are read, keeping only what is
+  needed to report a failure (instead of reading back the whole log)
+
+  Parameters
+  ----------
+  num_lines:
+    Number of last lines kept
+  window_size:
+    Number of lines kept starting at each line matching :data:`ERROR_REC`
+  num_windows:
+    Number of (last) windows of error lines kept
+  """
+  #-----------------------------------------------------------------------------
+  def __init__(self,
+      num_lines: int = 20,
+      window_size: int = 5,
+      num_windows: int = 20):
+
+    self.window_size = window_size
+    self.lineno = 0
+    self.num_errors = 0
+    self.last_error = None
+    self.lines = deque(maxlen=num_lines)
+    self.windows = deque(maxlen=num_windows)
+    self.closed = False
+    self._lock = threading.Lock()
+    # windows not yet filled
+    self._open = []
+
+  #-----------------------------------------------------------------------------
+  def feed(self, line: str):
+    with self._lock:
+      if self.closed:
+        return
+
+      item = (self.lineno, line)
+      self.lineno += 1
+      self.lines.append(item)
+
+      if self._open:
+        for window in self._open:
+          window.append(item)
+
+        self._open = [w for w in self._open if len(w) < self.window_size]
+
+      if ERROR_REC.search(line):
+        window = [item]
+        self.windows.append(window)
+        self.num_errors += 1
+        self.last_error = item[0]
+
+        if self.window_size > 1:
+          self._open.append(window)
+
+  #-----------------------------------------------------------------------------
+  def close(self):
+    """Ignore any more lines
+    """
+    with self._lock:
+      self.closed = True
+
+  #-----------------------------------------------------------------------------
+  def report(self, log_file: Path) -> str:
+    """Windows of error lines and last lines of output
+    """
+    with self._lock:
+      extra = []
+
+      if (omitted := self.num_errors - len(self.windows)) > 0:
+        extra += [
+          f"{'':-<70}",
+          f"[{omitted} earlier lines matching {ERROR_REC.pattern!r} omitted]"]
+
+      extra += [
         '\n'.join(
           [f"{'':-<70}",f"{'':>4}⋮"]
-          +[f"{j:>4d}| {line}" for j,line in lines[i:i+window_size]]
+          +[f"{j:>4d}| {line}" for j,line in window]
           +[f"{'':>4}⋮"])
-        for i in suspect_linenos]
-
-      m = len(lines)-num_windows
+        for window in self.windows]
 
-      if suspect_linenos:
-        m = max(m, suspect_linenos[-1])
+      last_lines = list(self.lines)
 
-      last_lines = lines[m:]
+      if self.last_error is not None:
+        # only after the last error, which is already in a window
+        last_lines = [(j, line) for j, line in last_lines if j >= self.last_error]
 
       if last_lines:
         extra += [
@@ -437,9 +1064,7 @@ class ProcessRunner:
           for j,line in last_lines]
 
       extra += [
-        f"{'END':>4}| [See log file: {stdout_file}]",
+        f"{'END':>4}| [See log file: {log_file}]",
         f"{'':-<70}",]
 
-      raise BuildCommandError(
-        str(e),
-        extra='\n'.join(extra)) from None
+      return '\n'.join(extra)
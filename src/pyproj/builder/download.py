@@ -2,6 +2,7 @@ from __future__ import annotations
 import sys
 import os
 import platform
+import threading
 import stat
 import re
 from pathlib import Path
@@ -67,9 +68,9 @@ def download(
     logger.info(f"Using cache file: {cache_file}")
 
   else:
-    # name unique to host/process as countermeasure for race condition
+    # name unique to host/process/thread as countermeasure for race condition
     hostname = re.sub(r'[^a-zA-Z0-9]+', '_', str(platform.node()))
-    tmp_name = f"{cache_file.name}-{hostname}-{os.getpid():06d}.tmp"
+    tmp_name = f"{cache_file.name}-{hostname}-{os.getpid():06d}-{threading.get_ident()}.tmp"
     tmp_file = cache_file.with_name(tmp_name)
 
     if tmp_file.exists():
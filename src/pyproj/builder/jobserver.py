@@ -0,0 +1,243 @@
+from __future__ import annotations
+import os
+import re
+import select
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+# options of MAKEFLAGS that configure a jobserver, or the number of jobs
+_jobserver_rec = re.compile(
+  r"(?:^|\s)--jobserver-(?:auth|fds)=(?P<auth>\S+)")
+_jobs_rec = re.compile(
+  r"(?:^|\s)(?:-j\s*\d*|--jobs(?:=\d+)?|--jobserver-(?:auth|fds)=\S+)(?=\s|$)")
+_make_version_rec = re.compile(r"GNU Make (\d+)\.(\d+)")
+
+#===============================================================================
+def jobserver_style() -> str:
+  """Style of jobserver to create, ``'fifo'`` unless the ``make`` program is
+  older than version 4.4 (which does not accept a named pipe), then ``'pipe'``
+
+  Note
+  ----
+  Ninja (>= 1.13) only accepts a named pipe.
+  """
+  if not (make := shutil.which('make')):
+    return 'fifo'
+
+  try:
+    out = subprocess.run(
+      [make, '--version'],
+      capture_output = True,
+      text = True,
+      timeout = 10).stdout
+
+  except (OSError, subprocess.SubprocessError):
+    return 'fifo'
+
+  if (m := _make_version_rec.search(out)) and (int(m[1]), int(m[2])) < (4, 4):
+    return 'pipe'
+
+  return 'fifo'
+
+#===============================================================================
+class JobServer:
+  """GNU make jobserver, limiting the total number of jobs run by all commands
+  that support it (e.g. ``make``, ``ninja`` >= 1.13)
+
+  Each process that is given the jobserver (through ``MAKEFLAGS``) may always run
+  one job, and must read a token from the jobserver before running each additional
+  job, writing it back when the job is complete.
+
+  Parameters
+  ----------
+  path:
+    Named pipe (FIFO) of tokens, if not given by ``fds``
+  fds:
+    File descriptors ``(read, write)`` of an anonymous pipe of tokens
+  jobs:
+    Total number of jobs, if known
+  owner:
+    If true, the pipe was created by this process, and is closed (or removed)
+    by :meth:`close`.
+
+  See Also
+  --------
+  * https://www.gnu.org/software/make/manual/html_node/POSIX-Jobserver.html
+  """
+  #-----------------------------------------------------------------------------
+  def __init__(self,
+      path: Path|None = None,
+      fds: tuple[int, int]|None = None,
+      jobs: int|None = None,
+      owner: bool = False):
+
+    self.path = path
+    self.jobs = jobs
+    self.owner = owner
+    self._lock = threading.Lock()
+    self._tokens = []
+
+    if path is not None:
+      # NOTE: the read end must be opened first for the (non-blocking) write end
+      self._rfd = os.open(path, os.O_RDONLY|os.O_NONBLOCK)
+      self._wfd = os.open(path, os.O_WRONLY|os.O_NONBLOCK)
+      self._fds = ()
+
+    else:
+      self._rfd, self._wfd = fds
+      self._fds = tuple(fds)
+
+  #-----------------------------------------------------------------------------
+  @classmethod
+  def create(cls,
+      jobs: int,
+      dir: Path,
+      style: str = 'fifo') -> JobServer|None:
+    """Creates a jobserver for a total of ``jobs``, or None if not supported
+    by the platform
+
+    Parameters
+    ----------
+    jobs:
+    dir:
+      Directory to create the named pipe
+    style:
+      ``'fifo'`` for a named pipe, or ``'pipe'`` for an anonymous pipe
+      (file descriptors inherited by commands).
+    """
+    if os.name != 'posix':
+      return None
+
+    if style == 'pipe':
+      rfd, wfd = os.pipe()
+      # NOTE: the file is shared with commands, which should not block on reads
+      os.set_blocking(rfd, False)
+      server = cls(fds = (rfd, wfd), jobs = jobs, owner = True)
+
+    else:
+      path = Path(dir)/'jobserver.fifo'
+      os.mkfifo(path, 0o600)
+      server = cls(path = path, jobs = jobs, owner = True)
+    # one job is always available to each process without a token
+    os.write(server._wfd, b'+'*(jobs - 1))
+
+    return server
+
+  #-----------------------------------------------------------------------------
+  @classmethod
+  def from_makeflags(cls, makeflags: str) -> JobServer|None:
+    """Jobserver inherited from the (parent) process that set ``makeflags``,
+    or None if there is not one available to this process
+    """
+    m = _jobserver_rec.search(makeflags or '')
+
+    if not m:
+      return None
+
+    auth = m.group('auth')
+
+    if auth.startswith('fifo:'):
+      path = Path(auth[len('fifo:'):])
+
+      try:
+        return cls(path = path)
+      except OSError:
+        return None
+
+    try:
+      fds = tuple(int(v) for v in auth.split(','))
+
+      if len(fds) != 2:
+        return None
+
+      # NOTE: the file descriptors are only inherited if this process was
+      # marked as recursive (e.g. by '+' in the makefile)
+      for fd in fds:
+        os.fstat(fd)
+
+    except (ValueError, OSError):
+      return None
+
+    return cls(fds = fds)
+
+  #-----------------------------------------------------------------------------
+  @property
+  def fds(self) -> tuple[int, ...]:
+    """File descriptors that must be passed to commands (``pass_fds``)
+    """
+    return self._fds
+
+  #-----------------------------------------------------------------------------
+  def makeflags(self, makeflags: str = '') -> str:
+    """``MAKEFLAGS`` of commands given this jobserver, replacing any other
+    jobserver (or number of jobs) in ``makeflags``
+    """
+    if not self.owner:
+      # inherited
+      return makeflags
+
+    makeflags = _jobs_rec.sub('', makeflags or '').strip()
+
+    if self.path is not None:
+      auth = f"fifo:{self.path}"
+    else:
+      auth = f"{self._rfd},{self._wfd}"
+
+    return ' '.join([
+      *makeflags.split(),
+      f"-j{self.jobs}",
+      f"--jobserver-auth={auth}"])
+
+  #-----------------------------------------------------------------------------
+  def acquire(self, timeout: float|None = None) -> bool:
+    """Reads one token, waiting up to ``timeout`` seconds (or indefinitely if None)
+
+    Returns
+    -------
+    True if a token was read, and must be returned by :meth:`release`.
+    """
+    while True:
+      ready, _, _ = select.select([self._rfd], [], [], timeout)
+
+      if not ready:
+        return False
+
+      try:
+        token = os.read(self._rfd, 1)
+      except (BlockingIOError, InterruptedError):
+        # read by another process first
+        continue
+
+      if not token:
+        # all write ends closed, no more tokens
+        return False
+
+      with self._lock:
+        self._tokens.append(token)
+
+      return True
+
+  #-----------------------------------------------------------------------------
+  def release(self):
+    """Returns a token read by :meth:`acquire`
+    """
+    with self._lock:
+      token = self._tokens.pop()
+
+    os.write(self._wfd, token)
+
+  #-----------------------------------------------------------------------------
+  def close(self):
+    """Returns any tokens still held, and removes the named pipe (if owned)
+    """
+    while self._tokens:
+      self.release()
+
+    if self.path is not None or self.owner:
+      os.close(self._rfd)
+      os.close(self._wfd)
+
+    if self.owner and self.path is not None and self.path.exists():
+      self.path.unlink()
@@ -1,4 +1,11 @@
 from __future__ import annotations
+import os
+import stat
+import json
+import time
+import shutil
+import hashlib
+import threading
 import tempfile
 from pathlib import Path
 
@@ -20,4 +27,806 @@ def cache_dir() -> Path:
   import getpass
   username = getpass.getuser()
   tmp_dir = tempfile.gettempdir()
-  return Path(tmp_dir)/f'.cache-partis-pyproj-{username}'
\ No newline at end of file
+  return Path(tmp_dir)/f'.cache-partis-pyproj-{username}'
+#===============================================================================
+class JSONCache:
+  """Base of caches stored as a JSON file, where each entry is a list of four
+  values with the time it was last used as the last value
+  """
+  version: int = 1
+  min_age: float = 2.0
+  max_age: float = 30*24*3600.0
+  max_entries: int = 2**17
+  # minimum change of the last used time of an entry before it is updated, so
+  # that the cache is not written again by every build that only reads it
+  used_resolution: float = 24*3600.0
+
+  #-----------------------------------------------------------------------------
+  def __init__(self, path: Path):
+    self.path = Path(path)
+    self._lock = threading.Lock()
+    self._entries = None
+    self._modified = False
+    self._now = time.time()
+
+  #-----------------------------------------------------------------------------
+  def save(self):
+    """Writes the cache file, if modified
+    """
+    from .file import create_tempfile
+
+    with self._lock:
+      if not self._modified:
+        return
+
+      oldest = self._now - self.max_age
+
+      entries = sorted(
+        ((k, v) for k, v in self._entries.items() if v[3] >= oldest),
+        key = lambda kv: kv[1][3],
+        reverse = True)[:self.max_entries]
+
+      data = json.dumps({
+        'version': self.version,
+        'entries': dict(entries) })
+
+      self.path.parent.mkdir(parents = True, exist_ok = True)
+      fd, tmp = create_tempfile(self.path.parent, prefix = f'.{self.path.name}.')
+
+      try:
+        with os.fdopen(fd, 'w', encoding = 'utf-8') as fp:
+          fp.write(data)
+
+        os.replace(tmp, self.path)
+
+      except BaseException:
+        tmp.unlink()
+        raise
+
+      self._modified = False
+
+  #-----------------------------------------------------------------------------
+  def _touch(self, entry: list):
+    """Marks an entry as used, if not already marked within ``used_resolution`` seconds
+    """
+    if self._now - entry[3] >= self.used_resolution:
+      entry[3] = int(self._now)
+      self._modified = True
+
+  #-----------------------------------------------------------------------------
+  def _load(self) -> dict[str, list]:
+    if self._entries is not None:
+      return self._entries
+
+    self._entries = dict()
+
+    try:
+      data = json.loads(self.path.read_text(encoding = 'utf-8'))
+
+      if data.get('version') == self.version:
+        self._entries = {
+          k: v
+          for k, v in data['entries'].items()
+          if isinstance(v, list) and len(v) == 4 }
+
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+      # missing or invalid cache is equivalent to being empty
+      pass
+
+    return self._entries
+
+#===============================================================================
+class HashCache(JSONCache):
+  """Persistent cache of file content hashes, keyed by the file stat
+
+  A cached hash is used only if the device, inode, size, and modification time
+  (nanoseconds) of a file are unchanged since the hash was computed.
+
+  Parameters
+  ----------
+  path:
+    File the cache is stored in, defaults to ``cache_dir()/'hash'/'sha256.json'``.
+
+  Note
+  ----
+  Files modified within ``min_age`` seconds are not cached, since
+  a subsequent modification may not change the modification time.
+  Entries that no longer match a file are evicted when looked up, and entries
+  not used within ``max_age`` seconds (or beyond the
+  ``max_entries`` most recently used) are evicted when saved.
+  Concurrent builds may each save the cache, where the last one is kept.
+  """
+  #-----------------------------------------------------------------------------
+  def __init__(self, path: Path|None = None):
+    if path is None:
+      path = cache_dir()/'hash'/'sha256.json'
+
+    super().__init__(path)
+
+  #-----------------------------------------------------------------------------
+  def get(self, st: os.stat_result) -> tuple[str, int]|None:
+    """Cached ``(hash, size)`` of a file, or None if not cached
+    """
+    key = f"{st.st_dev}:{st.st_ino}"
+
+    with self._lock:
+      entries = self._load()
+
+      if (entry := entries.get(key)) is None:
+        return None
+
+      size, mtime_ns, hash, _ = entry
+
+      if size != st.st_size or mtime_ns != st.st_mtime_ns:
+        # file has changed (or a different file with the same inode)
+        del entries[key]
+        self._modified = True
+        return None
+
+      self._touch(entry)
+
+      return hash, size
+
+  #-----------------------------------------------------------------------------
+  def set(self, st: os.stat_result, digest: tuple[str, int]):
+    """Caches the ``(hash, size)`` of a file
+    """
+    hash, size = digest
+
+    if size != st.st_size or st.st_mtime_ns > (self._now - self.min_age)*1e9:
+      return
+
+    key = f"{st.st_dev}:{st.st_ino}"
+
+    with self._lock:
+      self._load()[key] = [size, st.st_mtime_ns, hash, int(self._now)]
+      self._modified = True
+
+#===============================================================================
+class ScanCache(JSONCache):
+  """Persistent cache of directory listings, keyed by the directory modification time
+
+  Each entry holds the names and kinds (``'d'`` directory, ``'l'`` symlink,
+  ``'f'`` anything else) of a directory's entries, along with the last known
+  ``[mtime, size]`` of the files. A cached listing is used only if the
+  modification time (nanoseconds) of the directory is unchanged.
+
+  Parameters
+  ----------
+  path:
+    File the cache is stored in, defaults to ``cache_dir()/'scan'/'dirs.json'``.
+  trusted:
+    If true, the cached stats of files are also used without checking the files
+    themselves (only directories are stat'ed). Otherwise, only the listing is
+    used and each file is stat'ed again.
+
+  Note
+  ----
+  Modifying a file does not change the modification time of its directory, so
+  the cached stats of a file may be out of date in trusted mode.
+  Directories modified within ``min_age`` seconds are not cached, and entries
+  are evicted the same as :class:`HashCache`.
+  """
+  max_entries: int = 2**16
+
+  #-----------------------------------------------------------------------------
+  def __init__(self, path: Path|None = None, trusted: bool = False):
+    if path is None:
+      path = cache_dir()/'scan'/'dirs.json'
+
+    super().__init__(path)
+    self.trusted = trusted
+
+  #-----------------------------------------------------------------------------
+  def get(self,
+      path: str,
+      mtime_ns: int) -> tuple[dict[str, str], dict[str, list]]|None:
+    """Cached ``(kinds, stats)`` of a directory, or None if not cached
+    """
+    key = os.path.abspath(path)
+
+    with self._lock:
+      entries = self._load()
+
+      if (entry := entries.get(key)) is None:
+        return None
+
+      if entry[0] != mtime_ns:
+        # directory has changed
+        del entries[key]
+        self._modified = True
+        return None
+
+      self._touch(entry)
+
+      return entry[1], entry[2]
+
+  #-----------------------------------------------------------------------------
+  def set(self,
+      path: str,
+      mtime_ns: int,
+      kinds: dict[str, str],
+      stats: dict[str, list]):
+    """Caches the listing of a directory, which must be read after its
+    modification time ``mtime_ns``
+    """
+    if mtime_ns > (self._now - self.min_age)*1e9:
+      return
+
+    key = os.path.abspath(path)
+    entry = [mtime_ns, kinds, stats, int(self._now)]
+
+    with self._lock:
+      entries = self._load()
+
+      if (cur := entries.get(key)) is not None and cur[:3] == entry[:3]:
+        self._touch(cur)
+
+      else:
+        entries[key] = entry
+        self._modified = True
+
+
+#===============================================================================
+class BuildCache:
+  """Persistent cache of the files installed by build targets, keyed by a hash of
+  the target's configuration and the content of its source directory
+
+  Each entry is a directory containing all the files (and symlinks) in the
+  ``prefix`` of a target after it was run, except those in excluded directories
+  (e.g. its ``build_dir``), which are copied back into the ``prefix`` when the
+  same key is restored.
+
+  Parameters
+  ----------
+  path:
+    Directory the cache is stored in, defaults to ``cache_dir()/'build'``.
+  hash_cache:
+    If given, :class:`HashCache` used to look up or store the hashes of source files.
+  remote:
+    If given, :class:`BuildCacheRemote` that entries not in the local cache are
+    pulled from, and new entries are pushed to.
+
+  Note
+  ----
+  Restored files are cloned (reflink) where supported by the filesystem, otherwise
+  copied, but never hard-linked, since a later build may modify installed files in place.
+  Entries not used within ``max_age`` seconds are evicted by :meth:`prune`.
+  """
+  version: int = 1
+  max_age: float = 30*24*3600.0
+  # names of directories and files that are not inputs of a build
+  ignore: frozenset[str] = frozenset(['.git', '.hg', '.svn', '__pycache__'])
+
+  #-----------------------------------------------------------------------------
+  def __init__(self,
+      path: Path|None = None,
+      hash_cache: HashCache|None = None,
+      remote: BuildCacheRemote|None = None):
+
+    if path is None:
+      path = cache_dir()/'build'
+
+    self.path = Path(path)
+    self.hash_cache = hash_cache
+    self.remote = remote
+
+  #-----------------------------------------------------------------------------
+  def key(self,
+      config: dict,
+      src_dir: Path,
+      exclude: list[Path] = (),
+      aliases: dict[str, Path]|None = None) -> str:
+    """Hash of a target's configuration and the files in its source directory
+
+    Parameters
+    ----------
+    config:
+      JSON serializable configuration (values are otherwise converted to `str`)
+    src_dir:
+      Directory of the source files
+    exclude:
+      Directories within ``src_dir`` that are not inputs (e.g. ``build_dir``)
+    aliases:
+      Directories replaced by ``${name}`` wherever they appear in ``config``,
+      so that the key does not depend on their location (e.g. the project root).
+      Files in ``src_dir`` are always relative to ``src_dir``.
+    """
+    from .norms import hash_sha256
+
+    config = json.dumps(
+      [self.version, config],
+      sort_keys = True,
+      default = str)
+
+    # longest first, in case one is within another
+    for name, path in sorted((aliases or {}).items(), key = lambda kv: -len(str(kv[1]))):
+      config = config.replace(json.dumps(str(path))[1:-1], '${' + name + '}')
+
+    hasher = hashlib.sha256()
+    hasher.update(config.encode('utf-8'))
+
+    exclude = {os.path.abspath(p) for p in exclude}
+    hash_cache = self.hash_cache
+
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+      dirnames[:] = sorted(
+        name for name in dirnames
+        if name not in self.ignore
+        and os.path.join(dirpath, name) not in exclude)
+
+      # NOTE: symlinks to directories are listed in dirnames, but not followed
+      names = sorted(
+        [name for name in filenames if name not in self.ignore]
+        + [name for name in dirnames if os.path.islink(os.path.join(dirpath, name))])
+
+      rel = os.path.relpath(dirpath, src_dir)
+
+      for name in names:
+        file = os.path.join(dirpath, name)
+        st = os.lstat(file)
+
+        if stat.S_ISLNK(st.st_mode):
+          digest = ('l', os.readlink(file))
+
+        else:
+          digest = hash_cache.get(st) if hash_cache is not None else None
+
+          if digest is None:
+            with open(file, 'rb') as fp:
+              digest = hash_sha256(fp)
+
+            if hash_cache is not None:
+              hash_cache.set(st, digest)
+
+          digest = (digest[0], st.st_mode & 0o111)
+
+        hasher.update(json.dumps([rel, name, *digest]).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+  #-----------------------------------------------------------------------------
+  def restore(self, key: str, prefix: Path) -> bool:
+    """Copies the files of a cached entry into a prefix directory
+
+    Returns
+    -------
+    True if the entry was found (and restored), otherwise False.
+    An entry without any files is not restored.
+    """
+    from .file import clone_file
+
+    entry = self.path/key
+    manifest = entry/'manifest.json'
+
+    if not manifest.exists() and self.remote is not None:
+      self._pull(key)
+
+    try:
+      files = json.loads(manifest.read_text(encoding = 'utf-8'))['files']
+    except (OSError, ValueError, KeyError, TypeError):
+      return False
+
+    if not files:
+      return False
+
+    prefix = Path(prefix)
+
+    for rel, link in files:
+      src = entry/'files'/rel
+      dst = prefix/rel
+      dst.parent.mkdir(parents = True, exist_ok = True)
+
+      if link is not None:
+        if dst.is_symlink() or dst.exists():
+          dst.unlink()
+
+        os.symlink(link, dst)
+
+      else:
+        if dst.is_symlink():
+          dst.unlink()
+
+        clone_file(src, dst)
+
+    # mark as recently used
+    os.utime(manifest)
+
+    return True
+
+  #-----------------------------------------------------------------------------
+  def store(self, key: str, prefix: Path, exclude: list[Path] = ()) -> bool:
+    """Caches all the files in a prefix directory
+
+    Parameters
+    ----------
+    key:
+    prefix:
+      Directory of installed files, which must only be written by one target
+    exclude:
+      Directories within ``prefix`` that are not installed files (e.g. ``build_dir``)
+
+    Returns
+    -------
+    True if the entry was stored, or False if ``prefix`` had no files to cache.
+    """
+    from .file import clone_file
+
+    prefix = Path(prefix)
+    exclude = {os.path.abspath(p) for p in exclude}
+    files = []
+
+    for dirpath, dirnames, filenames in os.walk(prefix):
+      dirnames[:] = sorted(
+        name for name in dirnames
+        if os.path.join(dirpath, name) not in exclude)
+
+      # NOTE: symlinks to directories are listed in dirnames, but not followed
+      for name in sorted(filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]):
+        files.append(os.path.relpath(os.path.join(dirpath, name), prefix))
+
+    if not files:
+      return False
+
+    self.path.mkdir(parents = True, exist_ok = True)
+    tmp = Path(tempfile.mkdtemp(dir = self.path, prefix = f'.{key}.'))
+
+    try:
+      manifest = []
+
+      for rel in files:
+        src = prefix/rel
+        dst = tmp/'files'/rel
+
+        if src.is_symlink():
+          manifest.append([rel, os.readlink(src)])
+          continue
+
+        dst.parent.mkdir(parents = True, exist_ok = True)
+        clone_file(src, dst)
+        manifest.append([rel, None])
+
+      (tmp/'manifest.json').write_text(
+        json.dumps({'version': self.version, 'files': manifest}),
+        encoding = 'utf-8')
+
+      try:
+        os.rename(tmp, self.path/key)
+        tmp = None
+      except OSError:
+        # already cached, e.g. by a concurrent build
+        pass
+
+    finally:
+      if tmp is not None:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+    if self.remote is not None:
+      self.remote.push(key, self.path/key)
+
+    return True
+
+  #-----------------------------------------------------------------------------
+  def _pull(self, key: str):
+    """Copies an entry from the remote cache into the local cache, if found
+    """
+    self.path.mkdir(parents = True, exist_ok = True)
+    tmp = Path(tempfile.mkdtemp(dir = self.path, prefix = f'.{key}.'))
+
+    try:
+      if self.remote.pull(key, tmp):
+        try:
+          os.rename(tmp, self.path/key)
+          tmp = None
+        except OSError:
+          pass
+
+    finally:
+      if tmp is not None:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+  #-----------------------------------------------------------------------------
+  def prune(self):
+    """Removes entries not used within ``max_age`` seconds
+    """
+    oldest = time.time() - self.max_age
+
+    try:
+      entries = list(self.path.iterdir())
+    except OSError:
+      return
+
+    for entry in entries:
+      try:
+        used = (entry/'manifest.json').stat().st_mtime
+      except OSError:
+        # incomplete entries are only removed once old
+        used = entry.lstat().st_mtime
+
+      if used < oldest:
+        shutil.rmtree(entry, ignore_errors = True)
+
+#===============================================================================
+class BuildCacheRemote:
+  """Interface of a cache of build entries shared by many builds (e.g. by CI
+  workers), used by :class:`BuildCache` in addition to the local cache
+
+  An entry is a directory with a ``manifest.json`` and the cached files in a
+  ``files`` sub-directory, as created by :meth:`BuildCache.store`.
+  """
+  #-----------------------------------------------------------------------------
+  def pull(self, key: str, entry: Path) -> bool:
+    """Copies a cached entry into the (empty) directory ``entry``
+
+    Returns
+    -------
+    True if the entry was found, otherwise False (``entry`` is discarded).
+    """
+    raise NotImplementedError()
+
+  #-----------------------------------------------------------------------------
+  def push(self, key: str, entry: Path):
+    """Publishes the entry in directory ``entry``, unless already cached
+    """
+    raise NotImplementedError()
+
+#===============================================================================
+class SharedDirCache(BuildCacheRemote):
+  """Remote build cache in a directory shared by many machines (e.g. NFS)
+
+  The content of files is stored once as a "blob" named by its SHA-256 hash,
+  and each entry is a manifest of the files (with their blob and mode) named by
+  the key.
+  Blobs and manifests are written to a temporary file and renamed into place,
+  where the manifest is published last, so that an entry is never partially
+  visible.
+  While an entry is published, a lease file is held so that other builds with
+  the same key do not also publish it.
+
+  Parameters
+  ----------
+  path:
+    Shared directory
+
+  Note
+  ----
+  A lease older than ``lease_timeout`` seconds is assumed to have been abandoned
+  (e.g. by a build that was killed), and may be taken by another build.
+  An entry with a missing (or corrupted) blob is removed when pulled, so that
+  it is published again by the next build.
+  """
+  version: int = 1
+  lease_timeout: float = 600.0
+  max_age: float = 30*24*3600.0
+
+  #-----------------------------------------------------------------------------
+  def __init__(self, path: Path):
+    self.path = Path(path)
+
+  #-----------------------------------------------------------------------------
+  def _blob(self, hash: str) -> Path:
+    return self.path/'blobs'/hash[:2]/hash
+
+  #-----------------------------------------------------------------------------
+  def _manifest(self, key: str) -> Path:
+    return self.path/'entries'/f'{key}.json'
+
+  #-----------------------------------------------------------------------------
+  def pull(self, key: str, entry: Path) -> bool:
+    from .file import clone_file
+
+    manifest = self._manifest(key)
+
+    try:
+      data = json.loads(manifest.read_text(encoding = 'utf-8'))
+
+      if data['version'] != self.version:
+        return False
+
+      files = data['files']
+
+      for rel, link, hash, mode in files:
+        if link is not None:
+          continue
+
+        blob = self._blob(hash)
+        dst = entry/'files'/rel
+        dst.parent.mkdir(parents = True, exist_ok = True)
+
+        try:
+          clone_file(blob, dst)
+          valid = _file_hash(dst) == hash
+        except FileNotFoundError:
+          valid = False
+
+        if not valid:
+          # NOTE: missing (e.g. pruned) or corrupted blob, the entry is removed
+          # so that it may be published again
+          for file in (manifest, blob):
+            try:
+              file.unlink()
+            except OSError:
+              pass
+
+          return False
+
+        os.chmod(dst, mode)
+
+    except (OSError, ValueError, KeyError, TypeError):
+      return False
+
+    (entry/'manifest.json').write_text(
+      json.dumps({
+        'version': BuildCache.version,
+        'files': [[rel, link] for rel, link, *_ in files]}),
+      encoding = 'utf-8')
+
+    # mark as recently used
+    try:
+      os.utime(manifest)
+    except OSError:
+      pass
+
+    return True
+
+  #-----------------------------------------------------------------------------
+  def push(self, key: str, entry: Path):
+    from .file import clone_file
+
+    manifest = self._manifest(key)
+
+    if manifest.exists():
+      return
+
+    files = json.loads((entry/'manifest.json').read_text(encoding = 'utf-8'))['files']
+
+    if not self._acquire(key):
+      # published by another build
+      return
+
+    try:
+      _files = []
+
+      for rel, link in files:
+        if link is not None:
+          _files.append([rel, link, None, None])
+          continue
+
+        src = entry/'files'/rel
+        hash = _file_hash(src)
+        blob = self._blob(hash)
+
+        try:
+          # NOTE: a reused blob is marked as recent, so that it is not pruned
+          # before the entry that references it is published
+          os.utime(blob)
+
+        except FileNotFoundError:
+          blob.parent.mkdir(parents = True, exist_ok = True)
+          tmp = blob.with_name(f'.{hash}.{_unique()}.tmp')
+
+          try:
+            clone_file(src, tmp)
+            os.replace(tmp, blob)
+
+          except BaseException:
+            if tmp.exists():
+              tmp.unlink()
+
+            raise
+
+        _files.append([rel, None, hash, stat.S_IMODE(os.stat(src).st_mode)])
+
+      manifest.parent.mkdir(parents = True, exist_ok = True)
+      tmp = manifest.with_name(f'.{manifest.name}.{_unique()}.tmp')
+
+      try:
+        tmp.write_text(
+          json.dumps({'version': self.version, 'files': _files}),
+          encoding = 'utf-8')
+
+        os.replace(tmp, manifest)
+
+      except BaseException:
+        if tmp.exists():
+          tmp.unlink()
+
+        raise
+
+    finally:
+      self._release(key)
+
+  #-----------------------------------------------------------------------------
+  def prune(self):
+    """Removes entries not used within ``max_age`` seconds, and blobs no longer
+    referenced by any entry
+    """
+    now = time.time()
+    refs = set()
+
+    try:
+      manifests = list((self.path/'entries').iterdir())
+    except OSError:
+      manifests = []
+
+    for manifest in manifests:
+      try:
+        if manifest.stat().st_mtime < now - self.max_age:
+          manifest.unlink()
+          continue
+
+        refs.update(
+          hash
+          for rel, link, hash, mode in json.loads(manifest.read_text(encoding = 'utf-8'))['files']
+          if hash is not None)
+
+      except (OSError, ValueError, KeyError, TypeError):
+        continue
+
+    for dirpath, dirnames, filenames in os.walk(self.path/'blobs'):
+      for name in filenames:
+        blob = Path(dirpath)/name
+
+        try:
+          # NOTE: new blobs may not be referenced until their entry is published
+          if name not in refs and blob.stat().st_mtime < now - self.lease_timeout:
+            blob.unlink()
+
+        except OSError:
+          pass
+
+  #-----------------------------------------------------------------------------
+  def _acquire(self, key: str) -> bool:
+    lease = self.path/'leases'/key
+    lease.parent.mkdir(parents = True, exist_ok = True)
+
+    for _ in range(2):
+      try:
+        fd = os.open(lease, os.O_WRONLY|os.O_CREAT|os.O_EXCL, 0o644)
+
+      except FileExistsError:
+        try:
+          if lease.stat().st_mtime >= time.time() - self.lease_timeout:
+            return False
+
+          # abandoned lease
+          lease.unlink()
+
+        except FileNotFoundError:
+          pass
+
+        continue
+
+      with os.fdopen(fd, 'w') as fp:
+        fp.write(_unique())
+
+      return True
+
+    return False
+
+  #-----------------------------------------------------------------------------
+  def _release(self, key: str):
+    try:
+      (self.path/'leases'/key).unlink()
+    except FileNotFoundError:
+      pass
+
+#===============================================================================
+def _file_hash(path: Path) -> str:
+  hasher = hashlib.sha256()
+
+  with open(path, 'rb') as fp:
+    while data := fp.read(2**16):
+      hasher.update(data)
+
+  return hasher.hexdigest()
+
+#===============================================================================
+def _unique() -> str:
+  """Name unique to the host, process, and thread
+  """
+  import re
+  import platform
+  import secrets
+  hostname = re.sub(r'[^a-zA-Z0-9]+', '_', str(platform.node()))
+  return f"{hostname}-{os.getpid()}-{threading.get_ident()}-{secrets.token_hex(4)}"
@@ -10,6 +10,7 @@ from .dist_source import (
 
 from .dist_binary import (
   dist_binary_wheel,
+  dist_binary_metadata,
   dist_binary_editable)
 
 from .dist_copy import (
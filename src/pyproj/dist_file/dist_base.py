@@ -13,12 +13,14 @@ from abc import(
   abstractmethod )
 from ..norms import (
   norm_path,
+  norm_stream,
   hash_sha256 )
 from ..validate import (
   validating,
   ValidationError)
 from ..path import (
   resolve)
+from ..cache import HashCache
 
 #===============================================================================
 class dist_base( ABC ):
@@ -32,14 +34,17 @@ class dist_base( ABC ):
     Path to directory where the file should be copied after completing build.
   tmpdir:
     If not None, uses the given directory to place the temporary file(s) before
-    copying to final location.
-    May be the same as outdir.
+    moving to final location, otherwise they are placed in outdir.
+    If on a different filesystem than outdir, the file is copied instead.
   named_dirs:
     Mapping of specially named directories within the distribution.
     By default a named directory { 'root' : '.' } will be added,
     unless overridden with another directory name. Must be in form of Posix path.
   logger:
     Logger to which any status information is to be logged.
+  hash_cache:
+    If given, the cache of hashes of copied files, which is saved when the
+    distribution is closed.
 
   Attributes
   ----------
@@ -64,6 +69,10 @@ class dist_base( ABC ):
 
       Not all distribution implementations will create a hash of the record
 
+  prefetch :
+    Files may be read ahead of being added, and added with :meth:`write`
+    instead of :meth:`copyfile`.
+
   """
 
   outpath : Path
@@ -74,6 +83,7 @@ class dist_base( ABC ):
   copied : bool
   records : dict[PurePosixPath, tuple[str, int]]
   record_hash : str|None
+  prefetch : bool = True
 
   #-----------------------------------------------------------------------------
   def __init__( self,
@@ -81,7 +91,8 @@ class dist_base( ABC ):
     outdir: Path|None = None,
     tmpdir: Path|None = None,
     logger: Logger|None = None,
-    named_dirs: dict[str, PurePosixPath]|None = None ):
+    named_dirs: dict[str, PurePosixPath]|None = None,
+    hash_cache: HashCache|None = None ):
 
     if logger is None:
       logger = getLogger(type(self).__name__)
@@ -96,6 +107,7 @@ class dist_base( ABC ):
     self.outpath = self.outdir.joinpath(self.outname)
     self.tmpdir = Path(tmpdir) if tmpdir else None
     self.logger = logger
+    self.hash_cache = hash_cache
     self.named_dirs = {
       'root' : PurePosixPath(),
       **named_dirs }
@@ -130,25 +142,39 @@ class dist_base( ABC ):
     data: bytes,
     mode: int|None = None,
     exist_ok: bool = False,
-    record: bool = True):
+    record: bool = True,
+    digest: tuple[str, int]|None = None) -> tuple[str, int]:
     """Write data into the distribution file
 
     Parameters
     ----------
     dst :
     data :
+      Data to write, or a readable (seekable) binary stream that is copied in
+      chunks without reading the whole stream into memory.
     mode :
     record :
       Add file to the record
+    digest :
+      If given, the already known ``(hash, size)`` of the data, which is then
+      not hashed again.
 
+    Returns
+    -------
+    The ``(hash, size)`` of the data.
     """
 
+    if digest is None:
+      digest = hash_sha256(norm_stream(data)[0])
+
     if record:
       self.record(
         dst = dst,
-        data = data,
+        digest = digest,
         exist_ok = exist_ok)
 
+    return tuple(digest)
+
   #-----------------------------------------------------------------------------
   def write_link( self,
     dst: PurePosixPath,
@@ -228,16 +254,27 @@ class dist_base( ABC ):
 
     self.logger.debug(f'copyfile {src} -> {dst}')
 
-    if mode is None:
-      mode = src.stat().st_mode
-
     with open( src, "rb" ) as fp:
-      self.write(
+      st = os.fstat(fp.fileno())
+
+      if mode is None:
+        mode = st.st_mode
+
+      digest = None
+
+      if self.hash_cache is not None:
+        digest = self.hash_cache.get(st)
+
+      _digest = self.write(
         dst = dst,
         data = fp,
         mode = mode,
         record = record,
-        exist_ok = exist_ok)
+        exist_ok = exist_ok,
+        digest = digest)
+
+      if self.hash_cache is not None and digest is None:
+        self.hash_cache.set(st, _digest)
 
     return dst
 
@@ -364,8 +401,9 @@ class dist_base( ABC ):
   #-----------------------------------------------------------------------------
   def record( self,
     dst: PurePosixPath,
-    data: bytes,
-    exist_ok: bool = False) -> tuple[str, int]|None:
+    data: bytes|None = None,
+    exist_ok: bool = False,
+    digest: tuple[str, int]|None = None) -> tuple[str, int]|None:
     """Creates a record for an added file
 
     This produces an sha256 hash of the data and associates a record with the item
@@ -375,11 +413,15 @@ class dist_base( ABC ):
     dst:
       Path of item within the distribution
     data:
-      Binary data that was added
+      Binary data (or stream) that was added
     exist_ok:
       Allow overwriting a record. If False, this does *not* raise an exception if
       the new record would be exactly the same as the previous one for the same
       archive path.
+    digest:
+      If given, the already computed ``(hash, size)`` of the data, as returned
+      by :func:`hash_sha256 <partis.pyproj.norms.hash_sha256>`, and ``data`` is
+      not used.
 
     Returns
     -------
@@ -391,8 +433,10 @@ class dist_base( ABC ):
     dst = PurePosixPath(dst)
     _record = self.records.get(dst)
 
-    hash, size = hash_sha256(data)
-    record = (hash, size)
+    if digest is None:
+      digest = hash_sha256(data)
+
+    record = tuple(digest)
 
     if _record is not None:
       if record == _record:
@@ -437,6 +481,9 @@ class dist_base( ABC ):
     self.close_distfile()
     self.closed = True
 
+    if self.hash_cache is not None:
+      self.hash_cache.save()
+
     if copy and not self.copied:
       self.logger.info( f'copying {self.outname} -> {self.outdir}' )
       self.copy_distfile()
@@ -5,6 +5,7 @@ import re
 import csv
 import shutil
 import json
+import zipfile
 from subprocess import check_output
 from pathlib import (
   Path,
@@ -12,6 +13,7 @@ from pathlib import (
 from ..norms import (
   norm_path,
   norm_data,
+  norm_stream,
   hash_sha256,
   email_encode_items)
 from ..pep import (
@@ -67,6 +69,20 @@ class dist_binary_wheel( dist_zip ):
     Logger to use.
   gen_name : str
     Name to use as the 'Generator' of the wheel file
+  workers : int
+    Number of threads used to compress files into the wheel
+  compresslevel : None | int
+    Default DEFLATE compression level of files, or 0 to store them uncompressed.
+  compress_rules : None | List[ Tuple[ List[str], int ] ]
+    Compression level of files matching given patterns, see
+    :class:`dist_zip <partis.pyproj.dist_file.dist_zip.dist_zip>`.
+  compress_detect : bool
+    Store files that do not compress well, unless a rule matches.
+  hash_cache : None | :class:`HashCache <partis.pyproj.cache.HashCache>`
+    Cache of hashes of copied files.
+  incremental : bool
+    If a previous wheel exists at the output path, files that are unchanged
+    according to its RECORD are copied from it without being compressed again.
 
   Example
   -------
@@ -121,7 +137,13 @@ class dist_binary_wheel( dist_zip ):
     outdir = None,
     tmpdir = None,
     logger = None,
-    gen_name = None ):
+    gen_name = None,
+    workers = 1,
+    compresslevel = None,
+    compress_rules = None,
+    compress_detect = False,
+    hash_cache = None,
+    incremental = False ):
 
     if not compat:
       compat = [ ( 'py3', 'none', 'any' ), ]
@@ -151,6 +173,7 @@ class dist_binary_wheel( dist_zip ):
       for py_tag, abi_tag, plat_tag in compat)
 
     self.gen_name = str(gen_name)
+    self.incremental = bool(incremental)
 
     wheel_name_parts = [
       self.pkg_info.name_normed,
@@ -199,11 +222,68 @@ class dist_binary_wheel( dist_zip ):
       outdir = outdir,
       tmpdir = tmpdir,
       logger = logger,
+      workers = workers,
+      compresslevel = compresslevel,
+      compress_rules = compress_rules,
+      compress_detect = compress_detect,
+      hash_cache = hash_cache,
       named_dirs = {
         'dist_info' : self.dist_info_path,
         **{k: PurePosixPath('.') for k in self.pkg_paths},
         **{k : self.data_path.joinpath(k) for k in self.data_paths } } )
 
+  #-----------------------------------------------------------------------------
+  def create_distfile( self ):
+    super().create_distfile()
+
+    if not (self.incremental and self.outpath.exists()):
+      return
+
+    try:
+      with zipfile.ZipFile( self.outpath ) as zf:
+        record_data = zf.read( os.fspath(self.record_path) )
+        records = self.decode_dist_info_record( record_data )
+
+      levels = json.loads( self.levels_path.read_text( encoding = 'utf-8' ) )
+
+      if levels.get('record') != hash_sha256( record_data )[0]:
+        raise ValueError(f"Compression levels not of the previous wheel: {self.levels_path}")
+
+      if not self.reuse( self.outpath, records, levels['levels'] ):
+        return
+
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, zipfile.BadZipFile) as e:
+      self.logger.warning(f"Previous wheel could not be reused: {e}")
+      return
+
+    self.logger.info(f"reusing unchanged files from {self.outpath}")
+
+  #-----------------------------------------------------------------------------
+  def copy_distfile( self ):
+    if not self._tmp_path:
+      return
+
+    super().copy_distfile()
+
+    # NOTE: levels that do not match the (replaced) wheel must not be kept
+    if self.incremental:
+      self.levels_path.write_text(
+        json.dumps({
+          'record': self.record_hash,
+          'levels': self.compress_levels }),
+        encoding = 'utf-8' )
+
+    elif self.levels_path.exists():
+      self.levels_path.unlink()
+
+  #-----------------------------------------------------------------------------
+  @property
+  def levels_path( self ) -> Path:
+    """File next to the wheel with the compression level of each member, used
+    by an incremental build to reuse only members compressed with the same level
+    """
+    return self.outdir/f'.{self.outname}.levels.json'
+
   #-----------------------------------------------------------------------------
   def finalize(self, metadata_directory: str|None = None):
 
@@ -327,6 +407,160 @@ class dist_binary_wheel( dist_zip ):
 
     return content, hash
 
+  #-----------------------------------------------------------------------------
+  def decode_dist_info_record( self, content: bytes ):
+    """Parse content of .dist_info/RECORD
+
+    Returns
+    -------
+    records : dict[PurePosixPath, tuple[str, int]]
+      Mapping of path to hash and size of files with a sha256 hash
+    """
+
+    records = dict()
+
+    for row in csv.reader(io.StringIO(content.decode('utf-8'))):
+      if len(row) != 3:
+        continue
+
+      file, hash, size = row
+      algo, _, hash = hash.partition('=')
+
+      if algo == 'sha256' and hash:
+        records[PurePosixPath(file)] = (hash, int(size))
+
+    return records
+
+
+#===============================================================================
+class dist_binary_metadata( dist_binary_wheel ):
+  """Writes only the ``.dist-info`` metadata of a wheel into a directory
+
+  The metadata files are the same as those in a wheel built with the same
+  arguments, but written directly into ``outdir`` without creating a wheel file.
+  Links are written as symbolic links.
+
+  See Also
+  --------
+  * https://peps.python.org/pep-0517/#prepare-metadata-for-build-wheel
+  """
+  #-----------------------------------------------------------------------------
+  def __init__( self, **kwargs ):
+    # NOTE: the metadata must be the same as the wheel that will be built
+    kwargs.setdefault(
+      'gen_name',
+      f'{dist_binary_wheel.__module__}.{dist_binary_wheel.__name__}')
+
+    super().__init__(**kwargs)
+    self._files = set()
+
+  #-----------------------------------------------------------------------------
+  def create_distfile( self ):
+    self.outdir.mkdir(parents = True, exist_ok = True)
+
+  #-----------------------------------------------------------------------------
+  def close_distfile( self ):
+    pass
+
+  #-----------------------------------------------------------------------------
+  def copy_distfile( self ):
+    pass
+
+  #-----------------------------------------------------------------------------
+  def remove_distfile( self ):
+    pass
+
+  #-----------------------------------------------------------------------------
+  def write( self,
+    dst: PurePosixPath,
+    data: bytes,
+    mode: int|None = None,
+    exist_ok: bool = False,
+    record: bool = True,
+    digest: tuple[str, int]|None = None) -> tuple[str, int]:
+
+    self.assert_open()
+
+    dst = norm_path( os.fspath(dst) )
+    # NOTE: metadata is small enough to read into memory
+    data = norm_stream( data )[0].read()
+
+    if digest is None:
+      digest = hash_sha256( data )
+
+    if record:
+      if self.record( dst = dst, digest = digest, exist_ok = exist_ok ) is None:
+        # equivalent file has already been added
+        return tuple(digest)
+
+    elif not exist_ok and self.exists( dst ):
+      raise ValueError(f"Overwriting destination: {dst}")
+
+    path = self.outdir.joinpath( *PurePosixPath(dst).parts )
+    path.parent.mkdir( parents = True, exist_ok = True )
+    path.write_bytes( data )
+
+    self._files.add( dst )
+
+    return tuple(digest)
+
+  #-----------------------------------------------------------------------------
+  def write_link( self,
+    dst: PurePosixPath,
+    target: PurePosixPath,
+    mode: int|None = None,
+    exist_ok: bool = False,
+    record: bool = True):
+
+    self.assert_open()
+
+    dst = norm_path( os.fspath(dst) )
+    target = norm_path( target, parent_ok = True )
+    self.logger.debug(f"write_link {dst} ({target})")
+
+    if record:
+      rec = self.record(
+        dst = dst,
+        data = target.encode('utf-8'),
+        exist_ok = exist_ok )
+
+      if rec is None:
+        # equivalent file has already been added
+        return
+
+    elif not exist_ok and self.exists( dst ):
+      raise ValueError(f"Overwriting destination: {dst}")
+
+    path = self.outdir.joinpath( *PurePosixPath(dst).parts )
+    path.parent.mkdir( parents = True, exist_ok = True )
+
+    if path.is_symlink() or path.exists():
+      path.unlink()
+
+    path.symlink_to( target )
+
+    self._files.add( dst )
+
+  #-----------------------------------------------------------------------------
+  def makedirs( self,
+    dst: PurePosixPath,
+    mode: int|None = None,
+    exist_ok: bool = False,
+    record: bool = True ):
+
+    super().makedirs( dst, mode = mode, exist_ok = exist_ok, record = record )
+
+    self.outdir.joinpath( *PurePosixPath(norm_path(os.fspath(dst))).parts ).mkdir(
+      parents = True,
+      exist_ok = True )
+
+  #-----------------------------------------------------------------------------
+  def exists( self,
+    dst ):
+
+    self.assert_open()
+
+    return os.fspath(dst) in self._files
 
 #===============================================================================
 class dist_binary_editable( dist_binary_wheel ):
@@ -345,6 +579,8 @@ class dist_binary_editable( dist_binary_wheel ):
   root: Path
   pptoml_checksum: tuple[str, int]
   whl_root: Path
+  # NOTE: files are symlinked by copyfile, not read
+  prefetch = False
 
   #-----------------------------------------------------------------------------
   def __init__( self, *,
@@ -1,9 +1,13 @@
 from __future__ import annotations
 import os
+from collections import deque
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import (
   Path)
 import logging
+from ..norms import (
+  hash_sha256)
 from ..validate import (
   FileOutsideRootError,
   ValidationError,
@@ -19,18 +23,84 @@ from ..pptoml import (
   Include,
   PyprojDistCopy)
 
+# files larger than this are not read ahead, but streamed into the distribution
+PREFETCH_MAX_SIZE = 2**20
+# upper bound of bytes read ahead (or being read) but not yet written
+PREFETCH_BUDGET = 2**26
+# bytes charged against the budget for each file, in addition to its size,
+# to also bound the number of files read ahead
+PREFETCH_MIN_COST = 2**12
+
+#===============================================================================
+def prefetch_file(
+    src: Path,
+    hash_cache = None) -> tuple[bytes|None, os.stat_result, tuple[str, int]|None]:
+  """Reads and hashes a file to be copied into a distribution
+
+  Parameters
+  ----------
+  src:
+    File to read
+  hash_cache:
+    If given, :class:`HashCache <partis.pyproj.cache.HashCache>` to look up or
+    store the hash of the file.
+
+  Returns
+  -------
+  data:
+    Content of the file, or None if larger than :data:`PREFETCH_MAX_SIZE`
+  st:
+    Status of the file when read
+  digest:
+    The ``(hash, size)`` of the data, or None if not read
+  """
+  with open(src, 'rb') as fp:
+    st = os.fstat(fp.fileno())
+
+    if st.st_size > PREFETCH_MAX_SIZE:
+      return None, st, None
+
+    data = fp.read()
+
+  digest = None
+
+  if hash_cache is not None:
+    digest = hash_cache.get(st)
+
+  if digest is None:
+    digest = hash_sha256(data)
+
+    if hash_cache is not None:
+      hash_cache.set(st, digest)
+
+  return data, st, digest
+
 #===============================================================================
 def dist_iter(*,
   copy_items: list[PyprojDistCopy],
   ignore: list[str],
   root: Path,
   logger: logging.Logger,
-  follow_symlinks: bool = False):
+  follow_symlinks: bool = False,
+  workers: int = 1,
+  scan_cache = None):
 
   exclude = (PathFilter(ignore),)
 
-  # pre-scan all files in the project
-  scanned: DirInfo = scandir_recursive(root, follow_symlinks=follow_symlinks)
+  # NOTE: a negated pattern in a copy item's ignore may re-include names excluded
+  # by the global ignore, in which case they cannot be pruned while scanning
+  prune = not any(
+    p.startswith('!')
+    for cp in copy_items if cp.ignore
+    for p in cp.ignore)
+
+  # directories in the project are only scanned when first reached, and
+  # (globally) ignored directories are never scanned
+  scanned: DirInfo = scandir_recursive(
+    root,
+    follow_symlinks = follow_symlinks,
+    exclude = exclude if prune else None,
+    cache = scan_cache)
 
   for i, cp in enumerate(copy_items):
     src = cp.src
@@ -63,66 +133,92 @@ def dist_iter(*,
     if not include:
       include = [Include()]
 
-    for incl in include:
-      try:
-        matches = src_info.glob(
-          PathFilter(incl.glob, start=src),
-          exclude = _exclude,
-          dirpath = src)
-      except Exception as e:
-        logger.error(f"    - error: {e}", exc_info=e)
-        raise
+    # NOTE: the matches of all includes are found in a single traversal, where
+    # those of the first include are yielded as directories are reached, and
+    # the others are held until the previous includes are done, so that the
+    # order is the same as matching each include separately
+    matches = src_info.iglob_multi(
+      [PathFilter(incl.glob, start=src) for incl in include],
+      exclude = _exclude,
+      dirpath = src,
+      # NOTE: only directories that are traversed are scanned ahead
+      workers = workers)
 
-      # logger.debug(f"    - glob: {incl.glob} -> {len(matches)} matches")
+    pending = [[] for _ in include]
+    matched = [False for _ in include]
 
-      if not matches:
-        logger.warning(f"Copy pattern did not yield any files: {incl.glob!r}")
-        continue
+    for k, path, info in matches:
+      matched[k] = True
 
-      for i, (path, info) in enumerate(matches):
-        parent = path.parent.relative_to(src)
-        src_filename = path.name
-        # logger.debug(f"    - match:  {parent/src_filename}")
+      if k == 0:
+        if (copy := _dist_iter_match(include[k], src, dst, path)) is not None:
+          yield (i, *copy)
 
-        if incl.strip:
-          # remove leading path components
-          dst_parent = type(parent)(*parent.parts[incl.strip:])
-          # logger.debug(f"      - stripped:  {parent.parts[:incl.strip]}")
-        else:
-          dst_parent = parent
+      else:
+        pending[k].append(path)
 
-        # match to regular expression
-        m = incl.rematch.fullmatch(src_filename)
+    for k, incl in enumerate(include):
+      for path in pending[k]:
+        if (copy := _dist_iter_match(incl, src, dst, path)) is not None:
+          yield (i, *copy)
 
-        if not m:
-          # logger.debug(f"      - !rematch: {src_filename!r} (pattern = {incl.rematch})")
-          continue
+      pending[k] = None
 
-        # apply replacement
-        if incl.replace == '{0}':
-          dst_filename = src_filename
+      if not matched[k]:
+        logger.warning(f"Copy pattern did not yield any files: {incl.glob!r}")
 
-        else:
-          args = (m.group(0), *m.groups())
-          kwargs = m.groupdict()
+#===============================================================================
+def _dist_iter_match(
+    incl: Include,
+    src: Path,
+    dst: Path,
+    path: Path) -> tuple[Path, Path]|None:
+  """Source and destination of a file matched by an include, or None if the file
+  does not match the include's ``rematch``
+  """
+  parent = path.parent.relative_to(src)
+  src_filename = path.name
+  # logger.debug(f"    - match:  {parent/src_filename}")
+
+  if incl.strip:
+    # remove leading path components
+    dst_parent = type(parent)(*parent.parts[incl.strip:])
+    # logger.debug(f"      - stripped:  {parent.parts[:incl.strip]}")
+  else:
+    dst_parent = parent
+
+  # match to regular expression
+  m = incl.rematch.fullmatch(src_filename)
+
+  if not m:
+    # logger.debug(f"      - !rematch: {src_filename!r} (pattern = {incl.rematch})")
+    return None
+
+  # apply replacement
+  if incl.replace == '{0}':
+    dst_filename = src_filename
+
+  else:
+    args = (m.group(0), *m.groups())
+    kwargs = m.groupdict()
 
-          try:
-            dst_filename = incl.replace.format(*args, **kwargs)
-            # logger.debug(f"      - renamed: {src_filename!r} -> {dst_filename!r} ({incl.rematch.pattern!r} -> {incl.replace!r})")
+    try:
+      dst_filename = incl.replace.format(*args, **kwargs)
+      # logger.debug(f"      - renamed: {src_filename!r} -> {dst_filename!r} ({incl.rematch.pattern!r} -> {incl.replace!r})")
 
-          except (IndexError, KeyError) as e:
-            raise ValidationError(
-              f"Replacement {incl.replace!r} failed for"
-              f" {incl.rematch.pattern!r}:"
-              f" {args}, {kwargs}") from None
+    except (IndexError, KeyError) as e:
+      raise ValidationError(
+        f"Replacement {incl.replace!r} failed for"
+        f" {incl.rematch.pattern!r}:"
+        f" {args}, {kwargs}") from None
 
-        _src = src/parent/src_filename
-        # re-base the dst path, (path relative to src) == (path relative to dst)
-        _dst = dst/dst_parent/dst_filename
+  _src = src/parent/src_filename
+  # re-base the dst path, (path relative to src) == (path relative to dst)
+  _dst = dst/dst_parent/dst_filename
 
-        # logger.debug(f"      - from: {str(_src)!r}")
-        # logger.debug(f"      -   to: {str(_dst)!r}")
-        yield (i, _src, _dst)
+  # logger.debug(f"      - from: {str(_src)!r}")
+  # logger.debug(f"      -   to: {str(_dst)!r}")
+  return _src, _dst
 
 #===============================================================================
 def dist_copy(*,
@@ -132,7 +228,22 @@ def dist_copy(*,
   dist,
   root = None,
   logger = None,
-  follow_symlinks: bool = False):
+  follow_symlinks: bool = False,
+  workers: int = 1,
+  scan_cache = None):
+  """Copies files into a distribution
+
+  If ``workers > 1``, the source directories traversed by the includes (and
+  not ignored) are scanned ahead by a pool of threads, and
+  (if ``dist.prefetch``) files are read and hashed by a pool
+  of threads ahead of being written into the distribution, up to a total of
+  :data:`PREFETCH_BUDGET` bytes (each file at most :data:`PREFETCH_MAX_SIZE` bytes,
+  and charged at least :data:`PREFETCH_MIN_COST`). The files are still written
+  in the same order.
+
+  If given, ``scan_cache`` (:class:`ScanCache <partis.pyproj.cache.ScanCache>`)
+  is used to list the source directories, and is saved after copying.
+  """
 
   if len(copy_items) == 0:
     return
@@ -143,49 +254,142 @@ def dist_copy(*,
   copy_history: set[tuple[Path, Path]] = set()
   num_copies = len(copy_history)
 
-  with validating(key = 'copy'):
+  executor = None
+  budget = 0
+  # copy operations in order, which may be waiting on files being read ahead
+  pending = deque()
+  # bytes charged for pending operations
+  charged = 0
+
+  if workers > 1 and dist.prefetch:
+    executor = ThreadPoolExecutor(
+      max_workers = workers,
+      thread_name_prefix = 'dist_copy' )
+
+    budget = PREFETCH_BUDGET
+
+  try:
+    with validating(key = 'copy'):
+
+      for i, src, dst in dist_iter(
+        copy_items = copy_items,
+        ignore = ignore,
+        root = root,
+        follow_symlinks = follow_symlinks,
+        workers = workers,
+        scan_cache = scan_cache,
+        logger = logger):
+
+        with validating(key = i):
 
-    for i, src, dst in dist_iter(
-      copy_items = copy_items,
-      ignore = ignore,
-      root = root,
-      follow_symlinks = follow_symlinks,
-      logger = logger):
+          dst = base_path.joinpath(dst)
+          src_abs = resolve(src)
 
-      with validating(key = i):
+          if root and not subdir(root, src_abs, check = False):
+            # TODO: specialize error message for symlinks?
+            raise FileOutsideRootError(
+              f"Must have common path with root:\n  file = \"{src_abs}\"\n  root = \"{root}\"")
+
+          copy_history.add((src, dst))
+
+          if len(copy_history) == num_copies:
+            # ignore exactly duplicate copy operations
+            continue
+
+          num_copies = len(copy_history)
+
+          if not follow_symlinks and src.is_symlink():
+            target = Path(os.readlink(src))
+
+            # if not target.is_absolute():
+            #   # ensure minimal path within distribution
+            #   target = resolve(src/target)
+
+            # target = target.relative_to(src)
+
+            pending.append((i, src, dst, target, None, PREFETCH_MIN_COST))
+
+          elif src.is_dir():
+            raise AssertionError("dist_iter should not yield directories")
+
+          elif executor is not None:
+            size = src.stat().st_size
+            # NOTE: larger files are not read ahead, only opened
+            cost = PREFETCH_MIN_COST + (size if size <= PREFETCH_MAX_SIZE else 0)
+
+            # wait for earlier files to be written before reading more
+            while pending and charged + cost > budget:
+              charged -= _copy_pending(dist, pending)
+
+            pending.append((i, src, dst, None, executor.submit(
+              prefetch_file,
+              src,
+              dist.hash_cache), cost))
+
+          else:
+            pending.append((i, src, dst, None, None, PREFETCH_MIN_COST))
+
+          charged += pending[-1][-1]
+
+        while pending and charged > budget:
+          charged -= _copy_pending(dist, pending)
+
+      while pending:
+        _copy_pending(dist, pending)
+
+    if scan_cache is not None:
+      scan_cache.save()
+
+  finally:
+    if executor is not None:
+      for *_, future, _ in pending:
+        if future is not None:
+          future.cancel()
+
+      executor.shutdown(wait = True)
+
+#===============================================================================
+def _copy_pending(dist, pending):
+  """Copies the next pending file (or symlink) into the distribution
 
-        dst = base_path.joinpath(dst)
-        src_abs = resolve(src)
+  Returns
+  -------
+  cost:
+    Bytes that were charged for the pending file
+  """
+  i, src, dst, target, future, cost = pending.popleft()
 
-        if root and not subdir(root, src_abs, check = False):
-          # TODO: specialize error message for symlinks?
-          raise FileOutsideRootError(
-            f"Must have common path with root:\n  file = \"{src_abs}\"\n  root = \"{root}\"")
+  with validating(key = i):
 
-        copy_history.add((src, dst))
+    if target is not None:
+      dist.write_link(dst, target, mode = src.stat().st_mode)
+      return cost
 
-        if len(copy_history) == num_copies:
-          # ignore exactly duplicate copy operations
-          continue
+    if future is None:
+      dist.copyfile(
+        src = src,
+        dst = dst,
+        mode = src.stat().st_mode)
 
-        num_copies = len(copy_history)
+      return cost
 
-        if not follow_symlinks and src.is_symlink():
-          target = Path(os.readlink(src))
+    data, st, digest = future.result()
 
-          # if not target.is_absolute():
-          #   # ensure minimal path within distribution
-          #   target = resolve(src/target)
+    if data is None:
+      # too large to be read ahead
+      dist.copyfile(
+        src = src,
+        dst = dst,
+        mode = st.st_mode)
 
-          # target = target.relative_to(src)
+      return cost
 
-          dist.write_link(dst, target, mode = src.stat().st_mode)
+    dist.logger.debug(f'copyfile {src} -> {dst}')
 
-        elif src.is_dir():
-          raise AssertionError("dist_iter should not yield directories")
+    dist.write(
+      dst = dst,
+      data = data,
+      mode = st.st_mode,
+      digest = digest)
 
-        else:
-          dist.copyfile(
-            src = src,
-            dst = dst,
-            mode = src.stat().st_mode)
+  return cost
@@ -22,6 +22,12 @@ class dist_source_targz( dist_targz ):
     My be the same as outdir.
   logger : None | :class:`logging.Logger`
     Logger to use.
+  compresslevel : int
+    Gzip compression level, from 0 (none) to 9 (best).
+  workers : int
+    Number of threads used to compress the file.
+  hash_cache : None | :class:`HashCache <partis.pyproj.cache.HashCache>`
+    Cache of hashes of copied files.
 
   Example
   -------
@@ -68,7 +74,10 @@ class dist_source_targz( dist_targz ):
     pkg_info,
     outdir = None,
     tmpdir = None,
-    logger = None ):
+    logger = None,
+    compresslevel = 9,
+    workers = 1,
+    hash_cache = None ):
 
     if not isinstance( pkg_info, PkgInfo ):
       raise ValueError(f"pkg_info must be instance of PkgInfo: {pkg_info}")
@@ -88,6 +97,9 @@ class dist_source_targz( dist_targz ):
       outdir = outdir,
       tmpdir = tmpdir,
       logger = logger,
+      compresslevel = compresslevel,
+      workers = workers,
+      hash_cache = hash_cache,
       named_dirs = {
         'root' : self.base_path,
         'metadata' : self.metadata_path } )
@@ -3,15 +3,170 @@ import os
 from pathlib import (
   Path,
   PurePosixPath)
-import io
-import tempfile
-import shutil
 import tarfile
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .dist_base import dist_base
+from ..file import (
+  create_tempfile,
+  replace_file )
 from ..norms import (
   norm_path,
-  norm_data,
-  norm_mode )
+  norm_stream,
+  norm_mode,
+  norm_workers,
+  HashReader )
+
+# size of (uncompressed) blocks compressed independently by worker threads
+GZIP_BLOCKSIZE = 2**17
+# size of the preceding data used as the dictionary to compress each block
+GZIP_DICTSIZE = 2**15
+
+#===============================================================================
+def gzip_compress_block(
+    data: bytes,
+    zdict: bytes,
+    compresslevel: int,
+    last: bool) -> bytes:
+  """Compresses one block of a gzip member as a raw deflate stream
+
+  Each block ends on a byte boundary (``Z_SYNC_FLUSH``), so that consecutive
+  blocks may be concatenated into a single deflate stream, and only the last
+  block is terminated (``Z_FINISH``).
+  The tail of the preceding data is used as the dictionary, which gives nearly
+  the same compression as compressing the data as a single stream.
+  """
+  if zdict:
+    compressor = zlib.compressobj(
+      compresslevel, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY,
+      zdict)
+  else:
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+
+  return compressor.compress(data) + compressor.flush(
+    zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+#===============================================================================
+class ParallelGzipWriter:
+  """Write-only file object that gzip compresses blocks in a pool of threads
+
+  The data is split into blocks of :data:`GZIP_BLOCKSIZE`, which are compressed
+  concurrently and written in order as a single gzip member (similar to ``pigz``).
+  The output does not depend on the number of workers, and the header does not
+  contain a filename or modification time.
+
+  Parameters
+  ----------
+  fileobj:
+    Binary file to write the compressed data, which is not closed by :meth:`close`.
+  compresslevel:
+  workers:
+    Number of threads used to compress blocks.
+  """
+  #-----------------------------------------------------------------------------
+  def __init__(self,
+    fileobj,
+    compresslevel: int = 9,
+    workers: int = 1):
+
+    self.fileobj = fileobj
+    self.compresslevel = compresslevel
+    self.workers = norm_workers(workers)
+    self.closed = False
+
+    self._executor = ThreadPoolExecutor(max_workers = self.workers)
+    self._pending = deque()
+    self._buf = bytearray()
+    self._zdict = b''
+    self._crc = 0
+    self._size = 0
+
+    if compresslevel == 9:
+      xfl = 2
+    elif compresslevel == 1:
+      xfl = 4
+    else:
+      xfl = 0
+
+    # magic, deflate, no flags, no mtime, extra flags, unknown OS
+    self.fileobj.write(struct.pack('<BBBBLBB', 0x1f, 0x8b, 8, 0, 0, xfl, 255))
+
+  #-----------------------------------------------------------------------------
+  def write(self, data) -> int:
+    if self.closed:
+      raise ValueError("write to closed file")
+
+    data = memoryview(data).cast('B')
+    self._crc = zlib.crc32(data, self._crc)
+    self._size += len(data)
+    self._buf += data
+
+    # NOTE: the last block is held back until closed, since it must be terminated
+    while len(self._buf) > GZIP_BLOCKSIZE:
+      block = bytes(self._buf[:GZIP_BLOCKSIZE])
+      del self._buf[:GZIP_BLOCKSIZE]
+      self._submit(block, last = False)
+
+    return len(data)
+
+  #-----------------------------------------------------------------------------
+  def tell(self) -> int:
+    return self._size
+
+  #-----------------------------------------------------------------------------
+  def close(self):
+    if self.closed:
+      return
+
+    self.closed = True
+
+    try:
+      self._submit(bytes(self._buf), last = True)
+      self._buf = bytearray()
+
+      while self._pending:
+        self._write_next()
+
+      self.fileobj.write(struct.pack(
+        '<LL',
+        self._crc,
+        self._size & 0xffffffff))
+
+    finally:
+      for future in self._pending:
+        future.cancel()
+
+      self._pending.clear()
+      self._executor.shutdown(wait = True)
+
+  #-----------------------------------------------------------------------------
+  def _submit(self, block, last):
+    self._pending.append(self._executor.submit(
+      gzip_compress_block,
+      block,
+      self._zdict,
+      self.compresslevel,
+      last))
+
+    self._zdict = (self._zdict + block)[-GZIP_DICTSIZE:]
+
+    # bound the number of blocks held in memory
+    while len(self._pending) > 2*self.workers:
+      self._write_next()
+
+  #-----------------------------------------------------------------------------
+  def _write_next(self):
+    self.fileobj.write(self._pending.popleft().result())
+
+  #-----------------------------------------------------------------------------
+  def __enter__(self):
+    return self
+
+  #-----------------------------------------------------------------------------
+  def __exit__(self, type, value, traceback):
+    self.close()
 
 #===============================================================================
 class dist_targz( dist_base ):
@@ -48,6 +203,10 @@ class dist_targz( dist_base ):
           src = pkg_dir,
           dst = 'my_package' )
 
+  Note
+  ----
+  If ``workers > 1``, the tar stream is compressed in blocks by a pool of
+  threads using :class:`ParallelGzipWriter`.
 
   """
 
@@ -57,7 +216,10 @@ class dist_targz( dist_base ):
     outdir = None,
     tmpdir = None,
     named_dirs = None,
-    logger = None ):
+    logger = None,
+    compresslevel: int = 9,
+    workers: int = 1,
+    hash_cache = None ):
 
     tmpdir = Path(tmpdir) if tmpdir else None
 
@@ -66,26 +228,50 @@ class dist_targz( dist_base ):
       outdir = outdir,
       tmpdir = tmpdir,
       named_dirs = named_dirs,
-      logger = logger )
+      logger = logger,
+      hash_cache = hash_cache )
+
+    self.compresslevel = compresslevel
+    self.workers = norm_workers(workers)
 
     self._fd = None
     self._fp = None
+    self._gz = None
     self._tmp_path = None
     self._tarfile = None
+    # index of members added to the tar file, since TarFile.getmember is a linear search
+    self._members = dict()
   #-----------------------------------------------------------------------------
   def create_distfile( self ):
 
-    ( self._fd, self._tmp_path ) = tempfile.mkstemp(
-      dir = self.tmpdir )
+    # NOTE: by default the temporary file is created in the output directory,
+    # so that the final file may be moved into place instead of copied
+    tmpdir = self.tmpdir or self.outdir
+    tmpdir.mkdir(parents = True, exist_ok = True)
 
-    self._tmp_path = Path(self._tmp_path)
+    ( self._fd, self._tmp_path ) = create_tempfile(
+      tmpdir,
+      prefix = f'.{self.outname}.' )
 
     self._fp = os.fdopen( self._fd, "w+b" )
 
-    self._tarfile = tarfile.open(
-      fileobj = self._fp,
-      mode = 'w:gz',
-      format = tarfile.PAX_FORMAT )
+    if self.workers > 1:
+      self._gz = ParallelGzipWriter(
+        self._fp,
+        compresslevel = self.compresslevel,
+        workers = self.workers )
+
+      self._tarfile = tarfile.open(
+        fileobj = self._gz,
+        mode = 'w',
+        format = tarfile.PAX_FORMAT )
+
+    else:
+      self._tarfile = tarfile.open(
+        fileobj = self._fp,
+        mode = 'w:gz',
+        compresslevel = self.compresslevel,
+        format = tarfile.PAX_FORMAT )
 
 
   #-----------------------------------------------------------------------------
@@ -97,6 +283,10 @@ class dist_targz( dist_base ):
       self._tarfile.close()
       self._tarfile = None
 
+    if self._gz is not None:
+      self._gz.close()
+      self._gz = None
+
     if self._fp is not None:
       self._fp.close()
       self._fp = None
@@ -109,13 +299,10 @@ class dist_targz( dist_base ):
     if not self._tmp_path:
       return
 
-    # overwiting in destination directory
-    if self.outpath.exists():
-      # NOTE: the missing_ok parameter was not added until py38
-      self.outpath.unlink()
-
     self.outdir.mkdir(parents = True, exist_ok = True)
-    shutil.copyfile( self._tmp_path, self.outpath )
+    # atomically replaces any existing file, or copied if tmpdir is on another device
+    replace_file( self._tmp_path, self.outpath )
+    self._tmp_path = None
 
   #-----------------------------------------------------------------------------
   def remove_distfile( self ):
@@ -134,35 +321,60 @@ class dist_targz( dist_base ):
     data: bytes,
     mode: int|None = None,
     exist_ok: bool = False,
-    record: bool = True):
+    record: bool = True,
+    digest: tuple[str, int]|None = None) -> tuple[str, int]:
 
     self.assert_open()
 
     dst = norm_path(dst)
-    data = norm_data(data)
+    stream, size = norm_stream(data)
+
+    if record and PurePosixPath(dst) in self.records:
+      # NOTE: comparing to the existing record requires the hash before writing,
+      # costing a second pass over the data in this (uncommon) case
+      start = stream.tell()
 
-    if record:
       rec = self.record(
         dst = dst,
-        data = data,
-        exist_ok = exist_ok)
+        data = stream,
+        exist_ok = exist_ok,
+        digest = digest)
 
       if rec is None:
         # equivalent file has already been added
-        return
+        return self.records[PurePosixPath(dst)]
 
-    elif not exist_ok and self.exists( dst ):
+      stream.seek(start)
+      digest = rec
+      record = False
+
+    elif not record and not exist_ok and self.exists( dst ):
       # NOTE: can only skip equivalent files when they are recorded
       raise ValueError(f"Overwriting destination: {dst}")
 
     info = tarfile.TarInfo(dst)
 
-    info.size = len(data)
+    info.size = size
     info.mode = norm_mode( mode )
 
+    # unless already known, data is hashed in the same pass that it is copied
+    # into the archive
+    reader = stream if digest else HashReader(stream)
+
     self._tarfile.addfile(
       info,
-      fileobj = io.BytesIO(data) )
+      fileobj = reader )
+
+    self._members[info.name] = info
+    digest = digest or reader.digest()
+
+    if record:
+      self.record(
+        dst = dst,
+        digest = digest,
+        exist_ok = exist_ok)
+
+    return digest
 
   #-----------------------------------------------------------------------------
   def write_link( self,
@@ -198,6 +410,8 @@ class dist_targz( dist_base ):
     info.linkname = target
     self._tarfile.addfile(info)
 
+    self._members[info.name] = info
+
   #-----------------------------------------------------------------------------
   def finalize( self ): # pragma: no cover
     pass
@@ -208,8 +422,4 @@ class dist_targz( dist_base ):
 
     self.assert_open()
 
-    try:
-      self._tarfile.getmember(os.fspath(dst))
-      return True
-    except KeyError as e:
-      return False
+    return os.fspath(dst).rstrip('/') in self._members
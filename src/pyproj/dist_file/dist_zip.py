@@ -1,17 +1,215 @@
 from __future__ import annotations
 import os
+import sys
 from pathlib import (
   Path,
   PurePosixPath)
-import tempfile
-import shutil
+from io import BytesIO
 import zipfile
+import zlib
 import stat
+import struct
+from collections import deque
+from concurrent.futures import (
+  Future,
+  ThreadPoolExecutor )
 from .dist_base import dist_base
+from ..file import (
+  create_tempfile,
+  replace_file )
+from ..path import PathFilter
 from ..norms import (
   norm_path,
-  norm_data,
-  norm_zip_external_attr )
+  norm_stream,
+  norm_workers,
+  norm_zip_external_attr,
+  hash_sha256,
+  HashReader )
+
+# size of chunks read from streams while writing into the archive
+BUFSIZE = 2**16
+# largest entry compressed by a worker thread, larger entries are streamed
+PARALLEL_MAX_SIZE = 2**22
+# upper bound of (uncompressed) bytes held in memory for each worker thread
+PARALLEL_BUFSIZE = 2**23
+# entries are stored (not compressed) if the sample does not compress below this ratio
+DETECT_RATIO = 0.9
+# range of Python versions for which the private state of a ZipFile is known to be
+# updated by :func:`zip_write_compressed` the same as by ``ZipFile.open(mode='w')``
+ZIP_RAW_PYTHON = ((3, 8), (3, 14))
+
+#===============================================================================
+def zip_raw_supported() -> bool:
+  """Whether already compressed members may be appended to a zip file by
+  :func:`zip_write_compressed`, and read by :func:`zip_seek_compressed`
+
+  If not, members are only written through ``ZipFile.open``, which excludes
+  compressing members in parallel and copying them from a previous zip file.
+  """
+  if not ZIP_RAW_PYTHON[0] <= sys.version_info[:2] <= ZIP_RAW_PYTHON[1]:
+    return False
+
+  with zipfile.ZipFile(BytesIO(), mode = 'w') as zf:
+    return all(
+      hasattr(zf, k)
+      for k in ('_writing', '_writecheck', '_didModify', 'start_dir', 'fp', 'filelist', 'NameToInfo'))
+
+ZIP_RAW = zip_raw_supported()
+# settings for which a warning was already logged that they are ignored
+_zip_raw_warned = set()
+
+#===============================================================================
+def zip_compress(
+    data: bytes,
+    compress_type: int = zipfile.ZIP_DEFLATED,
+    compresslevel: int|None = None) -> tuple[int, bytes]:
+  """Compresses data for a zip archive member
+
+  The output is identical to that produced by :class:`zipfile.ZipFile` for the
+  same ``compress_type`` and ``compresslevel``.
+
+  Returns
+  -------
+  crc:
+    CRC-32 of the uncompressed data
+  data:
+    Compressed data
+  """
+
+  crc = zlib.crc32(data)
+
+  if compress_type == zipfile.ZIP_STORED:
+    return crc, data
+
+  if compress_type != zipfile.ZIP_DEFLATED:
+    raise NotImplementedError(f"Compression type not supported: {compress_type}")
+
+  if compresslevel is None:
+    compresslevel = zlib.Z_DEFAULT_COMPRESSION
+
+  # NOTE: negative window bits for a raw deflate stream, same as zipfile
+  compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+
+  return crc, compressor.compress(data) + compressor.flush()
+
+#===============================================================================
+def zip_level(zinfo: zipfile.ZipInfo) -> int|None:
+  """Compression level of a member, 0 if stored (not compressed), or None for
+  the default level of its ``compress_type``
+  """
+  if zinfo.compress_type == zipfile.ZIP_STORED:
+    return 0
+
+  return zinfo._compresslevel
+
+#===============================================================================
+def zip_write_compressed(
+    zf: zipfile.ZipFile,
+    zinfo: zipfile.ZipInfo,
+    crc: int,
+    file_size: int,
+    data: bytes,
+    compress_size: int|None = None):
+  """Appends an already compressed member to a zip file being written
+
+  This follows the same steps as writing a member with ``ZipFile.open(mode='w')``
+  to a seekable file, but without passing the data through the compressor.
+
+  Parameters
+  ----------
+  zf:
+    Zip file open for writing
+  zinfo:
+    Member info, with ``compress_type`` matching the compressed data
+  crc:
+    CRC-32 of the uncompressed data
+  file_size:
+    Size of the uncompressed data
+  data:
+    Compressed data, or a readable binary stream of compressed data
+  compress_size:
+    Number of bytes to copy if ``data`` is a stream
+
+  Note
+  ----
+  Only supported if :data:`ZIP_RAW`, since this depends on private attributes
+  of :class:`zipfile.ZipFile`.
+  """
+  if not ZIP_RAW:
+    raise NotImplementedError(
+      f"Writing compressed data not supported by zipfile of Python {sys.version}")
+
+  if zf._writing:
+    raise ValueError(
+      "Can't write to the ZIP file while there is another write handle open on it.")
+
+  zinfo.flag_bits = 0x00
+  zinfo.CRC = crc
+  zinfo.file_size = file_size
+  zinfo.compress_size = len(data) if compress_size is None else compress_size
+
+  zip64 = file_size * 1.05 > zipfile.ZIP64_LIMIT
+
+  if not zip64 and zinfo.compress_size > zipfile.ZIP64_LIMIT:
+    raise RuntimeError(f"Compressed size too large: {zinfo.filename}")
+
+  zf.fp.seek(zf.start_dir)
+  zinfo.header_offset = zf.fp.tell()
+
+  zf._writecheck(zinfo)
+  zf._didModify = True
+
+  zf.fp.write(zinfo.FileHeader(zip64))
+
+  if compress_size is None:
+    zf.fp.write(data)
+
+  else:
+    remaining = compress_size
+
+    while remaining > 0:
+      _data = data.read(min(remaining, BUFSIZE))
+
+      if not _data:
+        raise EOFError(f"Compressed data truncated: {zinfo.filename}")
+
+      zf.fp.write(_data)
+      remaining -= len(_data)
+
+  zf.start_dir = zf.fp.tell()
+  zf.filelist.append(zinfo)
+  zf.NameToInfo[zinfo.filename] = zinfo
+
+#===============================================================================
+def zip_seek_compressed(
+    zf: zipfile.ZipFile,
+    zinfo: zipfile.ZipInfo):
+  """Positions the file of a zip opened for reading at the start of the
+  compressed data of a member
+
+  Returns
+  -------
+  fp:
+    The underlying file of ``zf``, from which ``zinfo.compress_size`` bytes of
+    compressed data may be read.
+  """
+  if not ZIP_RAW:
+    raise NotImplementedError(
+      f"Reading compressed data not supported by zipfile of Python {sys.version}")
+
+  fp = zf.fp
+  fp.seek(zinfo.header_offset)
+  header = fp.read(zipfile.sizeFileHeader)
+
+  if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+    raise zipfile.BadZipFile(f"Bad local file header: {zinfo.filename}")
+
+  # NOTE: the lengths of the name and extra fields in the local header may differ
+  # from those in the central directory
+  name_len, extra_len = struct.unpack('<HH', header[26:30])
+  fp.seek(zinfo.header_offset + zipfile.sizeFileHeader + name_len + extra_len)
+
+  return fp
 
 #===============================================================================
 class dist_zip( dist_base ):
@@ -48,6 +246,27 @@ class dist_zip( dist_base ):
           src = pkg_dir,
           dst = 'my_package' )
 
+  Note
+  ----
+  If ``workers > 1``, entries are compressed concurrently in a pool of threads
+  and appended to the archive in the order they were written, so that the
+  resulting file is identical to one compressed serially.
+  Entries larger than :data:`PARALLEL_MAX_SIZE` are still streamed
+  serially, and the total size of entries waiting to be appended is bounded by
+  ``workers *`` :data:`PARALLEL_BUFSIZE`.
+
+  The compression of each entry is selected by the last of ``compress_rules``
+  with a matching pattern, with level ``0`` storing the entry without compression.
+  Patterns follow the same format as ``ignore`` patterns, relative to the root of
+  the archive.
+  If no rule matches and ``compress_detect`` is true, the first :data:`BUFSIZE`
+  bytes of the entry are compressed (at level 1) as a sample, and the entry is
+  stored if the sample does not compress below :data:`DETECT_RATIO`.
+
+  After calling :meth:`reuse` with a previous zip file, entries having the same
+  name, hash, and compression type as in the previous file are copied without
+  being compressed again.
+
   """
 
   #-----------------------------------------------------------------------------
@@ -56,27 +275,55 @@ class dist_zip( dist_base ):
     outdir = None,
     tmpdir = None,
     named_dirs = None,
-    logger = None ):
+    logger = None,
+    workers: int = 1,
+    compresslevel: int|None = None,
+    compress_rules: list[tuple[list[str], int]]|None = None,
+    compress_detect: bool = False,
+    hash_cache = None ):
 
     super().__init__(
       outname = outname,
       outdir = outdir,
       tmpdir = tmpdir,
       named_dirs = named_dirs,
-      logger = logger )
+      logger = logger,
+      hash_cache = hash_cache )
+
+    self.workers = norm_workers(workers)
+    self.compresslevel = compresslevel
+    self.compress_rules = [
+      (PathFilter(patterns), level)
+      for patterns, level in (compress_rules or []) ]
+    self.compress_detect = bool(compress_detect)
 
     self._fd = None
     self._fp = None
     self._tmp_path = None
     self._zipfile = None
+    self._executor = None
+    # entries being compressed by workers, in the order they must be appended
+    self._pending = deque()
+    self._pending_names = dict()
+    self._pending_size = 0
+    # previous zip file from which compressed entries may be copied
+    self._previous = None
+    self._previous_records = dict()
+    self._previous_levels = dict()
+    # compression level each member was written with
+    self.compress_levels = dict()
 
   #-----------------------------------------------------------------------------
   def create_distfile( self ):
 
-    ( self._fd, self._tmp_path ) = tempfile.mkstemp(
-      dir = self.tmpdir )
+    # NOTE: by default the temporary file is created in the output directory,
+    # so that the final file may be moved into place instead of copied
+    tmpdir = self.tmpdir or self.outdir
+    tmpdir.mkdir(parents = True, exist_ok = True)
 
-    self._tmp_path = Path(self._tmp_path)
+    ( self._fd, self._tmp_path ) = create_tempfile(
+      tmpdir,
+      prefix = f'.{self.outname}.' )
 
     self._fp = os.fdopen( self._fd, "w+b" )
 
@@ -85,9 +332,53 @@ class dist_zip( dist_base ):
       mode = "w",
       compression = zipfile.ZIP_DEFLATED )
 
+    # NOTE: members compressed by workers are appended by zip_write_compressed
+    if self.workers > 1:
+      if ZIP_RAW:
+        self._executor = ThreadPoolExecutor(
+          max_workers = self.workers,
+          thread_name_prefix = type(self).__name__ )
+      else:
+        self.warn_zip_raw('workers')
+
+  #-----------------------------------------------------------------------------
+  def warn_zip_raw( self, setting: str ):
+    """Logs a warning, once per process, that a setting is ignored since
+    :data:`ZIP_RAW` is not supported
+    """
+    if setting in _zip_raw_warned:
+      return
+
+    _zip_raw_warned.add(setting)
+
+    self.logger.warning(
+      f"Ignoring '{setting}', not supported by zipfile of Python {sys.version}")
+
   #-----------------------------------------------------------------------------
   def close_distfile( self ):
 
+    try:
+      if self.finalized:
+        self.flush()
+
+    finally:
+      for zinfo, future in self._pending:
+        future.cancel()
+
+      if self._executor is not None:
+        self._executor.shutdown(wait = True)
+        self._executor = None
+
+      self._pending.clear()
+      self._pending_names.clear()
+      self._pending_size = 0
+
+      if self._previous is not None:
+        self._previous.close()
+        self._previous = None
+        self._previous_records = dict()
+        self._previous_levels = dict()
+
     if self._zipfile is not None:
 
       # close the file
@@ -106,13 +397,10 @@ class dist_zip( dist_base ):
     if not self._tmp_path:
       return
 
-    # overwiting in destination directory
-    if self.outpath.exists():
-      # NOTE: the missing_ok parameter was not added until py38
-      self.outpath.unlink()
-
-    self.outdir.mkdir(parents = True, exist_ok = True )
-    shutil.copyfile( self._tmp_path, self.outpath )
+    self.outdir.mkdir(parents = True, exist_ok = True)
+    # atomically replaces any existing file, or copied if tmpdir is on another device
+    replace_file( self._tmp_path, self.outpath )
+    self._tmp_path = None
 
   #-----------------------------------------------------------------------------
   def remove_distfile( self ):
@@ -131,36 +419,65 @@ class dist_zip( dist_base ):
     data,
     mode: int|None = None,
     exist_ok: bool = False,
-    record: bool = True):
+    record: bool = True,
+    digest: tuple[str, int]|None = None) -> tuple[str, int]:
 
     self.assert_open()
 
     dst = norm_path( os.fspath(dst) )
 
-    data = norm_data( data )
+    stream, size = norm_stream( data )
+
+    if record and PurePosixPath(dst) in self.records:
+      # NOTE: comparing to the existing record requires the hash before writing,
+      # costing a second pass over the data in this (uncommon) case
+      start = stream.tell()
 
-    if record:
       rec = self.record(
         dst = dst,
-        data = data,
-        exist_ok = exist_ok)
+        data = stream,
+        exist_ok = exist_ok,
+        digest = digest)
 
       if rec is None:
         # equivalent file has already been added
-        return
+        return self.records[PurePosixPath(dst)]
 
-    elif not exist_ok and self.exists( dst ):
+      stream.seek(start)
+      digest = rec
+      record = False
+
+    elif not record and not exist_ok and self.exists( dst ):
       # NOTE: can only skip equivalent files when they are recorded
       raise ValueError(f"Overwriting destination: {dst}")
 
     zinfo = zipfile.ZipInfo( dst )
 
     zinfo.external_attr = norm_zip_external_attr( mode )
+    self.compress_zinfo( zinfo, stream )
 
-    self._zipfile.writestr(
-      zinfo,
-      data,
-      compress_type = zipfile.ZIP_DEFLATED )
+    if (previous := self._previous_records.get(dst)) is not None:
+      if digest is None:
+        start = stream.tell()
+        digest = hash_sha256( stream )
+        stream.seek( start )
+
+      if tuple(digest) == previous and self.copy_previous( zinfo ):
+        self.logger.debug(f'reused {dst}')
+
+      else:
+        digest = self.write_zinfo( zinfo, stream, size, digest = digest )
+
+    else:
+      digest = self.write_zinfo( zinfo, stream, size, digest = digest )
+
+    if record:
+      self.record(
+        dst = dst,
+        digest = digest,
+        exist_ok = exist_ok)
+
+    return digest
 
   #-----------------------------------------------------------------------------
   def write_link( self,
@@ -194,7 +511,249 @@ class dist_zip( dist_base ):
     zinfo = zipfile.ZipInfo(dst)
     zinfo.external_attr = norm_zip_external_attr(mode, islink = True)
 
-    self._zipfile.writestr(zinfo, data, compress_type = zipfile.ZIP_DEFLATED)
+    stream = BytesIO(data)
+    self.compress_zinfo(zinfo, stream)
+
+    self.write_zinfo(zinfo, stream, len(data))
+
+  #-----------------------------------------------------------------------------
+  def compress_zinfo( self,
+    zinfo: zipfile.ZipInfo,
+    stream = None ):
+    """Sets the compression of a member according to the compression rules
+
+    Parameters
+    ----------
+    zinfo:
+      Member info, with the ``filename`` used to match ``compress_rules``
+    stream:
+      Seekable binary stream of member data, sampled if ``compress_detect`` is
+      true and no rule matches. The position of the stream is restored.
+    """
+
+    level = None
+    path = PurePosixPath(zinfo.filename)
+
+    for rule, _level in self.compress_rules:
+      if rule.filter(path.parent, [path.name], dnames = []):
+        level = _level
+
+    if level is None:
+      level = self.compresslevel
+
+      if self.compress_detect and stream is not None:
+        start = stream.tell()
+        sample = stream.read( BUFSIZE )
+        stream.seek( start )
+
+        if sample:
+          crc, _sample = zip_compress( sample, compresslevel = 1 )
+
+          if len(_sample) > DETECT_RATIO * len(sample):
+            level = 0
+
+    if level == 0:
+      zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+      zinfo.compress_type = zipfile.ZIP_DEFLATED
+      zinfo._compresslevel = level
+
+  #-----------------------------------------------------------------------------
+  def write_zinfo( self,
+    zinfo: zipfile.ZipInfo,
+    stream,
+    size: int,
+    digest: tuple[str, int]|None = None ) -> tuple[str, int]:
+    """Writes a member into the zip file, or queues it to be compressed by a
+    worker thread
+
+    Parameters
+    ----------
+    zinfo:
+      Member info, including the ``compress_type``
+    stream:
+      Readable binary stream of member data
+    size:
+      Number of bytes to be read from ``stream``
+    digest:
+      If given, the already known ``(hash, size)`` of the data, which is then
+      not hashed again.
+
+    Returns
+    -------
+    The ``(hash, size)`` of the data, as returned by
+    :func:`hash_sha256 <partis.pyproj.norms.hash_sha256>`
+    """
+
+    # NOTE: the expected size determines whether zip64 extensions are needed
+    zinfo.file_size = size
+    self.compress_levels[zinfo.filename] = zip_level(zinfo)
+
+    # unless already known, data is hashed in the same pass that it is read
+    # into the archive
+    reader = stream if digest else HashReader(stream)
+
+    if self._executor is not None and size <= PARALLEL_MAX_SIZE:
+      data = reader.read()
+
+      future = self._executor.submit(
+        zip_compress,
+        data,
+        zinfo.compress_type,
+        zinfo._compresslevel )
+
+      self._queue( zinfo, future )
+
+      return digest or reader.digest()
+
+    # any pending entries must be appended first to preserve the order
+    self.flush()
+
+    with self._zipfile.open( zinfo, mode = 'w' ) as fp:
+      while _data := reader.read( BUFSIZE ):
+        fp.write( _data )
+
+    return digest or reader.digest()
+
+  #-----------------------------------------------------------------------------
+  def reuse( self,
+    path: Path,
+    records: dict[PurePosixPath, tuple[str, int]],
+    levels: dict[PurePosixPath, int|None] ) -> bool:
+    """Reuse compressed entries from a previous zip file
+
+    Parameters
+    ----------
+    path:
+      Previous zip file, which is kept open until this file is closed
+    records:
+      Mapping of path to ``(hash, size)`` of the data of entries in the previous file.
+      Only entries in ``records`` may be reused.
+    levels:
+      Mapping of path to the compression level entries in the previous file were
+      written with (see :attr:`compress_levels`). Only entries compressed with the
+      same level as they would be now are reused.
+
+    Returns
+    -------
+    False if entries cannot be reused (see :data:`ZIP_RAW`), else True
+    """
+    if self._zipfile is None:
+      raise ValueError("distribution file is not open")
+
+    if not ZIP_RAW:
+      self.warn_zip_raw('incremental')
+      return False
+
+    if self._previous is not None:
+      self._previous.close()
+
+    self._previous = zipfile.ZipFile( path )
+    self._previous_records = {
+      os.fspath(k): tuple(v)
+      for k, v in records.items() }
+    self._previous_levels = {
+      os.fspath(k): v
+      for k, v in levels.items() }
+
+    return True
+
+  #-----------------------------------------------------------------------------
+  def copy_previous( self,
+    zinfo: zipfile.ZipInfo ) -> bool:
+    """Copies the compressed data of an entry from the previous zip file
+
+    Parameters
+    ----------
+    zinfo:
+      Member info of the new entry, including the ``compress_type``
+
+    Returns
+    -------
+    True if the entry was copied, or False if there is no compatible entry
+    (or copying is not supported, see :data:`ZIP_RAW`)
+    """
+    if not ZIP_RAW:
+      return False
+
+    try:
+      previous = self._previous.getinfo( zinfo.filename )
+    except KeyError:
+      return False
+
+    if previous.compress_type != zinfo.compress_type or previous.flag_bits & 0x01:
+      # different compression, or encrypted
+      return False
+
+    level = zip_level( zinfo )
+
+    if self._previous_levels.get( zinfo.filename, -1 ) != level:
+      # different (or unknown) compression level
+      return False
+
+    zinfo.file_size = previous.file_size
+    self.compress_levels[zinfo.filename] = level
+    fp = zip_seek_compressed( self._previous, previous )
+
+    if self._executor is not None and previous.compress_size <= PARALLEL_MAX_SIZE:
+      # NOTE: must still be appended in order with entries pending compression
+      future = Future()
+      future.set_result(( previous.CRC, fp.read( previous.compress_size ) ))
+      self._queue( zinfo, future )
+      return True
+
+    self.flush()
+
+    zip_write_compressed(
+      self._zipfile,
+      zinfo,
+      crc = previous.CRC,
+      file_size = previous.file_size,
+      data = fp,
+      compress_size = previous.compress_size )
+
+    return True
+
+  #-----------------------------------------------------------------------------
+  def _queue( self,
+    zinfo: zipfile.ZipInfo,
+    future: Future ):
+    """Queue an entry to be appended after being compressed by a worker thread
+    """
+    name = zinfo.filename
+    self._pending.append((zinfo, future))
+    self._pending_names[name] = self._pending_names.get(name, 0) + 1
+    self._pending_size += zinfo.file_size
+
+    while self._pending_size > self.workers * PARALLEL_BUFSIZE:
+      self._flush_next()
+
+  #-----------------------------------------------------------------------------
+  def flush( self ):
+    """Appends all entries pending compression by worker threads
+    """
+    while self._pending:
+      self._flush_next()
+
+  #-----------------------------------------------------------------------------
+  def _flush_next( self ):
+    zinfo, future = self._pending.popleft()
+    crc, data = future.result()
+
+    zip_write_compressed(
+      self._zipfile,
+      zinfo,
+      crc = crc,
+      file_size = zinfo.file_size,
+      data = data )
+
+    self._pending_size -= zinfo.file_size
+
+    name = zinfo.filename
+    count = self._pending_names.pop(name) - 1
+
+    if count:
+      self._pending_names[name] = count
 
 
   #-----------------------------------------------------------------------------
@@ -207,6 +766,9 @@ class dist_zip( dist_base ):
 
     self.assert_open()
 
+    if os.fspath(dst) in self._pending_names:
+      return True
+
     try:
       self._zipfile.getinfo(os.fspath(dst))
       return True
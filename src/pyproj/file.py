@@ -1,5 +1,19 @@
 from __future__ import annotations
 import os
+import errno
+import secrets
+import shutil
+from pathlib import Path
+
+try:
+  import fcntl
+except ImportError: # pragma: no cover
+  fcntl = None
+
+# ioctl request to share the extents of a file, from linux/fs.h
+FICLONE = 0x40049409
+# maximum number of bytes to copy in each call to copy_file_range or sendfile
+COPY_BLOCKSIZE = 2**30
 
 #===============================================================================
 def tail(path, n, bufsize = 1024, encoding = 'utf-8') -> list[str]:
@@ -61,3 +75,153 @@ def tail(path, n, bufsize = 1024, encoding = 'utf-8') -> list[str]:
   lines = res.splitlines()[-n:]
 
   return lines
+
+#===============================================================================
+def create_tempfile(
+    dir: Path,
+    prefix: str = '',
+    suffix: str = '.tmp') -> tuple[int, Path]:
+  """Creates and opens a new file with a unique name
+
+  Unlike :func:`tempfile.mkstemp`, the file is created with the default
+  permissions (subject to the umask), so that it may be moved into place as the
+  final file.
+
+  Returns
+  -------
+  fd:
+    Open (read/write) file descriptor
+  path:
+    Path to the file
+  """
+  dir = Path(dir)
+  flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+  for _ in range(100):
+    path = dir/f"{prefix}{secrets.token_hex(4)}{suffix}"
+
+    try:
+      return os.open(path, flags, 0o666), path
+    except FileExistsError:
+      continue
+
+  raise FileExistsError(errno.EEXIST, "No usable temporary file name found", str(dir))
+
+#===============================================================================
+def copy_fd(fd_src: int, fd_dst: int, size: int):
+  """Copies ``size`` bytes between open files, from the current positions
+
+  Tries, in order, to share extents (reflink ``FICLONE``), ``copy_file_range``,
+  and ``sendfile``, before falling back to copying through a user-space buffer.
+  """
+  if fcntl is not None and os.lseek(fd_src, 0, os.SEEK_CUR) == 0:
+    try:
+      fcntl.ioctl(fd_dst, FICLONE, fd_src)
+      os.lseek(fd_dst, size, os.SEEK_SET)
+      return
+    except OSError:
+      pass
+
+  for func in ['copy_file_range', 'sendfile']:
+    if not hasattr(os, func):
+      continue
+
+    copy = getattr(os, func)
+    copied = 0
+
+    try:
+      while copied < size:
+        if func == 'sendfile':
+          n = copy(fd_dst, fd_src, None, min(size - copied, COPY_BLOCKSIZE))
+        else:
+          n = copy(fd_src, fd_dst, min(size - copied, COPY_BLOCKSIZE))
+
+        if n == 0:
+          break
+
+        copied += n
+
+    except OSError as e:
+      if copied:
+        # NOTE: cannot resume with another method after a partial copy
+        raise
+
+      continue
+
+    if copied == size:
+      return
+
+    # file was truncated while copying
+    raise OSError(errno.EIO, f"Expected to copy {size} bytes, copied {copied}")
+
+  with open(fd_src, 'rb', closefd = False) as fsrc, open(fd_dst, 'wb', closefd = False) as fdst:
+    shutil.copyfileobj(fsrc, fdst)
+
+#===============================================================================
+def replace_file(src: Path, dst: Path):
+  """Moves ``src`` to replace ``dst``, similar to :func:`os.replace`
+
+  If ``src`` and ``dst`` are on different filesystems, the file is copied to a
+  temporary file in the destination directory (see :func:`copy_fd`) before
+  replacing ``dst``, so that ``dst`` is never partially written.
+  """
+  src = Path(src)
+  dst = Path(dst)
+
+  try:
+    os.replace(src, dst)
+    return
+  except OSError as e:
+    if e.errno != errno.EXDEV:
+      raise
+
+  fd_dst, tmp = create_tempfile(dst.parent, prefix = f'.{dst.name}.')
+
+  try:
+    with open(src, 'rb') as fsrc:
+      copy_fd(fsrc.fileno(), fd_dst, os.fstat(fsrc.fileno()).st_size)
+
+    os.close(fd_dst)
+    fd_dst = None
+
+    shutil.copymode(src, tmp)
+    os.replace(tmp, dst)
+
+  except BaseException:
+    if fd_dst is not None:
+      os.close(fd_dst)
+
+    tmp.unlink()
+    raise
+
+  src.unlink()
+
+#===============================================================================
+def clone_file(src: Path, dst: Path):
+  """Copies ``src`` to replace ``dst``, along with its mode and modification time
+
+  The data is shared with ``src`` where supported by the filesystem (see
+  :func:`copy_fd`), and ``dst`` is replaced by a new file (never written in place),
+  so that changes to one do not affect the other.
+  """
+  src = Path(src)
+  dst = Path(dst)
+
+  fd_dst, tmp = create_tempfile(dst.parent, prefix = f'.{dst.name}.')
+
+  try:
+    with open(src, 'rb') as fsrc:
+      copy_fd(fsrc.fileno(), fd_dst, os.fstat(fsrc.fileno()).st_size)
+
+    os.close(fd_dst)
+    fd_dst = None
+
+    shutil.copystat(src, tmp)
+    os.replace(tmp, dst)
+
+  except BaseException:
+    if fd_dst is not None:
+      os.close(fd_dst)
+
+    tmp.unlink()
+    raise
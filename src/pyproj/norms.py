@@ -69,6 +69,44 @@ def norm_bool(val):
 
   return val
 
+#===============================================================================
+def norm_workers(val):
+  """Number of worker threads to use, with ``'auto'`` (or zero) for the number of
+  available CPUs.
+  """
+  if isinstance(val, str):
+    val = val.strip().lower()
+
+    if val != 'auto':
+      val = int(val)
+
+  if val in ('auto', 0):
+    try:
+      val = len(os.sched_getaffinity(0))
+    except AttributeError:
+      val = os.cpu_count() or 1
+
+  val = int(val)
+
+  if val < 1:
+    raise ValidationError(
+      f"Number of workers must be a positive integer or 'auto': {val}")
+
+  return val
+
+#===============================================================================
+def norm_jobs(val):
+  """Total number of jobs, with ``'auto'`` for the number of available CPUs, or
+  zero (or empty) if not limited.
+  """
+  if isinstance(val, str):
+    val = val.strip().lower()
+
+  if val in ('', '0', 0, None):
+    return 0
+
+  return norm_workers(val)
+
 #===============================================================================
 def empty_str(val):
   val = str(val)
@@ -125,6 +163,36 @@ def norm_data(data: str|bytes|IOBase) -> bytes:
 
   return data
 
+#===============================================================================
+def norm_stream(data: str|bytes|IOBase) -> tuple[IOBase, int]:
+  """Normalize data for streaming into a distribution
+
+  Parameters
+  ----------
+  data:
+    Data to process
+
+  Returns
+  -------
+  stream:
+
+    * If data is a stream, it is returned un-modified (assumes seekable).
+    * Otherwise, the result of :func:`norm_data` wrapped in a :class:`io.BytesIO`.
+
+  size:
+    Number of bytes remaining in the stream from its current position.
+  """
+
+  if not isinstance(data, IOBase):
+    data = norm_data(data)
+    return BytesIO(data), len(data)
+
+  start = data.tell()
+  size = data.seek(0, os.SEEK_END) - start
+  data.seek(start)
+
+  return data, size
+
 #===============================================================================
 def norm_path( path: str|pathlib.PurePath, parent_ok: bool = False) -> str:
   """Normalizes a file path for writing into a distribution archive
@@ -324,6 +392,53 @@ def hash_sha256(stream: BytesIO|bytes) -> tuple[str, int]:
 
   return digest_b64_nopad, size
 
+#===============================================================================
+class HashReader:
+  """Wraps a readable binary stream, computing the SHA-256 hash of all data
+  as it is read
+
+  Parameters
+  ----------
+  stream:
+    Stream to read from
+
+  Example
+  -------
+
+  .. code-block:: python
+
+    from io import BytesIO
+    from partis.pyproj import HashReader, hash_sha256
+
+    reader = HashReader(BytesIO(b'abc'))
+
+    while reader.read(2):
+      pass
+
+    print( reader.digest() == hash_sha256(b'abc') )
+
+  """
+  #-----------------------------------------------------------------------------
+  def __init__(self, stream: IOBase):
+    self.stream = stream
+    self.hasher = hashlib.sha256()
+    self.size = 0
+
+  #-----------------------------------------------------------------------------
+  def read(self, size: int = -1) -> bytes:
+    data = self.stream.read(size)
+    self.hasher.update(data)
+    self.size += len(data)
+
+    return data
+
+  #-----------------------------------------------------------------------------
+  def digest(self) -> tuple[str, int]:
+    """urlsafe base64 encoded hash, and size (in bytes) of all data read so far
+    (the same form returned by :func:`hash_sha256`)
+    """
+    return b64_nopad(self.hasher.digest()), self.size
+
 #===============================================================================
 def email_encode_items(
   headers,
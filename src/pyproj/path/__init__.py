@@ -10,6 +10,7 @@ from .pattern import (
   tr_rel_join,
   tr_join,
   tr_subdir,
+  GlobNFA,
   PathPatternError,
   PatternError )
 
@@ -1,7 +1,9 @@
 from __future__ import annotations
 import os.path as osp
 from os import PathLike
-from functools import partial
+from functools import (
+  partial,
+  lru_cache)
 from pathlib import (
   PurePath,
   PureWindowsPath,
@@ -9,14 +11,52 @@ from pathlib import (
 import re
 
 from .pattern import (
+  SEP,
+  GRef,
+  GlobNFA,
   PatternError,
   tr_glob,
   tr_path,
-  tr_rel_join,
+  tr_join,
   tr_subdir)
 from .utils import (
   subdir)
 
+# maximum number of translated patterns (and combined matchers) kept in memory
+PATTERN_CACHE_SIZE = 4096
+# engines available to match patterns, and the default engine
+PATTERN_ENGINES = ('re', 'nfa')
+PATTERN_ENGINE = 're'
+# characters that make a glob pattern not a literal
+rec_special = re.compile(r'[*?[\\]')
+
+#===============================================================================
+@lru_cache(maxsize = PATTERN_CACHE_SIZE)
+def compile_glob(pattern: str, pid: int = 0) -> tuple[re.Pattern, str, tuple[GRef]]:
+  r"""Translates and compiles a glob pattern (see :func:`tr_glob`)
+
+  The results are cached (up to :data:`PATTERN_CACHE_SIZE`), since the same
+  patterns are usually used by many filters.
+
+  Returns
+  -------
+  rec:
+    Compiled regex
+  regex:
+    Translated regex
+  refs:
+    References to the parts of the glob pattern
+  """
+  regex, refs = tr_glob(pattern, pid = pid)
+  return re.compile(regex), regex, tuple(refs)
+
+#===============================================================================
+@lru_cache(maxsize = PATTERN_CACHE_SIZE)
+def compile_glob_nfa(pattern: str) -> GlobNFA:
+  r"""Cached :class:`GlobNFA` of a glob pattern
+  """
+  return GlobNFA(pattern)
+
 #===============================================================================
 class PathMatcher:
   r"""Pattern matching similar to '.gitignore'
@@ -33,6 +73,10 @@ class PathMatcher:
     This pattern is to match relative paths instead of just the base name.
   start:
     If given, paths are translated relative to this sub-directory before matching.
+  engine:
+    How the pattern is matched, either ``'re'`` (translated to a regex), or
+    ``'nfa'`` (:class:`GlobNFA`, linear time in the length of the path).
+    Defaults to :data:`PATTERN_ENGINE`.
 
   Notes
   -----
@@ -92,7 +136,14 @@ class PathMatcher:
     negate: bool = False,
     dironly: bool = False,
     relative: bool = False,
-    start: str|PurePath|None = None):
+    start: str|PurePath|None = None,
+    engine: str|None = None):
+
+    if engine is None:
+      engine = PATTERN_ENGINE
+
+    if engine not in PATTERN_ENGINES:
+      raise ValueError(f"Pattern engine must be one of {PATTERN_ENGINES}: {engine!r}")
 
     pattern = str(pattern).strip()
     _pattern = pattern
@@ -129,9 +180,19 @@ class PathMatcher:
       start = PurePath(start)
 
     self._pattern = _pattern
-    self._pattern_tr, self._pattern_segs = tr_glob(pattern)
-    self._rec = re.compile( self._pattern_tr )
-    self._match = self._rec.match
+    self._glob = pattern
+
+    if engine == 'nfa':
+      self._rec = compile_glob_nfa(pattern)
+      self._pattern_tr = None
+      self._pattern_segs = self._rec.refs
+      self._match = self._rec.match
+
+    else:
+      self._rec, self._pattern_tr, self._pattern_segs = compile_glob(pattern)
+      self._match = self._rec.match
+
+    self.engine = engine
     self._start = None if start is None else tr_path(start)
 
     self.negate = negate
@@ -155,6 +216,9 @@ class PathMatcher:
       if getattr(self, attr):
         args.append(f'{attr} = True')
 
+    if self.engine != PATTERN_ENGINE:
+      args.append(f"engine = {self.engine!r}")
+
     if self.start is not None:
       args.append(f"start = {self.start!r}")
 
@@ -204,6 +268,130 @@ class PathMatcher:
     """
     return self(PurePosixPath(path))
 
+#===============================================================================
+class CombinedMatcher:
+  """Matches a path to the last of several patterns
+
+  Literal patterns (no wildcards) are looked up in a dictionary, and (for
+  base-names) patterns like ``*.ext`` by each suffix of the name starting with
+  '.' (or for other suffixes, like ``*~``, by the suffix of each length). The remaining
+  patterns are combined into one regex as alternatives in reverse order,
+  so that a match is to the last matching pattern, identified by the index of
+  its outer capturing group.
+
+  Parameters
+  ----------
+  globs:
+    List of ``(index, glob, engine)``, in increasing order of index, where each
+    glob is a pattern without the leading "!" or trailing "/"
+    (``PathMatcher._glob``). Patterns with the ``'nfa'`` engine (that are not
+    literals or suffixes) are matched separately by :class:`GlobNFA`.
+  basename:
+    Whether the patterns are matched against base-names, otherwise relative paths.
+  """
+  #-----------------------------------------------------------------------------
+  def __init__(self,
+      globs: list[tuple[int, str, str]],
+      basename: bool = True):
+
+    literals = {}
+    extensions = {}
+    suffixes = {}
+    alts = []
+    nfas = []
+
+    for j, glob, engine in globs:
+      segs = glob.split('/')
+
+      # NOTE: empty segments (e.g. the remaining leading '/' of "//b") are left
+      # to the translated pattern, which does not simply drop them
+      if not rec_special.search(glob) and all(segs):
+        literals[SEP.join(segs)] = j
+
+      elif basename and glob[0] == '*' and not rec_special.search(glob[1:]):
+        suffix = glob[1:]
+
+        if suffix.startswith('.'):
+          # extensions are looked up starting from each '.' in a name
+          extensions[suffix] = j
+        else:
+          suffixes[suffix] = j
+
+      elif engine == 'nfa':
+        nfas.append((j, compile_glob_nfa(glob).match))
+
+      else:
+        # NOTE: each pattern is translated with a unique id, since the names of
+        # the groups it uses must be unique in the combined regex
+        alts.append((j, compile_glob(glob, pid = j)[1]))
+
+    self.literals = literals
+    self.extensions = extensions
+    self.suffixes = suffixes
+    self._suffix_lens = sorted({len(suffix) for suffix in suffixes})
+    # in reverse order, so that the first match is the last matching pattern
+    self._nfas = nfas[::-1]
+    self._match = None
+    self._index = None
+    self._last = -1
+
+    if alts:
+      rec = re.compile('|'.join([f'(?P<m{j}>{regex})' for j, regex in reversed(alts)]))
+      self._match = rec.match
+      self._index = {rec.groupindex[f'm{j}']: j for j, _ in alts}
+      self._last = alts[-1][0]
+
+  #-----------------------------------------------------------------------------
+  def __call__(self, path: str) -> int:
+    """Index of the last pattern matching a path (translated by
+    :func:`tr_path`), or -1 if none match
+    """
+    last = self.literals.get(path, -1)
+
+    if self.extensions:
+      get = self.extensions.get
+      i = path.find('.')
+
+      while i >= 0:
+        if (j := get(path[i:], -1)) > last:
+          last = j
+
+        i = path.find('.', i+1)
+
+    if self._suffix_lens:
+      n = len(path)
+      get = self.suffixes.get
+
+      for k in self._suffix_lens:
+        if k > n:
+          break
+
+        if (j := get(path[n-k:], -1)) > last:
+          last = j
+
+    # NOTE: the regex cannot change the result if a later pattern already matched
+    if last < self._last and (m := self._match(path)):
+      last = max(last, self._index[m.lastindex])
+
+    for j, match in self._nfas:
+      if j <= last:
+        break
+
+      if match(path):
+        last = j
+        break
+
+    return last
+
+#===============================================================================
+@lru_cache(maxsize = PATTERN_CACHE_SIZE)
+def combined_matcher(
+    globs: tuple[tuple[int, str, str]],
+    basename: bool = True) -> CombinedMatcher:
+  r"""Cached :class:`CombinedMatcher`, shared by filters with the same patterns
+  """
+  return CombinedMatcher(globs, basename = basename)
+
 #===============================================================================
 class PathFilter:
   """A combination of file patterns applied relative to a given 'start' directory
@@ -216,11 +404,22 @@ class PathFilter:
     Note that patterns `PathMatcher.start` (if defined) must be relative to
     the `PathFilter.start`. The path actually being tested is equivalent to
     `pattern.match(path.relative_to(filter.start).relative_to(pattern.start))`
+  engine:
+    Engine of patterns given as strings (see :class:`PathMatcher`).
+
+  Note
+  ----
+  The patterns are combined into a single matcher for each distinct path they
+  are matched against (see :class:`CombinedMatcher`), so that each name is
+  tested once and the last matching pattern decides whether it is included
+  (or excluded if negated).
+  The ``patterns`` should not be modified after the filter is created.
   """
   #-----------------------------------------------------------------------------
   def __init__(self,
       patterns: list[str|PathMatcher] = None,
-      start: PathLike|None = None):
+      start: PathLike|None = None,
+      engine: str|None = None):
 
     if patterns is None:
       patterns = []
@@ -229,7 +428,7 @@ class PathFilter:
       patterns = [patterns]
 
     self.patterns = [
-      p if isinstance(p, PathMatcher) else PathMatcher(p)
+      p if isinstance(p, PathMatcher) else PathMatcher(p, engine = engine)
       for p in patterns ]
 
     _start = None
@@ -243,6 +442,7 @@ class PathFilter:
 
     self.start = start
     self._start = _start
+    self._combined = self._combine()
 
   #-----------------------------------------------------------------------------
   def filter(self,
@@ -306,47 +506,102 @@ class PathFilter:
     """Internal method, assumes dir has already been converted to posix, and
     fnames/dnames must be separatly given.
     """
-    # translate relative to filter.start
-    dname_paths = tr_rel_join(self._start, dir, dnames, check=check)
-    fname_paths = tr_rel_join(self._start, dir, fnames, check=check)
-    name_paths = dname_paths + fname_paths
-
     if feasible is None:
       feasible = set()
 
-    #DEBUG print(f"  {self.start}, {dir}")
-    #DEBUG print(f"    fnames: {fname_paths}")
-    #DEBUG print(f"    dnames: {dname_paths}")
+    if not self.patterns:
+      return feasible
+
+    combined = self._combined
 
-    for pattern in self.patterns:
-      # select whether matches add to or remove from existing matches
-      op = feasible.difference if pattern.negate else feasible.union
-      # select whether to match only directories, or all paths
-      _name_paths = dname_paths if pattern.dironly else name_paths
-      match = pattern._match
+    # translate relative to filter.start
+    names = dnames + fnames
+
+    if (rpath := tr_subdir(self._start, dir, check=check)) is None:
+      return feasible
+
+    rel_paths = None
 
-      if pattern.relative:
-        # match full path
-        if (start := pattern._start) is not None:
+    # the last matching pattern of each name, or -1 if no pattern matched
+    last = dict.fromkeys(names, -1)
+
+    for start, rec_dir, rec_file in combined:
+      if start is False:
+        # match only base-name of path
+        name_paths = [(name, name) for name in names]
+
+      else:
+        if rel_paths is None:
+          rel_paths = [(name, tr_join(rpath, name)) for name in names]
+
+        if start is None:
+          # match full path
+          name_paths = rel_paths
+
+        else:
           # translate relative to pattern.start
-          _name_paths = [
+          name_paths = [
             (name, tr_subdir(start, path, check=check))
-            for name, path in _name_paths]
+            for name, path in rel_paths]
 
-        feasible = op({
-          name
-          for name, path in _name_paths
-          if path is not None and match(path)})
-      else:
-        # match only base-name of path
-        feasible = op({ name for name, path in _name_paths if match(name) })
+      num_dirs = len(dnames)
+
+      for i, (name, path) in enumerate(name_paths):
+        if path is None:
+          continue
+
+        j = (rec_dir if i < num_dirs else rec_file)(path)
+
+        if j > last[name]:
+          last[name] = j
+
+    patterns = self.patterns
+    feasible = set(feasible)
 
-      #DEBUG print(f"    - {repr(pattern)} -> {feasible}")
+    for name, j in last.items():
+      if j < 0:
+        continue
+
+      # the last matching pattern determines whether a name is included
+      if patterns[j].negate:
+        feasible.discard(name)
+      else:
+        feasible.add(name)
 
     #DEBUG print(f"    {feasible}")
 
     return feasible
 
+  #-----------------------------------------------------------------------------
+  def _combine(self) -> list[tuple[str|bool|None, CombinedMatcher, CombinedMatcher]]:
+    """Combines the patterns into one matcher for each path they are matched against
+
+    Patterns are grouped by whether they match the base-name (``start = False``),
+    or the path relative to each distinct ``pattern.start``.
+    Directory-only patterns are excluded from the matcher used for files.
+
+    Returns
+    -------
+    combined:
+      List of ``(start, dir_matcher, file_matcher)``
+    """
+    groups = {}
+
+    for j, pattern in enumerate(self.patterns):
+      start = pattern._start if pattern.relative else False
+      groups.setdefault(start, []).append(j)
+
+    return [
+      (start, *[
+        combined_matcher(
+          tuple([
+            (j, self.patterns[j]._glob, self.patterns[j].engine)
+            for j in idx
+            if isdir or not self.patterns[j].dironly]),
+          basename = start is False)
+        for isdir in [True, False]])
+      for start, idx in groups.items()]
+
   #-----------------------------------------------------------------------------
   def __repr__(self):
     return f"{type(self).__name__}({self.patterns}, {self.start!r})"
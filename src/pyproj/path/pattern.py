@@ -476,7 +476,8 @@ def tr_chrset(pat):
     # An expression "[!...]" matches a single character, namely any
     # character that is not matched by the expression obtained by
     # removing the first '!' from it.
-    add('^')
+    # NOTE: like any other set, the complement never matches the separator
+    add('^' + SEP)
     wild = wild[1:]
 
   while wild:
@@ -496,34 +497,20 @@ def tr_chrset(pat):
   return ''.join(parts)
 
 #===============================================================================
-def tr_glob(pat, pid = 0) -> tuple[str, list[GRef]]:
-  """
-  Notes
-  -----
-  * https://man7.org/linux/man-pages/man7/glob.7.html
+def parse_glob(pat) -> tuple[list[tuple[str, str|None]], list[GRef]]:
+  """Splits a glob pattern into its parts
 
+  Returns
+  -------
+  parts:
+    List of ``(case, value)``, where case is one of 'fixed' (value is the
+    unescaped literal), 'sep', 'subdir', 'alldir', 'any', 'chr', or 'chrset'
+    (value is the translated regex character set).
+  refs:
+    References to where each part is in the pattern
   """
-
-  # collapse repeated separators '//...' to single '/'
-  pat = re.sub(r'/+', '/', pat)
-
   refs = []
-
-  if pat == '**':
-    return r'\A.*\Z', refs
-
-  segs = GPath()
-
-  def add(case):
-    if isinstance(case, GSeparator):
-      segs.append(case)
-      return
-
-    if not ( len(segs) and isinstance(segs[-1], GSegment) ):
-      segs.append(GSegment(pid = pid, sid = len(segs)))
-
-    segs[-1].append(case)
-
+  parts = []
 
   i = 0
   m = None
@@ -541,29 +528,27 @@ def tr_glob(pat, pid = 0) -> tuple[str, list[GRef]]:
     refs.append(GRef(m.group(0), d[0], m.start(), m.end()))
 
     if m['fixed']:
-      # NOTE: unescape glob pattern 'escaped' characters before applying re.escape
-      # otherwise they become double-escaped
-      fixed = rec_unescape.sub(r'\1', m['fixed'])
-      add(GFixed(re.escape(fixed)))
+      # NOTE: unescape glob pattern 'escaped' characters
+      parts.append(('fixed', rec_unescape.sub(r'\1', m['fixed'])))
 
     elif m['sep']:
-      add(GSEP)
+      parts.append(('sep', None))
 
     elif m['subdir'] or m['isubdir']:
-      add(GSUBDIR)
+      parts.append(('subdir', None))
 
     elif m['alldir']:
-      add(GALLDIR)
+      parts.append(('alldir', None))
 
     elif m['any']:
-      add(GANY)
+      parts.append(('any', None))
 
     elif m['chr']:
-      add(GCHR)
+      parts.append(('chr', None))
 
     elif m['chrset']:
       try:
-        add(GChrSet(tr_chrset(m['chrset'])))
+        parts.append(('chrset', tr_chrset(m['chrset'])))
       except ValueError as e:
         raise PatternError("Invalid pattern", pat, refs) from e
 
@@ -577,6 +562,205 @@ def tr_glob(pat, pid = 0) -> tuple[str, list[GRef]]:
     refs.append(GRef(undefined, 'undefined', i, len(pat)))
     raise PatternError("Invalid pattern", pat, refs)
 
+  return parts, refs
+
+#===============================================================================
+def tr_glob(pat, pid = 0) -> tuple[str, list[GRef]]:
+  """
+  Notes
+  -----
+  * https://man7.org/linux/man-pages/man7/glob.7.html
+
+  """
+
+  # collapse repeated separators '//...' to single '/'
+  pat = re.sub(r'/+', '/', pat)
+
+  if pat == '**':
+    return r'\A.*\Z', []
+
+  segs = GPath()
+
+  def add(case):
+    if isinstance(case, GSeparator):
+      segs.append(case)
+      return
+
+    if not ( len(segs) and isinstance(segs[-1], GSegment) ):
+      segs.append(GSegment(pid = pid, sid = len(segs)))
+
+    segs[-1].append(case)
+
+  parts, refs = parse_glob(pat)
+
+  for case, value in parts:
+    if case == 'fixed':
+      # NOTE: escaped after unescaping glob pattern 'escaped' characters,
+      # otherwise they become double-escaped
+      add(GFixed(re.escape(value)))
+
+    elif case == 'sep':
+      add(GSEP)
+
+    elif case == 'subdir':
+      add(GSUBDIR)
+
+    elif case == 'alldir':
+      add(GALLDIR)
+
+    elif case == 'any':
+      add(GANY)
+
+    elif case == 'chr':
+      add(GCHR)
+
+    else:
+      add(GChrSet(value))
+
   #DEBUG print(segs)
   res = segs.regex()
   return fr'\A{res}\Z', refs
+
+#===============================================================================
+class GlobNFA:
+  r"""Matches a glob pattern as a finite automaton, in linear time of the path
+
+  This is an alternative to the regex from :func:`tr_glob`, which does not
+  depend on how the regex engine backtracks. The automaton is a (Thompson) NFA
+  without empty transitions, where each part of the pattern adds states:
+
+  * fixed and single characters: one state for each character.
+  * ``*``: a loop on the current state for any character except :data:`SEP`.
+  * ``**/``: a loop through one state for ``[^SEP]+SEP``.
+  * ``/**``: two states for ``(SEP[^SEP]+)+``.
+
+  The sets of states reached are memoized as they are computed (a lazy DFA).
+
+  Parameters
+  ----------
+  pat:
+    Glob pattern, the same as for :func:`tr_glob`
+  """
+  # maximum number of memoized transitions, after which they are discarded
+  max_transitions: int = 2**14
+
+  #-----------------------------------------------------------------------------
+  def __init__(self, pat: str):
+    pat = re.sub(r'/+', '/', pat)
+
+    # transitions from each state as a list of (kind, value, next state)
+    edges = [[]]
+    cur = 0
+
+    def state():
+      edges.append([])
+      return len(edges) - 1
+
+    def edge(a, kind, value, b):
+      edges[a].append((kind, value, b))
+
+    if pat == '**':
+      # equivalent to '.*', any character except newline
+      edge(cur, 'notin', '\n', cur)
+      refs = []
+
+    else:
+      parts, refs = parse_glob(pat)
+
+      for case, value in parts:
+        if case == 'fixed':
+          for c in value:
+            n = state()
+            edge(cur, 'chr', c, n)
+            cur = n
+
+        elif case == 'sep':
+          n = state()
+          edge(cur, 'chr', SEP, n)
+          cur = n
+
+        elif case == 'chr':
+          n = state()
+          edge(cur, 'notin', SEP, n)
+          cur = n
+
+        elif case == 'chrset':
+          # NOTE: a set (e.g. negated) never matches the separator
+          n = state()
+          edge(cur, 'set', re.compile(value).match, n)
+          cur = n
+
+        elif case == 'any':
+          edge(cur, 'notin', SEP, cur)
+
+        elif case == 'subdir':
+          # ([^SEP]+SEP)*, continuing from the current state
+          t = state()
+          edge(cur, 'notin', SEP, t)
+          edge(t, 'notin', SEP, t)
+          edge(t, 'chr', SEP, cur)
+
+        elif case == 'alldir':
+          # (SEP[^SEP]+)+
+          t = state()
+          u = state()
+          edge(cur, 'chr', SEP, t)
+          edge(t, 'notin', SEP, u)
+          edge(u, 'notin', SEP, u)
+          edge(u, 'chr', SEP, t)
+          cur = u
+
+    self.pattern = pat
+    self.refs = refs
+    self._edges = [tuple(e) for e in edges]
+    self._start = frozenset([0])
+    self._accept = cur
+    self._transitions = {}
+
+  #-----------------------------------------------------------------------------
+  def _step(self, states: frozenset[int], c: str) -> frozenset[int]:
+    edges = self._edges
+    nxt = set()
+
+    for a in states:
+      for kind, value, b in edges[a]:
+        if kind == 'chr':
+          if c == value:
+            nxt.add(b)
+
+        elif kind == 'notin':
+          if c != value:
+            nxt.add(b)
+
+        elif c != SEP and value(c):
+          nxt.add(b)
+
+    return frozenset(nxt)
+
+  #-----------------------------------------------------------------------------
+  def match(self, path: str) -> bool:
+    """True if the whole path (translated by :func:`tr_path`) matches
+    """
+    transitions = self._transitions
+
+    if len(transitions) > self.max_transitions:
+      transitions.clear()
+
+    states = self._start
+
+    for c in path:
+      key = (states, c)
+
+      if (nxt := transitions.get(key)) is None:
+        nxt = transitions[key] = self._step(states, c)
+
+      if not nxt:
+        return False
+
+      states = nxt
+
+    return self._accept in states
+
+  #-----------------------------------------------------------------------------
+  __call__ = match
+
@@ -1,15 +1,27 @@
 from __future__ import annotations
 from pathlib import Path, PurePath
 from typing import NamedTuple
+from collections.abc import Iterator
 import os
-import stat
+import os.path as osp
+from stat import S_ISDIR
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from os import (
   scandir as os_scandir,
+  stat as os_stat,
+  lstat as os_lstat,
   readlink as os_readlink,
   sep as os_sep)
 from . import (
   tr_path,
-  PathFilter)
+  tr_join,
+  PathFilter,
+  partition)
+
+# number of directories scanned serially before scanning in parallel, so that
+# small trees do not pay the cost of starting threads
+SCAN_SERIAL_MAX = 32
 
 #===============================================================================
 class FileInfo(NamedTuple):
@@ -24,19 +36,300 @@ class FileInfo(NamedTuple):
   """
 
 #===============================================================================
-class DirInfo(NamedTuple):
-  files: dict[str, FileInfo]
-  r"""File names and info in this directory
-  """
-  dirs: dict[str, DirInfo]
-  r"""Directory names and info in this directory
-  """
-  ignore: list[str]|None
-  r"""Equivalent to a ".gitignore" present in this directory
-  """
-  errors: dict[str, str]
-  r"""File or directory names that resulted in error messages in this directory
+class DirInfo:
+  r"""Info of the files and sub-directories in a directory
+
+  Parameters
+  ----------
+  files:
+  dirs:
+  ignore:
+  errors:
+  path:
+    If given, the directory is scanned (once) when any of the other attributes
+    is first accessed, instead of being given. Sub-directories are also scanned
+    lazily, so that only directories that are reached are ever accessed.
+  follow_symlinks:
+    Whether or not to follow symlinks when scanning ``path``.
+  gitignore:
+    If true, reads a ".gitignore" file when scanning ``path`` into ``ignore``.
+  exclude:
+    Filters applied while scanning ``path``, the matched names are added to
+    ``pruned`` instead of ``files`` or ``dirs`` (and are never stat'ed or scanned).
+  dirpath:
+    Path of this directory relative to the start of the ``exclude`` filters.
+  cache:
+    If given, :class:`ScanCache <partis.pyproj.cache.ScanCache>` used to re-use
+    the listing of directories that have not been modified since cached.
   """
+  __slots__ = (
+    '_files',
+    '_dirs',
+    '_ignore',
+    '_errors',
+    '_pruned',
+    '_path',
+    '_scanned',
+    '_follow_symlinks',
+    '_gitignore',
+    '_exclude',
+    '_dirpath',
+    '_cache',
+    '_kinds',
+    '_stats')
+
+  #-----------------------------------------------------------------------------
+  def __init__(self,
+      files: dict[str, FileInfo]|None = None,
+      dirs: dict[str, DirInfo]|None = None,
+      ignore: list[str]|None = None,
+      errors: dict[str, str]|None = None,
+      *,
+      path: str|Path|None = None,
+      follow_symlinks: bool = False,
+      gitignore: bool = False,
+      exclude: tuple[PathFilter] = (),
+      dirpath: PurePath = PurePath(),
+      cache = None):
+
+    self._files = {} if files is None else files
+    self._dirs = {} if dirs is None else dirs
+    self._ignore = ignore
+    self._errors = {} if errors is None else errors
+    self._pruned = set()
+    self._path = path
+    self._scanned = path is None
+    self._follow_symlinks = follow_symlinks
+    self._gitignore = gitignore
+    self._exclude = exclude
+    self._dirpath = dirpath
+    self._cache = cache
+    self._kinds = {}
+    self._stats = {}
+
+  #-----------------------------------------------------------------------------
+  @property
+  def files(self) -> dict[str, FileInfo]:
+    r"""File names and info in this directory
+    """
+    if not self._scanned:
+      self._scan()
+
+    return self._files
+
+  #-----------------------------------------------------------------------------
+  @property
+  def dirs(self) -> dict[str, DirInfo]:
+    r"""Directory names and info in this directory
+    """
+    if not self._scanned:
+      self._scan()
+
+    return self._dirs
+
+  #-----------------------------------------------------------------------------
+  @property
+  def ignore(self) -> list[str]|None:
+    r"""Equivalent to a ".gitignore" present in this directory
+    """
+    if not self._scanned:
+      self._scan()
+
+    return self._ignore
+
+  #-----------------------------------------------------------------------------
+  @property
+  def errors(self) -> dict[str, str]:
+    r"""File or directory names that resulted in error messages in this directory
+    """
+    if not self._scanned:
+      self._scan()
+
+    return self._errors
+
+  #-----------------------------------------------------------------------------
+  @property
+  def pruned(self) -> set[str]:
+    r"""File or directory names in this directory matched by the exclude filters
+    """
+    if not self._scanned:
+      self._scan()
+
+    return self._pruned
+
+  #-----------------------------------------------------------------------------
+  def scan(self, workers: int = 1) -> DirInfo:
+    r"""Scans all (not pruned) sub-directories now, instead of when first reached
+
+    Parameters
+    ----------
+    workers:
+      Maximum number of threads used to scan directories concurrently. The first
+      :data:`SCAN_SERIAL_MAX` directories are always scanned serially, so that
+      small trees are not scanned in parallel.
+      The resulting tree does not depend on the number of workers.
+    """
+    pending = deque([self])
+    num_scanned = 0
+
+    while pending and (workers <= 1 or num_scanned < SCAN_SERIAL_MAX):
+      pending.extend(_scan_dirs(pending.popleft()))
+      num_scanned += 1
+
+    if not pending:
+      return self
+
+    with ThreadPoolExecutor(
+        max_workers = workers,
+        thread_name_prefix = 'scandir') as executor:
+
+      # NOTE: each directory is only submitted once, and the info of a directory
+      # is only written by the thread that scans it
+      futures = deque([executor.submit(_scan_dirs, d) for d in pending])
+
+      try:
+        while futures:
+          futures.extend([
+            executor.submit(_scan_dirs, d)
+            for d in futures.popleft().result()])
+
+      finally:
+        for future in futures:
+          future.cancel()
+
+    return self
+
+  #-----------------------------------------------------------------------------
+  def _scan(self):
+    r"""Scans the directory, without recursing into sub-directories
+    """
+    self._scanned = True
+    root = self._path
+    cache = self._cache
+    listing = None
+
+    try:
+      if cache is not None:
+        # NOTE: modification time must be read *before* listing the directory,
+        # so that any later change invalidates the cached listing
+        mtime_ns = os_stat(root).st_mtime_ns
+        listing = cache.get(root, mtime_ns)
+
+      if listing is None:
+        kinds = {}
+        stats = {}
+
+        with os_scandir(root) as it:
+          for entry in it:
+            kinds[entry.name] = _entry_kind(entry)
+
+      else:
+        kinds, stats = listing
+        # file stats are only re-used in trusted mode
+        stats = dict(stats) if cache.trusted else {}
+
+    except OSError as e:
+      self._errors['.'] = str(e)
+      return
+
+    self._kinds = kinds
+    self._stats = stats
+    names = list(kinds.keys())
+
+    if exclude := self._exclude:
+      dnames, fnames = partition(
+        lambda name: self._is_dir(name, kinds[name]),
+        names)
+
+      _dirpath = tr_path(self._dirpath)
+      pruned = set()
+
+      for _exclude in exclude:
+        pruned = _exclude._filter(_dirpath, fnames, dnames, pruned)
+
+      if pruned:
+        self._pruned = pruned
+        names = [name for name in names if name not in pruned]
+
+    for name in names:
+      try:
+        self._add_entry(name, kinds[name])
+      except OSError as e:
+        self._errors[name] = str(e)
+
+    if cache is not None:
+      cache.set(root, mtime_ns, kinds, stats)
+
+  #-----------------------------------------------------------------------------
+  def _is_dir(self, name: str, kind: str) -> bool:
+    if kind == 'l' and self._follow_symlinks:
+      return osp.isdir(osp.join(self._path, name))
+
+    return kind == 'd'
+
+  #-----------------------------------------------------------------------------
+  def _add_entry(self, name: str, kind: str) -> DirInfo|FileInfo:
+    r"""Adds info of a single entry of the scanned directory
+    """
+    path = osp.join(self._path, name)
+    s = None
+
+    if kind == 'l':
+      if not self._follow_symlinks:
+        s = os_lstat(path)
+        info = self._files[name] = FileInfo(
+          s.st_mtime,
+          s.st_size,
+          PurePath(os_readlink(path)))
+
+        return info
+
+      s = os_stat(path)
+
+      if S_ISDIR(s.st_mode):
+        kind = 'd'
+
+    if kind == 'd':
+      info = self._dirs[name] = DirInfo(
+        path = path,
+        follow_symlinks = self._follow_symlinks,
+        gitignore = self._gitignore,
+        exclude = self._exclude,
+        dirpath = self._dirpath/name,
+        cache = self._cache)
+
+      return info
+
+    if s is not None:
+      # followed symlink
+      info = self._files[name] = FileInfo(s.st_mtime, s.st_size)
+
+    elif (_stat := self._stats.get(name)) is not None:
+      # cached stat in trusted mode
+      info = self._files[name] = FileInfo(*_stat)
+
+    else:
+      s = os_stat(path)
+      self._stats[name] = [s.st_mtime, s.st_size]
+      info = self._files[name] = FileInfo(s.st_mtime, s.st_size)
+
+    if self._gitignore and name == '.gitignore':
+      with open(path, 'r') as fp:
+        ignore = [line.strip() for line in fp.read().splitlines()]
+
+      self._ignore = [line for line in ignore if not line.startswith('#')]
+
+    return info
+
+  #-----------------------------------------------------------------------------
+  def _get_pruned(self, name: str) -> DirInfo|FileInfo|None:
+    r"""Adds a single pruned entry, when it is explicitly requested by name
+    """
+    if name not in self.pruned:
+      return None
+
+    self._pruned.discard(name)
+    return self._add_entry(name, self._kinds[name])
 
   #-----------------------------------------------------------------------------
   def get(self, path: PurePath|list[str]) -> DirInfo|FileInfo:
@@ -60,6 +353,10 @@ class DirInfo(NamedTuple):
       _cur = cur.dirs.get(name)
 
       if _cur is None:
+        # excluded directories are still available when given explicitly
+        _cur = cur._get_pruned(name)
+
+      if type(_cur) is not DirInfo:
         raise FileNotFoundError(f"No directory {path}")
 
       cur = _cur
@@ -70,6 +367,9 @@ class DirInfo(NamedTuple):
     if _cur is None:
       _cur = cur.files.get(name)
 
+    if _cur is None:
+      _cur = cur._get_pruned(name)
+
     if _cur is None:
       raise FileNotFoundError(f"No file or directory {path}")
 
@@ -81,8 +381,8 @@ class DirInfo(NamedTuple):
       exclude: PathFilter|tuple[PathFilter]|None = None,
       ignore: bool = False,
       dirpath: PurePath = PurePath()) -> list[tuple[PurePath, FileInfo]]:
-    r"""Similar to performing glob on a directory with the same content, but does
-    not use any filesystem access.
+    r"""Similar to performing glob on a directory with the same content, but
+    only directories that are not excluded are scanned (if not already).
 
     Parameters
     ----------
@@ -96,65 +396,144 @@ class DirInfo(NamedTuple):
       If given, serves as the path for the starting directory where `glob` was
       called, all matched paths will begin with this path.
     """
+    return list(self.iglob(include, exclude, ignore, dirpath))
 
-    if isinstance(exclude, PathFilter):
-      exclude = (exclude,)
-    elif exclude is None:
-      exclude = ()
-    else:
-      exclude = tuple(exclude)
+  #-----------------------------------------------------------------------------
+  def iglob(self,
+      include: PathFilter,
+      exclude: PathFilter|tuple[PathFilter]|None = None,
+      ignore: bool = False,
+      dirpath: PurePath = PurePath()) -> Iterator[tuple[PurePath, FileInfo]]:
+    r"""Same as :meth:`glob`, but yields each match as it is reached
 
-    return self._glob(dirpath, include, exclude, ignore)
+    Directories are only scanned as they are reached, and the matches are in the
+    same order as :meth:`glob`.
+    """
+    for _, path, info in self.iglob_multi([include], exclude, ignore, dirpath):
+      yield path, info
 
   #-----------------------------------------------------------------------------
-  def _glob(self,
-      dirpath: PurePath,
-      include: PathFilter|None,
-      excludes: tuple[PathFilter],
-      ignore: bool) -> list[tuple[PurePath, FileInfo]]:
+  def iglob_multi(self,
+      includes: list[PathFilter],
+      exclude: PathFilter|tuple[PathFilter]|None = None,
+      ignore: bool = False,
+      dirpath: PurePath = PurePath(),
+      workers: int = 1) -> Iterator[tuple[int, PurePath, FileInfo]]:
+    r"""Same as :meth:`iglob` for several include filters, in a single traversal
 
-    _dirpath = tr_path(dirpath)
-    fnames = list(self.files.keys())
-    dnames = list(self.dirs.keys())
+    Parameters
+    ----------
+    includes:
+      Filters for files to include, each equivalent to a separate glob pattern
+    exclude:
+    ignore:
+    dirpath:
+    workers:
+      Maximum number of threads used to scan directories ahead of being matched.
+      Only the directories that are traversed (not excluded) are scanned, after
+      the first :data:`SCAN_SERIAL_MAX` directories are scanned serially.
+
+    Returns
+    -------
+    matches:
+      Iterator of ``(index, path, info)``, where ``index`` is of the matching
+      include. A file matched by several includes is yielded once for each.
+      The matches of each include are in the same order as :meth:`iglob`, but
+      are interleaved with those of the other includes.
+    """
 
-    if include is None:
-      included = set(fnames+dnames)
+    if isinstance(exclude, PathFilter):
+      exclude = (exclude,)
+    elif exclude is None:
+      exclude = ()
     else:
-      included = include._filter(
-        _dirpath,
-        fnames = fnames,
-        dnames = dnames)
-
-    if ignore and self.ignore is not None:
-      excludes = (PathFilter(self.ignore, start = dirpath),) + excludes
-
-    excluded = set()
-
-    for exclude in excludes:
-      excluded = exclude._filter(
-        _dirpath,
-        fnames,
-        dnames,
-        excluded)
-
-    included = included - excluded
-
-    files = [
-      (dirpath/name, info) for name, info in self.files.items()
-      if name in included]
-
-    for name, info in self.dirs.items():
-      if name in included:
-        # The directory matched the include pattern,
-        # treat as though everything under the directory also matches
-        files.extend(info._glob(dirpath/name, None, excludes, ignore))
-
-      elif name not in excluded:
-        # directory is still recursed if not ignored,
-        # but individual items must still match the include pattern
-        files.extend(info._glob(dirpath/name, include, excludes, ignore))
+      exclude = tuple(exclude)
 
-    return files
+    # directories remaining to be matched, depth-first in the same order as they
+    # are listed, along with the include filters still being matched
+    # NOTE: an include of None means everything under a matched directory
+    stack = [(self, dirpath, tr_path(dirpath), tuple(enumerate(includes)), exclude)]
+
+    executor = None
+    # directories being scanned ahead by worker threads, which must be complete
+    # before a directory is matched
+    scanning = {}
+    num_dirs = 0
+
+    try:
+      while stack:
+        info, dirpath, _dirpath, includes, excludes = stack.pop()
+
+        if (future := scanning.pop(id(info), None)) is not None:
+          future.result()
+
+        files = info.files
+        dirs = info.dirs
+        fnames = list(files.keys())
+        dnames = list(dirs.keys())
+
+        if ignore and info.ignore is not None:
+          excludes = (PathFilter(info.ignore, start = dirpath),) + excludes
+
+        excluded = set()
+
+        for exclude in excludes:
+          excluded = exclude._filter(
+            _dirpath,
+            fnames,
+            dnames,
+            excluded)
+
+        included = [
+          (k, include, (
+            set(fnames+dnames) if include is None
+            else include._filter(_dirpath, fnames = fnames, dnames = dnames))
+            - excluded)
+          for k, include in includes]
+
+        for name, file in files.items():
+          for k, _, _included in included:
+            if name in _included:
+              yield k, dirpath/name, file
+
+        children = []
+
+        for name, _info in dirs.items():
+          if name in excluded:
+            continue
+
+          # The directory matched the include pattern, treat as though everything
+          # under the directory also matches.
+          # Otherwise, directory is still recursed if not ignored,
+          # but individual items must still match the include pattern
+          children.append((
+            _info,
+            dirpath/name,
+            tr_join(_dirpath, name),
+            tuple([
+              (k, None if name in _included else include)
+              for k, include, _included in included]),
+            excludes))
+
+        stack.extend(reversed(children))
+        num_dirs += 1
+
+        if workers > 1 and num_dirs >= SCAN_SERIAL_MAX:
+          if executor is None:
+            executor = ThreadPoolExecutor(
+              max_workers = workers,
+              thread_name_prefix = 'scandir')
+
+          for _info, *_ in children:
+            if not _info._scanned:
+              scanning[id(_info)] = executor.submit(_scan_dirs, _info)
+
+    finally:
+      if executor is not None:
+        for future in scanning.values():
+          future.cancel()
+
+        executor.shutdown(wait = True)
 
   #-----------------------------------------------------------------------------
   def __str__(self):
@@ -166,13 +545,42 @@ class DirInfo(NamedTuple):
 
     return f"{type(self).__name__}({args})"
 
+#===============================================================================
+def _entry_kind(entry: os.DirEntry) -> str:
+  r"""Kind of a directory entry, ``'l'`` symlink, ``'d'`` directory, or ``'f'``
+  """
+  # NOTE: type of entry is usually known without a 'stat'
+  try:
+    if entry.is_symlink():
+      return 'l'
+
+    if entry.is_dir(follow_symlinks=False):
+      return 'd'
+
+  except OSError:
+    pass
+
+  return 'f'
+
+#===============================================================================
+def _scan_dirs(info: DirInfo) -> list[DirInfo]:
+  r"""Scans a directory, returning the sub-directories to scan
+  """
+  return list(info.dirs.values())
+
 #===============================================================================
 def scandir_recursive(
     root: Path,
     follow_symlinks: bool = False,
-    gitignore: bool = False) -> DirInfo:
+    gitignore: bool = False,
+    exclude: PathFilter|tuple[PathFilter]|None = None,
+    workers: int = 1,
+    cache = None) -> DirInfo:
   r"""Returns all file paths under given root directory
 
+  The directories are scanned lazily, only when the info of a directory is first
+  accessed (e.g. by :meth:`DirInfo.get` or :meth:`DirInfo.glob`).
+
   Parameters
   ----------
   root:
@@ -183,46 +591,32 @@ def scandir_recursive(
     If true, reads .gitignore files as they encountered and stores the patterns
     in DirInfo.ignore. These are *not* used during the scan, all files will
     still be returned.
+  exclude:
+    If given, filters (relative to ``root``) for files and directories that are
+    pruned during the scan. Excluded directories are never descended into,
+    unless explicitly requested with :meth:`DirInfo.get`.
+  workers:
+    If greater than one, the whole tree is scanned immediately with up to this
+    many threads (see :meth:`DirInfo.scan`), instead of lazily.
+  cache:
+    If given, :class:`ScanCache <partis.pyproj.cache.ScanCache>` of directory
+    listings. Note that the cache is not saved.
   """
-  files = {}
-  dirs = {}
-  errors = {}
-  ignore = None
-  entry: os.DirEntry
-
-  try:
-    with os_scandir(root) as entries:
-      for entry in entries:
-        path = entry.path
-
-        try:
-          s = entry.stat(follow_symlinks=follow_symlinks)
-
-          if stat.S_ISLNK(s.st_mode):
-            files[entry.name] = FileInfo(
-              s.st_mtime,
-              s.st_size,
-              PurePath(os_readlink(path)))
-
-          elif stat.S_ISDIR(s.st_mode):
-            dirs[entry.name] = scandir_recursive(path, follow_symlinks, gitignore)
-
-          else:
-            files[entry.name] = FileInfo(
-              s.st_mtime,
-              s.st_size)
-
-            if gitignore and entry.name == '.gitignore':
-              with open(entry.path, 'r') as fp:
-                ignore = [line.strip() for line in fp.read().splitlines()]
-
-              ignore = [line for line in ignore if not line.startswith('#')]
-
-        except OSError as e:
-          errors[entry.name] = str(e)
-
-  except OSError as e:
-    errors['.'] = str(e)
-
-  return DirInfo(files, dirs, ignore, errors)
-
+  if isinstance(exclude, PathFilter):
+    exclude = (exclude,)
+  elif exclude is None:
+    exclude = ()
+  else:
+    exclude = tuple(exclude)
+
+  info = DirInfo(
+    path = root,
+    follow_symlinks = follow_symlinks,
+    gitignore = gitignore,
+    exclude = exclude,
+    cache = cache)
+
+  if workers > 1:
+    info.scan(workers)
+
+  return info
@@ -33,6 +33,8 @@ from .norms import (
   str_list,
   nonempty_str_list,
   norm_bool,
+  norm_workers,
+  norm_jobs,
   norm_path,
   norm_path_to_os )
 
@@ -293,6 +295,11 @@ class pyproj_dist_source_prep(pyproj_prep):
 class pyproj_dist_binary_prep(pyproj_prep):
   pass
 
+#===============================================================================
+class TargetDepends(valid_list):
+  _as_list = valid(as_list)
+  value_valid = valid(nonempty_str, norm_printable)
+
 #===============================================================================
 class pyproj_build_target(valid_dict):
   allow_keys = list()
@@ -304,6 +311,10 @@ class pyproj_build_target(valid_dict):
   default = {
     'enabled': valid(True, marker_evaluated),
     'exclusive': valid('', norm_printable),
+    # name referenced by 'depends_on' of other targets
+    'name': valid('', norm_printable),
+    # names of targets that must complete before this target is run
+    'depends_on': TargetDepends,
     # NOTE: default builder from backward compatibility
     'entry': valid('partis.pyproj.builder:meson', norm_entry_point_ref),
     'options': dict,
@@ -395,6 +406,21 @@ class pyproj_dist_scheme(valid_dict):
     'ignore': IgnoreList,
     'copy': pyproj_dist_copy_list }
 
+#===============================================================================
+class pyproj_dist_compress(valid_dict):
+  allow_keys = list()
+  # a string at top-level interpreted as 'glob'
+  proxy_key = 'glob'
+  default = {
+    # same pattern format as 'ignore', relative to the root of the wheel
+    'glob': valid(REQUIRED, IgnoreList),
+    # zero stores without compression (default, first option), otherwise DEFLATE
+    'level': restrict(*range(10)) }
+
+#===============================================================================
+class pyproj_dist_compress_list(valid_list):
+  value_valid = valid(pyproj_dist_compress)
+
 #===============================================================================
 class pyproj_dist_binary(valid_dict):
   allow_keys = list()
@@ -402,6 +428,10 @@ class pyproj_dist_binary(valid_dict):
     'build_number': valid(OPTIONAL_NONE, int),
     'build_suffix': valid(OPTIONAL_NONE, str),
     'compat_tags': valid(purelib_compat_tags(), compat_tags),
+    # default DEFLATE compression level (default, first option, is same as zlib)
+    'compress_level': restrict(6, *range(6), *range(7, 10)),
+    'compress': pyproj_dist_compress_list,
+    'compress_detect': valid(False, norm_bool),
     'prep': valid(OPTIONAL_NONE, pyproj_dist_binary_prep),
     'ignore': IgnoreList,
     'copy': pyproj_dist_copy_list,
@@ -418,7 +448,9 @@ class pyproj_dist_source(valid_dict):
     'prep': valid(OPTIONAL, pyproj_dist_source_prep),
     'ignore': IgnoreList,
     'copy': pyproj_dist_copy_list,
-    'add_legacy_setup': valid(False, norm_bool) }
+    'add_legacy_setup': valid(False, norm_bool),
+    # gzip compression level, default (first option) is 9
+    'compress_level': restrict(*range(9, -1, -1)) }
 
 #===============================================================================
 class pyproj_dist(valid_dict):
@@ -444,6 +476,34 @@ class pyproj(valid_dict):
     'targets': pyproj_targets }
   deprecate_keys = [('meson', 'targets')]
 
+#===============================================================================
+class pyproj_backend_settings(valid_dict):
+  """Settings of the backend itself (not the project)
+
+  These are given in ``config_settings`` with keys prefixed by ``pyproj.``,
+  (e.g. ``pyproj.workers``), or the environment variable ``PARTIS_PYPROJ_{KEY}``
+  (e.g. ``PARTIS_PYPROJ_WORKERS``).
+  """
+  allow_keys = list()
+  default = {
+    # number of threads used to compress distribution files
+    'workers': valid(1, norm_workers),
+    # number of build targets run concurrently
+    'target_workers': valid(1, norm_workers),
+    # cache hashes of unchanged files between builds
+    'hash_cache': valid(False, norm_bool),
+    # reuse compressed files from a previous wheel in the output directory
+    'incremental': valid(False, norm_bool),
+    # cache listings of unmodified directories between builds
+    'scan_cache': restrict('off', 'on', 'trusted'),
+    # restore installed files of build targets with unchanged inputs
+    'build_cache': valid(False, norm_bool),
+    # directory shared between builds (e.g. on other machines) to pull and
+    # push the build cache
+    'build_cache_remote': valid('', norm_printable),
+    # total number of jobs of build targets, through a make jobserver
+    'jobs': valid(0, norm_jobs) }
+
 #===============================================================================
 class tool(valid_dict):
   require_keys = ['pyproj']
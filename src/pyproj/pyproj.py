@@ -1,4 +1,5 @@
 from __future__ import annotations
+import os
 from logging import (
   getLogger,
   Logger)
@@ -31,6 +32,11 @@ from .pep import (
   platlib_compat_tags )
 from .path import (
   resolve)
+from .cache import (
+  HashCache,
+  ScanCache,
+  BuildCache,
+  SharedDirCache)
 from .load_module import (
   EntryPoint )
 
@@ -44,6 +50,7 @@ from .pptoml import (
   pyproj_dist_source,
   pyproj_dist_binary,
   pyproj_targets,
+  pyproj_backend_settings,
   # NOTE: deprecated
   pyproj,
   pyproj_meson,
@@ -135,8 +142,31 @@ class PyProjBase:
       allow_keys = list()
       default = config_default
 
+    # settings for the backend itself are separated from those validated against
+    # "tool.pyproj.config", with fallback to environment variables
+    config_settings = dict(config_settings or dict())
+    backend_settings = dict()
+
+    for k in list(config_settings.keys()):
+      if k.startswith('pyproj.'):
+        backend_settings[k[len('pyproj.'):]] = config_settings.pop(k)
+
+    for k in pyproj_backend_settings._all_keys:
+      env_key = 'PARTIS_PYPROJ_' + k.upper()
+
+      if k not in backend_settings and env_key in os.environ:
+        backend_settings[k] = os.environ[env_key]
+
     with validating( key = 'config_settings' ):
-      self._config_settings = valid_config_settings(config_settings or dict())
+      self._config_settings = valid_config_settings(config_settings)
+      self._backend_settings = pyproj_backend_settings(backend_settings)
+
+    # shared by all copies from the project (saved after each)
+    self.scan_cache = None
+
+    if self._backend_settings.scan_cache != 'off':
+      self.scan_cache = ScanCache(
+        trusted = self._backend_settings.scan_cache == 'trusted')
 
     #...........................................................................
     self.build_backend = mapget( self.pptoml,
@@ -226,6 +256,14 @@ class PyProjBase:
   # alias for backward compatibility
   config = config_settings
 
+  #-----------------------------------------------------------------------------
+  @property
+  def backend_settings(self) -> pyproj_backend_settings:
+    """Settings of the backend itself, passed in ``config_settings`` as
+    ``pyproj.{key}``, or environment variables ``PARTIS_PYPROJ_{KEY}``
+    """
+    return self._backend_settings
+
   #-----------------------------------------------------------------------------
   @property
   def targets(self) -> pyproj_targets:
@@ -378,7 +416,9 @@ class PyProjBase:
         ignore = self.dist.ignore + self.source.ignore,
         dist = dist,
         root = self.root,
-        logger = self.logger )
+        logger = self.logger,
+        workers = self.backend_settings.workers,
+        scan_cache = self.scan_cache )
 
       if self.add_legacy_setup:
         with validating(key = 'add_legacy_setup'):
@@ -391,16 +431,34 @@ class PyProjBase:
     """Prepares project files for a binary distribution
     """
 
+    build_cache = None
+
+    if self.backend_settings.build_cache or self.backend_settings.build_cache_remote:
+      remote = None
+
+      if self.backend_settings.build_cache_remote:
+        remote = SharedDirCache(self.backend_settings.build_cache_remote)
+
+      build_cache = BuildCache(
+        hash_cache = HashCache() if self.backend_settings.hash_cache else None,
+        remote = remote)
+
     builder = Builder(
       pyproj = self,
       root = self.root,
       targets = self.targets,
       logger = self.logger.getChild("targets"),
-      editable = self.editable)
+      editable = self.editable,
+      workers = self.backend_settings.target_workers,
+      build_cache = build_cache,
+      jobs = self.backend_settings.jobs)
 
     with builder:
       builder.build_targets()
 
+      if build_cache is not None and build_cache.hash_cache is not None:
+        build_cache.hash_cache.save()
+
       self.prep_entrypoint(
         name = "tool.pyproj.dist.binary.prep",
         obj = self.binary,
@@ -429,7 +487,9 @@ class PyProjBase:
         dist = dist,
         root = self.root,
         logger = self.logger,
-        follow_symlinks = True)
+        follow_symlinks = True,
+        workers = self.backend_settings.workers,
+        scan_cache = self.scan_cache)
 
       data_scheme = [
         'data',
@@ -454,4 +514,6 @@ class PyProjBase:
               dist = dist,
               root = self.root,
               logger = self.logger,
-              follow_symlinks = True)
+              follow_symlinks = True,
+              workers = self.backend_settings.workers,
+              scan_cache = self.scan_cache)
@@ -0,0 +1,112 @@
+"""Micro-benchmark of :class:`PathFilter` matching typical ignore patterns
+
+Compares the combined matcher (literal and suffix look-ups, and one regex for
+the remaining patterns) to matching each pattern separately.
+
+.. code-block:: bash
+
+  python tests/bench_path_filter.py
+
+"""
+import re
+import timeit
+from partis.pyproj import (
+  PathFilter )
+from partis.pyproj.path import (
+  tr_path,
+  tr_rel_join )
+from partis.pyproj.path.match import (
+  compile_glob,
+  combined_matcher )
+from pathlib import PurePosixPath
+
+#===============================================================================
+PATTERNS = [
+  '__pycache__/', '.git/', '.hg/', '.svn/', '.tox/', '.nox/', '.venv/', 'venv/',
+  'node_modules/', 'build/', 'dist/', '.eggs/', '*.egg-info/', '.mypy_cache/',
+  '.pytest_cache/', '.ruff_cache/', '.ipynb_checkpoints/', 'htmlcov/',
+  '.coverage', '.coverage.*', 'coverage.xml', '.DS_Store', 'Thumbs.db',
+  '*.pyc', '*.pyo', '*.pyd', '*.so', '*.o', '*.a', '*.dll', '*.dylib', '*.obj',
+  '*.exe', '*.log', '*.tmp', '*.swp', '*.swo', '*~', '*.bak', '*.orig', '*.rej',
+  '*.egg', '*.whl', '*.tar.gz', '*.zip', '*.lock', '.env', '.envrc',
+  '.idea/', '.vscode/', '*.code-workspace', '.cache/', 'tmp/', 'temp/',
+  '/docs/_build/', '/site/', 'wheelhouse/', 'pip-wheel-metadata/', '*.prof',
+  '*.lprof', '.hypothesis/', '.benchmarks/', '*.sqlite3', '*.db', '*.pid',
+  '*.mo', '*.pot', 'nosetests.xml', '*.cover', '*.py,cover', '.cython_debug/',
+  'cmake-build-*/', 'CMakeFiles/', 'CMakeCache.txt', 'Makefile.in',
+  'test_*.tmp', 'out[0-9]/', '!keep.log', '!/dist/README.md' ]
+
+FNAMES = [
+  f'{stem}{i}{ext}'
+  for i in range(40)
+  for stem, ext in [
+    ('module', '.py'), ('module', '.pyc'), ('data', '.json'), ('lib', '.so'),
+    ('notes', '.md'), ('run', '.log'), ('setup', '.cfg'), ('test_x', '.tmp'),
+    ('img', '.png'), ('edit', '.py~') ]]
+
+DNAMES = [
+  f'{name}{i}'
+  for i in range(10)
+  for name in ['pkg', 'sub', 'out', 'src', 'node_modules']] + [
+  '__pycache__', '.git', 'build', 'docs']
+
+#===============================================================================
+def filter_separately(pfilter, dir, fnames, dnames):
+  """Equivalent of :meth:`PathFilter._filter`, matching each pattern separately
+  """
+  dname_paths = tr_rel_join(pfilter._start, dir, dnames)
+  fname_paths = tr_rel_join(pfilter._start, dir, fnames)
+  name_paths = dname_paths + fname_paths
+  feasible = set()
+
+  for pattern in pfilter.patterns:
+    op = feasible.difference if pattern.negate else feasible.union
+    _name_paths = dname_paths if pattern.dironly else name_paths
+    match = pattern._match
+
+    if pattern.relative:
+      feasible = op({name for name, path in _name_paths if match(path)})
+    else:
+      feasible = op({name for name, path in _name_paths if match(name)})
+
+  return feasible
+
+#===============================================================================
+def main(number = 200):
+  pfilter = PathFilter(PATTERNS)
+  dir = tr_path(PurePosixPath('src/pkg'))
+  names = len(FNAMES) + len(DNAMES)
+
+  expected = filter_separately(pfilter, dir, FNAMES, DNAMES)
+  assert pfilter._filter(dir, FNAMES, DNAMES) == expected
+
+  t_sep = min(timeit.repeat(
+    lambda: filter_separately(pfilter, dir, FNAMES, DNAMES),
+    number = number,
+    repeat = 5)) / number
+
+  t_comb = min(timeit.repeat(
+    lambda: pfilter._filter(dir, FNAMES, DNAMES),
+    number = number,
+    repeat = 5)) / number
+
+  print(f"{len(PATTERNS)} patterns, {names} names ({len(expected)} matched)")
+  print(f"  separately: {1e6*t_sep:9.1f} us")
+  print(f"  combined:   {1e6*t_comb:9.1f} us ({t_sep/t_comb:.1f}x)")
+
+  def create_uncached():
+    compile_glob.cache_clear()
+    combined_matcher.cache_clear()
+    re.purge()
+    PathFilter(PATTERNS)
+
+  t_new = min(timeit.repeat(create_uncached, number = 10, repeat = 3)) / 10
+  t_cached = min(timeit.repeat(lambda: PathFilter(PATTERNS), number = number, repeat = 5)) / number
+
+  print("create filter")
+  print(f"  uncached:   {1e6*t_new:9.1f} us")
+  print(f"  cached:     {1e6*t_cached:9.1f} us ({t_new/t_cached:.1f}x)")
+
+#===============================================================================
+if __name__ == '__main__':
+  main()
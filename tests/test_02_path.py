@@ -289,6 +289,105 @@ def test_filter():
   assert p.filter(pxp('z/x'), dnames = [], fnames = ['y']) == {'y'}
   assert p.filter(ntp('z\\x'), dnames = [], fnames = ['y']) == {'y'}
 
+#===============================================================================
+def test_filter_combined():
+  # last matching pattern decides, with directory-only patterns only for dnames
+  p = PathFilter(['*.py', '!test_*', 'test_a.py', 'build/', '!/build', 'x/y'])
+  dnames = ['build', 'test_dir', 'src']
+  fnames = ['a.py', 'test_a.py', 'test_b.py', 'build', 'y']
+
+  assert p.filter('.', fnames = fnames, dnames = dnames) == {
+    'a.py', 'test_a.py' }
+
+  assert p.filter(pxp('x'), fnames = fnames, dnames = dnames) == {
+    'a.py', 'test_a.py', 'build', 'y' }
+
+  # names not matched by any pattern keep their feasibility
+  assert p.filter(
+    '.',
+    fnames = fnames,
+    dnames = dnames,
+    feasible = {'src', 'test_b.py'}) == {'a.py', 'test_a.py', 'src'}
+
+  # patterns with their own start directory
+  p = PathFilter([
+    'a.py',
+    PathMatcher('!b/a.py', start = pxp('c')),
+    PathMatcher('/d/', start = pxp('c'))],
+    start = pxp('x'))
+
+  assert p.filter(pxp('x/c/b'), fnames = ['a.py'], dnames = ['d']) == set()
+  assert p.filter(pxp('x/c'), fnames = ['a.py'], dnames = ['d']) == {'a.py', 'd'}
+  assert p.filter(pxp('x/e'), fnames = ['a.py'], dnames = ['d'], check = False) == {'a.py'}
+
+#===============================================================================
+def test_filter_fast_path():
+  from partis.pyproj.path.match import CombinedMatcher
+
+  patterns = [
+    '__pycache__', '*.pyc', '*.tar.gz', '*~', 'a*.py', '!keep.pyc', '*.py[cd]']
+
+  m = CombinedMatcher([(j, PathMatcher(p)._glob, 're') for j, p in enumerate(patterns)])
+  assert m.literals == {'__pycache__': 0, 'keep.pyc': 5}
+  assert m.extensions == {'.pyc': 1, '.tar.gz': 2}
+  assert m.suffixes == {'~': 3}
+
+  assert m('__pycache__') == 0
+  assert m('x.pyc') == 6
+  assert m('.pyc') == 6
+  assert m('keep.pyc') == 6
+  assert m('x.tar.gz') == 2
+  assert m('x.gz') == -1
+  assert m('x.py~') == 3
+  assert m('ab.py') == 4
+  assert m('b.py') == -1
+  assert m('keep.pyd') == 6
+
+  # tested by suffix with or without the regex
+  p = PathFilter(patterns[:-1])
+  assert p.filter('.', fnames = ['keep.pyc', 'a.pyc', 'a.py', 'b.py']) == {
+    'a.pyc', 'a.py' }
+
+  # literals with empty segments match the same as the translated pattern
+  patterns = ['//b', 'a//b', 'c/d']
+  globs = [PathMatcher(p)._glob for p in patterns]
+
+  for engine in ['re', 'nfa']:
+    m = CombinedMatcher(
+      [(j, glob, engine) for j, glob in enumerate(globs)],
+      basename = False)
+
+    assert m.literals == {tr_path(pxp('c/d')): 2}
+
+    for path in ['b', 'a/b', 'c/d', 'x/b']:
+      _path = tr_path(pxp(path))
+      expected = [j for j, p in enumerate(patterns) if PathMatcher(p)._match(_path)]
+      assert m(_path) == max(expected, default = -1), (engine, path)
+
+#===============================================================================
+def test_filter_cache():
+  from partis.pyproj.path.match import (
+    compile_glob,
+    combined_matcher )
+
+  patterns = ['__pycache__/', '*.py[cd]', '!/build/keep_*', 'docs/**/_build']
+
+  a = PathFilter(patterns)
+  hits = compile_glob.cache_info().hits
+  b = PathFilter(patterns, start = pxp('src'))
+
+  assert compile_glob.cache_info().hits > hits
+  assert a.patterns[1]._rec is b.patterns[1]._rec
+
+  # filters with the same patterns share the same matchers
+  assert [m for _, *m in a._combined] == [m for _, *m in b._combined]
+  assert a._combined[0][1] is b._combined[0][1]
+
+  # invalid patterns are not cached
+  for i in range(2):
+    with raises(PatternError):
+      PathFilter(['a[]'])
+
 #===============================================================================
 def test_file_ignore_patterns():
   ignore_patterns = combine_ignore_patterns(
@@ -308,6 +407,323 @@ def test_file_ignore_patterns():
 
     assert ignore_patterns('z/x', ['y'])
 
+#===============================================================================
+def test_scandir_lazy(monkeypatch):
+  from partis.pyproj.path import (
+    FileInfo,
+    DirInfo,
+    scandir_recursive )
+  from partis.pyproj.path import scandir as _scandir
+
+  scanned = []
+  os_scandir = _scandir.os_scandir
+
+  def _os_scandir(path):
+    scanned.append(pathlib.Path(path).name)
+    return os_scandir(path)
+
+  monkeypatch.setattr(_scandir, 'os_scandir', _os_scandir)
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    for d in ['src/pkg/sub', 'build/tmp', 'docs']:
+      os.makedirs(osp.join(tmpdir, d))
+
+    for f in ['src/pkg/a.py', 'src/pkg/sub/b.py', 'build/tmp/c.o', 'docs/d.md']:
+      with open(osp.join(tmpdir, f), 'w') as fp:
+        fp.write('x')
+
+    root = scandir_recursive(tmpdir)
+    assert isinstance(root, DirInfo)
+    assert scanned == []
+
+    assert type(root.get('src/pkg/a.py')) is FileInfo
+    assert scanned == [pathlib.Path(tmpdir).name, 'src', 'pkg']
+
+    matches = root.get('src').glob(
+      PathFilter(['*.py']),
+      exclude = PathFilter(['sub/']),
+      dirpath = prp('src'))
+
+    assert [str(pxp(p)) for p, _ in matches] == ['src/pkg/a.py']
+    # neither excluded nor untouched directories are ever scanned
+    assert 'sub' not in scanned
+    assert 'build' not in scanned
+    assert 'tmp' not in scanned
+    assert 'docs' not in scanned
+
+    with raises(FileNotFoundError):
+      root.get('src/missing.py')
+
+    assert set(root.dirs.keys()) == {'src', 'build', 'docs'}
+    assert 'build' not in scanned
+
+#===============================================================================
+def test_scandir_iglob(monkeypatch):
+  from partis.pyproj.path import (
+    FileInfo,
+    scandir_recursive )
+  from partis.pyproj.path import scandir as _scandir
+
+  scanned = []
+  os_scandir = _scandir.os_scandir
+
+  def _os_scandir(path):
+    scanned.append(pathlib.Path(path).name)
+    return os_scandir(path)
+
+  monkeypatch.setattr(_scandir, 'os_scandir', _os_scandir)
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    for d in ['a/b/c', 'a/d', 'e']:
+      os.makedirs(osp.join(tmpdir, d))
+
+    for f in ['x.py', 'a/x.py', 'a/y.txt', 'a/b/x.py', 'a/b/c/x.py', 'a/d/x.py', 'e/x.py']:
+      with open(osp.join(tmpdir, f), 'w') as fp:
+        fp.write('x')
+
+    include = PathFilter(['*.py', 'd/'])
+    exclude = PathFilter(['c/'])
+
+    expected = scandir_recursive(tmpdir).glob(include, exclude, dirpath = prp('src'))
+
+    assert sorted(str(pxp(p)) for p, _ in expected) == [
+      'src/a/b/x.py',
+      'src/a/d/x.py',
+      'src/a/x.py',
+      'src/e/x.py',
+      'src/x.py']
+
+    scanned.clear()
+    it = scandir_recursive(tmpdir).iglob(include, exclude, dirpath = prp('src'))
+
+    # files in a directory are yielded before any sub-directory is scanned
+    path, info = next(it)
+    assert path == prp('src/x.py')
+    assert type(info) is FileInfo
+    assert scanned == [pathlib.Path(tmpdir).name]
+
+    assert [(path, info)] + list(it) == expected
+    assert 'c' not in scanned
+
+#===============================================================================
+def test_scandir_exclude(monkeypatch):
+  from partis.pyproj.path import (
+    FileInfo,
+    DirInfo,
+    scandir_recursive )
+  from partis.pyproj.path import scandir as _scandir
+
+  scanned = []
+  os_scandir = _scandir.os_scandir
+
+  def _os_scandir(path):
+    scanned.append(pathlib.Path(path).name)
+    return os_scandir(path)
+
+  monkeypatch.setattr(_scandir, 'os_scandir', _os_scandir)
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    for d in ['src/pkg/__pycache__', 'src/build', 'build/lib']:
+      os.makedirs(osp.join(tmpdir, d))
+
+    for f in [
+        'a.py',
+        'a.pyc',
+        'src/pkg/a.py',
+        'src/pkg/__pycache__/a.pyc',
+        'src/build/b.py',
+        'build/lib/c.py']:
+
+      with open(osp.join(tmpdir, f), 'w') as fp:
+        fp.write('x')
+
+    root = scandir_recursive(
+      tmpdir,
+      exclude = PathFilter(['/build/', '__pycache__/', '*.pyc']))
+
+    matches = root.glob(PathFilter(['**']))
+
+    assert sorted(str(pxp(p)) for p, _ in matches) == [
+      'a.py',
+      'src/build/b.py',
+      'src/pkg/a.py']
+
+    assert root.pruned == {'build', 'a.pyc'}
+    assert root.get('src/pkg').pruned == {'__pycache__'}
+    assert '__pycache__' not in scanned
+    assert 'lib' not in scanned
+
+    # still available when explicitly requested
+    assert type(root.get('a.pyc')) is FileInfo
+    assert type(root.get('build/lib/c.py')) is FileInfo
+    assert 'build' not in root.pruned
+    assert isinstance(root.dirs['build'], DirInfo)
+
+#===============================================================================
+def test_scandir_workers(monkeypatch):
+  from partis.pyproj.path import (
+    scandir_recursive )
+  from partis.pyproj.path import scandir as _scandir
+
+  def as_dict(info):
+    return (
+      list(info.files.keys()),
+      {k: as_dict(v) for k, v in info.dirs.items()},
+      info.pruned)
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    for i in range(6):
+      for j in range(5):
+        d = osp.join(tmpdir, f'd{i}', f'e{j}')
+        os.makedirs(osp.join(d, 'f'))
+
+        with open(osp.join(d, 'f', 'x.py'), 'w') as fp:
+          fp.write('x')
+
+    os.makedirs(osp.join(tmpdir, 'd0', 'build', 'g'))
+
+    exclude = PathFilter(['build/'])
+    serial = scandir_recursive(tmpdir, exclude = exclude)
+    expected = as_dict(serial)
+
+    for serial_max in [0, 4, 1000]:
+      monkeypatch.setattr(_scandir, 'SCAN_SERIAL_MAX', serial_max)
+
+      info = scandir_recursive(tmpdir, exclude = exclude, workers = 4)
+      # all directories have already been scanned
+      monkeypatch.setattr(_scandir, 'os_scandir', None)
+      assert as_dict(info) == expected
+      monkeypatch.undo()
+
+    info = scandir_recursive(tmpdir, exclude = exclude)
+    assert info.get('d1').scan(3) is info.get('d1')
+    monkeypatch.setattr(_scandir, 'os_scandir', None)
+    assert as_dict(info.get('d1')) == expected[1]['d1']
+
+#===============================================================================
+def test_scandir_cache(tmp_path, monkeypatch):
+  from partis.pyproj.cache import ScanCache
+  from partis.pyproj.path import (
+    scandir_recursive )
+  from partis.pyproj.path import scandir as _scandir
+
+  root = tmp_path/'root'
+  (root/'a'/'b').mkdir(parents = True)
+  (root/'a'/'b'/'x.py').write_text('x')
+  (root/'a'/'y.py').write_text('y')
+  (root/'z.py').write_text('z')
+
+  # directories modified too recently are not cached
+  for d in [root, root/'a', root/'a'/'b']:
+    os.utime(d, ns = (0, 10**18))
+
+  cache_file = tmp_path/'cache'/'dirs.json'
+
+  def as_dict(info):
+    return (
+      {k: v.size for k, v in info.files.items()},
+      {k: as_dict(v) for k, v in info.dirs.items()})
+
+  cache = ScanCache(cache_file)
+  expected = as_dict(scandir_recursive(root, cache = cache))
+  cache.save()
+  assert cache_file.exists()
+
+  # the cached listings are used instead of scanning the directories
+  monkeypatch.setattr(_scandir, 'os_scandir', None)
+  (root/'z.py').write_text('zzz')
+  os.utime(root, ns = (0, 10**18))
+
+  info = scandir_recursive(root, cache = ScanCache(cache_file))
+  assert as_dict(info)[1] == expected[1]
+  # files are still stat'ed
+  assert info.files['z.py'].size == 3
+
+  cache = ScanCache(cache_file, trusted = True)
+  cache._now += 10
+  info = scandir_recursive(root, cache = cache)
+  assert as_dict(info) == expected
+  # unchanged entries that were recently used are not written again
+  assert not cache._modified
+
+  # modified directory is scanned again
+  monkeypatch.undo()
+  (root/'a'/'w.py').write_text('w')
+
+  info = scandir_recursive(root, cache = ScanCache(cache_file, trusted = True))
+  assert set(info.get('a').files.keys()) == {'y.py', 'w.py'}
+
+#===============================================================================
+def test_match_nfa(monkeypatch):
+  import random
+  from partis.pyproj.path import match
+
+  # the same cases with the automaton engine as the default
+  monkeypatch.setattr(match, 'PATTERN_ENGINE', 'nfa')
+  assert PathMatcher('a*b').engine == 'nfa'
+
+  for test in [
+      test_match_escape,
+      test_match_chr,
+      test_match_chrset,
+      test_match_any,
+      test_match,
+      test_match_recurse,
+      test_filter,
+      test_filter_combined,
+      test_file_ignore_patterns]:
+
+    test()
+
+  monkeypatch.undo()
+
+  with raises(ValueError):
+    PathMatcher('a', engine = 'dfa')
+
+  # a set, negated or not, never matches the separator
+  for pattern, path in [
+      ('*[!a]*b', 'ca/xb'),
+      ('*[!a]*b', 'a/xb'),
+      ('*[!a]*b', 'xa/xb'),
+      ('*[!a]*b', 'ca/b'),
+      ('[!a]b', '/b'),
+      ('x/*[!a]*b', 'x/ca/xb'),
+      ('x/*[!a]*b', 'x/a/xb')]:
+
+    assert not PathMatcher(pattern).match(path), (pattern, path)
+    assert not PathMatcher(pattern, engine = 'nfa').match(path), (pattern, path)
+
+  assert PathMatcher('*[!a]*b').match('cxb')
+  assert PathMatcher('*[!a]*b', engine = 'nfa').match('cxb')
+
+  # compare the engines on random patterns and paths
+  rnd = random.Random(0)
+  atoms = ['a', 'b', 'ab', '*', '?', '[ab]', '[!a]', 'a*b', '*[!a]*b', r'\*', '**']
+  names = ['a', 'b', 'ab', 'ba', 'aab', '*', 'x', '']
+
+  for _ in range(500):
+    pattern = '/'.join(rnd.choice(atoms) for _ in range(rnd.randint(1, 4)))
+
+    try:
+      p_re = PathMatcher(pattern)
+    except PatternError:
+      with raises(PatternError):
+        PathMatcher(pattern, engine = 'nfa')
+
+      continue
+
+    p_nfa = PathMatcher(pattern, engine = 'nfa')
+
+    for _ in range(20):
+      path = '/'.join(rnd.choice(names) for _ in range(rnd.randint(1, 5)))
+      _path = tr_path(pxp(path))
+      assert bool(p_re._match(_path)) == p_nfa._match(_path), (pattern, path)
+
+  # linear time for patterns that are slow with backtracking
+  p = PathMatcher('**/a*b*c*d/**', engine = 'nfa')
+  assert not p.posix('/'.join(['abc'*200 + 'x']*50))
+  assert p.posix('x/' + 'abc'*200 + 'd/y')
+
 #===============================================================================
 if __name__ == '__main__':
   test_match_any()
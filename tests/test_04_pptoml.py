@@ -3,7 +3,8 @@ from pytest import (
 from partis.pyproj import (
   ValidationError)
 from partis.pyproj.pptoml import (
-  dependency_groups)
+  dependency_groups,
+  pyproj_dist_binary)
 
 #===============================================================================
 def test_dependency_groups():
@@ -40,6 +41,33 @@ def test_dependency_groups():
     # include groups cannot be recursive
     dependency_groups({'foo': [{'include-group': "foo"}]})
 
+#===============================================================================
+def test_dist_binary_compress():
+  binary = pyproj_dist_binary({})
+  assert binary.compress_level == 6
+  assert binary.compress == []
+  assert not binary.compress_detect
+
+  binary = pyproj_dist_binary({
+    'compress_level': 9,
+    'compress': [
+      '*.gz',
+      {'glob': ['*.txt', 'data/*.csv'], 'level': 1}],
+    'compress_detect': True })
+
+  assert binary.compress[0].glob == ['*.gz']
+  assert binary.compress[0].level == 0
+  assert binary.compress[1].glob == ['*.txt', 'data/*.csv']
+  assert binary.compress[1].level == 1
+
+  with raises(ValidationError):
+    pyproj_dist_binary({'compress_level': 10})
+
+  with raises(ValidationError):
+    # patterns are required
+    pyproj_dist_binary({'compress': [{'level': 1}]})
+
 #===============================================================================
 if __name__ == '__main__':
   test_dependency_groups()
+  test_dist_binary_compress()
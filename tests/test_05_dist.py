@@ -4,7 +4,9 @@ import tempfile
 import shutil
 
 from pytest import (
-  raises )
+  raises,
+  mark,
+  skip )
 
 from pathlib import (
   Path,
@@ -18,7 +20,8 @@ from partis.pyproj import (
   dist_zip,
   dist_source_targz,
   dist_source_dummy,
-  dist_binary_wheel )
+  dist_binary_wheel,
+  dist_binary_metadata )
 
 #===============================================================================
 def test_dist_base():
@@ -116,6 +119,14 @@ def test_dist_targz():
       dist.write('stuff', 'stuff content')
 
       assert dist.exists('stuff')
+      assert dist.exists(PurePosixPath('stuff'))
+      assert not dist.exists('stuff/other')
+
+      dist.write_link('link', 'stuff')
+      assert dist.exists('link')
+
+      with raises(ValueError):
+        dist.write('stuff', 'other content', record = False)
 
       dist.assert_recordable()
 
@@ -329,3 +340,544 @@ def test_dist_binary_wheel():
       bdist.copytree(
         src = pkg_dir,
         dst = 'my_package' )
+
+#===============================================================================
+def test_dist_stream():
+  import hashlib
+  import tarfile
+  import tracemalloc
+  import zipfile
+  from partis.pyproj import b64_nopad
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    tmpdir = Path(tmpdir)
+    src_file = tmpdir/'large.bin'
+    size = 2**23
+
+    with open(src_file, 'wb') as fp:
+      for i in range(size // 2**16):
+        fp.write(os.urandom(2**12)*16)
+
+    content = src_file.read_bytes()
+    digest = (b64_nopad(hashlib.sha256(content).digest()), size)
+    del content
+
+    for cls, name in [(dist_zip, 'asd.zip'), (dist_targz, 'asd.tgz')]:
+      tracemalloc.start()
+
+      try:
+        with cls(outname = name, outdir = tmpdir) as dist:
+          dist.copyfile(src_file, 'large.bin')
+          # equivalent file is skipped
+          dist.copyfile(src_file, 'large.bin')
+
+        _, peak = tracemalloc.get_traced_memory()
+
+      finally:
+        tracemalloc.stop()
+
+      # file is never read into memory as a whole
+      assert peak < size // 4
+      assert dist.records[PurePosixPath('large.bin')] == digest
+
+      if cls is dist_zip:
+        with zipfile.ZipFile(dist.outpath) as fp:
+          assert fp.read('large.bin') == src_file.read_bytes()
+          assert len(fp.infolist()) == 1
+      else:
+        with tarfile.open(dist.outpath) as fp:
+          assert fp.extractfile('large.bin').read() == src_file.read_bytes()
+          assert len(fp.getmembers()) == 1
+
+#===============================================================================
+def test_dist_zip_workers():
+  from partis.pyproj.dist_file.dist_zip import PARALLEL_MAX_SIZE
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    tmpdir = Path(tmpdir)
+    src_dir = tmpdir/'src'
+    src_dir.mkdir()
+
+    for i in range(200):
+      (src_dir/f'file_{i:03d}.py').write_text(f"print({i})\n"*(i*10))
+
+    # larger than the parallel limit, must be streamed in-order
+    with open(src_dir/'large.bin', 'wb') as fp:
+      fp.write((b'0123456789'*1000 + os.urandom(100))*(PARALLEL_MAX_SIZE//10000))
+
+    (src_dir/'link').symlink_to('file_000.py')
+
+    outputs = []
+
+    for workers in [1, 4]:
+      with dist_zip(
+        outname = f'out_{workers}.zip',
+        outdir = tmpdir,
+        workers = workers ) as dist:
+
+        assert dist.workers == workers
+        dist.copytree(src_dir, 'src')
+        # pending entries are visible before being appended
+        assert dist.exists('src/file_199.py')
+        dist.write('extra.txt', 'extra')
+
+        with raises(ValueError):
+          dist.write('extra.txt', 'other', record = False)
+
+      outputs.append(dist.outpath.read_bytes())
+
+    assert outputs[0] == outputs[1]
+
+#===============================================================================
+def test_dist_targz_workers():
+  import gzip
+  import tarfile
+  from io import BytesIO
+  from partis.pyproj.dist_file.dist_targz import (
+    GZIP_BLOCKSIZE,
+    ParallelGzipWriter )
+
+  # exactly on a block boundary, and empty, must still terminate the stream
+  for data in [
+    b'',
+    b'x'*GZIP_BLOCKSIZE,
+    (b'0123456789'*1000 + os.urandom(100))*100 ]:
+
+    outputs = []
+
+    for workers in [2, 4]:
+      fp = BytesIO()
+
+      with ParallelGzipWriter(fp, compresslevel = 6, workers = workers) as gz:
+        for i in range(0, len(data), 1000):
+          gz.write(data[i:i+1000])
+
+        assert gz.tell() == len(data)
+
+      assert gzip.decompress(fp.getvalue()) == data
+      outputs.append(fp.getvalue())
+
+    assert outputs[0] == outputs[1]
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    tmpdir = Path(tmpdir)
+    src_dir = tmpdir/'src'
+    src_dir.mkdir()
+
+    for i in range(100):
+      (src_dir/f'file_{i:03d}.py').write_text(f"print({i})\n"*(i*100))
+
+    for workers in [1, 4]:
+      with dist_targz(
+        outname = f'out_{workers}.tar.gz',
+        outdir = tmpdir,
+        compresslevel = 1,
+        workers = workers ) as dist:
+
+        dist.copytree(src_dir, 'src')
+
+      with tarfile.open(dist.outpath, 'r:gz') as tf:
+        for i in range(100):
+          assert tf.extractfile(f'src/file_{i:03d}.py').read() == (
+            (src_dir/f'file_{i:03d}.py').read_bytes())
+
+#===============================================================================
+def test_dist_zip_compress():
+  import zipfile
+
+  text = b"print('hello')\n"*1000
+  noise = os.urandom(100000)
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    tmpdir = Path(tmpdir)
+
+    with dist_zip(
+      outname = 'out.zip',
+      outdir = tmpdir,
+      compresslevel = 9,
+      compress_rules = [
+        (['*.gz', 'pkg/data/*.bin'], 0),
+        (['pkg/data/fast.bin'], 1)],
+      compress_detect = True ) as dist:
+
+      dist.write('module.py', text)
+      dist.write('archive.gz', text)
+      dist.write('pkg/archive.gz', text)
+      dist.write('pkg/data/a.bin', text)
+      dist.write('pkg/data/fast.bin', text)
+      dist.write('other/data/a.bin', text)
+      dist.write('noise.dat', noise)
+      dist.write('empty.dat', b'')
+      dist.write_link('pkg/link.gz', 'archive.gz')
+
+    with zipfile.ZipFile(dist.outpath) as zf:
+      types = {
+        zinfo.filename: zinfo.compress_type
+        for zinfo in zf.infolist() }
+
+      assert zf.read('noise.dat') == noise
+      assert zf.read('pkg/data/fast.bin') == text
+      assert zf.read('pkg/link.gz') == b'archive.gz'
+
+    assert types == {
+      'module.py': zipfile.ZIP_DEFLATED,
+      'archive.gz': zipfile.ZIP_STORED,
+      'pkg/archive.gz': zipfile.ZIP_STORED,
+      'pkg/data/a.bin': zipfile.ZIP_STORED,
+      'pkg/data/fast.bin': zipfile.ZIP_DEFLATED,
+      'other/data/a.bin': zipfile.ZIP_DEFLATED,
+      'noise.dat': zipfile.ZIP_STORED,
+      'empty.dat': zipfile.ZIP_DEFLATED,
+      'pkg/link.gz': zipfile.ZIP_STORED }
+
+    # a level of 0 stores every member, including links
+    with dist_zip(
+      outname = 'stored.zip',
+      outdir = tmpdir,
+      compresslevel = 0 ) as dist:
+
+      dist.write('module.py', text)
+      dist.write_link('link', 'module.py')
+
+    with zipfile.ZipFile(dist.outpath) as zf:
+      assert {
+        zinfo.filename: zinfo.compress_type
+        for zinfo in zf.infolist() } == {
+          'module.py': zipfile.ZIP_STORED,
+          'link': zipfile.ZIP_STORED }
+
+#===============================================================================
+def test_dist_replace(monkeypatch):
+  import errno
+  from partis.pyproj import file
+
+  umask = os.umask(0)
+  os.umask(umask)
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    tmpdir = Path(tmpdir)
+    out_dir = tmpdir/'out'
+
+    for outname, cls in [('out.zip', dist_zip), ('out.tar.gz', dist_targz)]:
+      with cls(outname = outname, outdir = out_dir) as dist:
+        dist.write('a.txt', 'a')
+        # temporary file is created next to the final file
+        assert dist._tmp_path.parent == out_dir
+
+      assert not dist.outpath.stat().st_mode & 0o777 & umask
+
+    assert sorted(os.listdir(out_dir)) == ['out.tar.gz', 'out.zip']
+
+    # simulate temporary directory on a different device
+    data = os.urandom(100000)
+    _replace = os.replace
+
+    def replace(src, dst):
+      if Path(src).parent != Path(dst).parent:
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+      _replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', replace)
+
+    for fallback in [None, 'copy_file_range', 'sendfile', 'fcntl']:
+      if fallback == 'fcntl':
+        monkeypatch.setattr(file, 'fcntl', None)
+      elif fallback:
+        monkeypatch.delattr(os, fallback, raising = False)
+
+      src = tmpdir/'src.bin'
+      src.write_bytes(data)
+      dst = out_dir/'dst.bin'
+
+      file.replace_file(src, dst)
+
+      assert dst.read_bytes() == data
+      assert not src.exists()
+
+    assert sorted(os.listdir(out_dir)) == ['dst.bin', 'out.tar.gz', 'out.zip']
+
+#===============================================================================
+def test_dist_hash_cache(tmp_path):
+  import json
+  from partis.pyproj.cache import HashCache
+  from partis.pyproj.norms import hash_sha256
+
+  src_dir = tmp_path/'src'
+  src_dir.mkdir()
+  old = tmp_path/'src'/'old.txt'
+  new = tmp_path/'src'/'new.txt'
+  old.write_text('old')
+  new.write_text('new')
+  # only files not modified recently are cached
+  os.utime(old, ns = (0, 10**18))
+
+  cache_file = tmp_path/'cache'/'sha256.json'
+
+  def build():
+    with dist_zip(
+      outname = 'out.zip',
+      outdir = tmp_path,
+      hash_cache = HashCache(cache_file) ) as dist:
+
+      dist.copytree(src_dir, 'src')
+
+    return dist.records
+
+  records = build()
+  assert records[PurePosixPath('src/old.txt')] == hash_sha256(b'old')
+
+  data = json.loads(cache_file.read_text())
+  st = old.stat()
+  key = f"{st.st_dev}:{st.st_ino}"
+  assert list(data['entries']) == [key]
+
+  # cached hash is used when the stat is unchanged
+  data['entries'][key][2] = 'cached'
+  cache_file.write_text(json.dumps(data))
+
+  records = build()
+  assert records[PurePosixPath('src/old.txt')] == ('cached', 3)
+
+  # changed file evicts the entry
+  old.write_text('changed')
+  os.utime(old, ns = (0, 11*10**17))
+
+  records = build()
+  assert records[PurePosixPath('src/old.txt')] == hash_sha256(b'changed')
+
+  data = json.loads(cache_file.read_text())
+  assert data['entries'][key][:3] == [7, 11*10**17, hash_sha256(b'changed')[0]]
+
+  # invalid cache is ignored
+  cache_file.write_text('{')
+  records = build()
+  assert records[PurePosixPath('src/old.txt')] == hash_sha256(b'changed')
+
+#===============================================================================
+def test_hash_cache_used(tmp_path):
+  from partis.pyproj.cache import HashCache
+
+  file = tmp_path/'file.txt'
+  file.write_text('a')
+  os.utime(file, ns = (0, 10**18))
+  st = file.stat()
+
+  cache_file = tmp_path/'cache'/'sha256.json'
+  cache = HashCache(cache_file)
+  cache.set(st, ('hash', 1))
+  cache.save()
+
+  # a hit does not modify the cache while recently used
+  cache = HashCache(cache_file)
+  assert cache.get(st) == ('hash', 1)
+  assert not cache._modified
+
+  # but the time of use is refreshed once older than the resolution
+  cache = HashCache(cache_file)
+  cache._now += cache.used_resolution
+  assert cache.get(st) == ('hash', 1)
+  assert cache._modified
+
+#===============================================================================
+def test_dist_binary_wheel_incremental(tmp_path, monkeypatch):
+  import sys
+  # NOTE: the module is shadowed by the class of the same name
+  _dist_zip = sys.modules['partis.pyproj.dist_file.dist_zip']
+
+  pkg_dir = tmp_path/'src'/'my_package'
+  pkg_dir.mkdir(parents = True)
+
+  for i in range(20):
+    (pkg_dir/f'module_{i}.py').write_text(f"print({i})\n"*(i*100))
+
+  # larger than the parallel limit, copied by streaming
+  (pkg_dir/'large.bin').write_bytes(b'0123456789'*(_dist_zip.PARALLEL_MAX_SIZE//5))
+
+  pkg_info = PkgInfo(
+    project = dict(
+      name = 'my-package',
+      version = '1.0' ) )
+
+  written = []
+  write_zinfo = _dist_zip.dist_zip.write_zinfo
+
+  def _write_zinfo(self, zinfo, *args, **kwargs):
+    written.append(zinfo.filename)
+    return write_zinfo(self, zinfo, *args, **kwargs)
+
+  monkeypatch.setattr(_dist_zip.dist_zip, 'write_zinfo', _write_zinfo)
+
+  def build(out_dir, incremental, workers, compresslevel = None):
+    written.clear()
+
+    with dist_binary_wheel(
+      pkg_info = pkg_info,
+      outdir = out_dir,
+      incremental = incremental,
+      workers = workers,
+      compresslevel = compresslevel ) as dist:
+
+      dist.copytree(pkg_dir, 'my_package')
+
+    return dist.outpath.read_bytes()
+
+  for workers in [1, 4]:
+    out_dir = tmp_path/f'out_{workers}'
+    build(out_dir, True, workers)
+    assert 'my_package/module_1.py' in written
+
+    (pkg_dir/'module_1.py').write_text("print('changed')")
+
+    reused = build(out_dir, True, workers)
+    # only the changed file, and RECORD (not itself recorded), are compressed
+    assert set(written) == {'my_package/module_1.py', 'my_package-1.0.dist-info/RECORD'}
+
+    # same result as building from scratch
+    assert reused == build(tmp_path/f'new_{workers}', False, workers)
+
+    (pkg_dir/'module_1.py').write_text(f"print(1)\n"*100)
+
+    # a different compression level does not reuse any compressed files
+    reused = build(out_dir, True, workers, compresslevel = 1)
+    assert 'my_package/module_2.py' in written
+    assert reused == build(tmp_path/f'new_{workers}', False, workers, compresslevel = 1)
+
+    reused = build(out_dir, True, workers, compresslevel = 1)
+    assert set(written) == {'my_package-1.0.dist-info/RECORD'}
+    assert reused == build(tmp_path/f'new_{workers}', False, workers, compresslevel = 1)
+
+    # levels of a wheel replaced by a build that is not incremental are removed
+    assert len(list(out_dir.glob('.*.levels.json'))) == 1
+    build(out_dir, False, workers)
+    assert not list(out_dir.glob('.*.levels.json'))
+    build(out_dir, True, workers)
+    assert 'my_package/module_2.py' in written
+
+#===============================================================================
+@mark.parametrize('raw', [True, False])
+def test_dist_zip_raw(tmp_path, monkeypatch, caplog, raw):
+  import sys
+  import logging
+  import zipfile
+  _dist_zip = sys.modules['partis.pyproj.dist_file.dist_zip']
+
+  if raw and not _dist_zip.ZIP_RAW:
+    skip("zipfile internals not supported")
+
+  # without raw writes, the archive is written only through the public API
+  monkeypatch.setattr(_dist_zip, 'ZIP_RAW', raw)
+  monkeypatch.setattr(_dist_zip, '_zip_raw_warned', set())
+
+  src_dir = tmp_path/'src'
+  src_dir.mkdir()
+
+  for i in range(20):
+    (src_dir/f'file_{i:02d}.py').write_text(f"print({i})\n"*(i*100))
+
+  (src_dir/'large.bin').write_bytes(b'0123456789'*(_dist_zip.PARALLEL_MAX_SIZE//5))
+
+  def build(previous = None):
+    with dist_zip(
+      outname = 'out.zip',
+      outdir = tmp_path/'out',
+      workers = 4 ) as dist:
+
+      if previous is not None:
+        assert dist.reuse(previous, records, levels) == raw
+
+      dist.copytree(src_dir, 'src')
+
+    return dist
+
+  with caplog.at_level(logging.WARNING):
+    dist = build()
+    records = dict(dist.records)
+    levels = dict(dist.compress_levels)
+    previous = tmp_path/'previous.zip'
+    shutil.copyfile(dist.outpath, previous)
+
+    # entries copied from the previous file
+    (src_dir/'file_01.py').write_text("print('changed')")
+    dist = build(previous)
+
+  # settings that are ignored are warned about only once
+  warnings = [
+    r.message for r in caplog.records
+    if r.levelno == logging.WARNING ]
+
+  if raw:
+    assert not warnings
+  else:
+    assert len(warnings) == 2
+    assert "'workers'" in warnings[0]
+    assert "'incremental'" in warnings[1]
+
+  with zipfile.ZipFile(dist.outpath) as zf:
+    assert zf.testzip() is None
+
+    for file in src_dir.iterdir():
+      assert zf.read(f'src/{file.name}') == file.read_bytes()
+
+#===============================================================================
+def test_dist_binary_metadata(tmp_path):
+  import zipfile
+
+  (tmp_path/'license.rst').write_text("my license")
+
+  pkg_info = PkgInfo(
+    root = tmp_path,
+    project = dict(
+      name = 'my-package',
+      version = '1.0',
+      license = { 'file' : 'license.rst' },
+      scripts = { 'my-script': 'my_package:main' } ) )
+
+  with dist_binary_wheel(
+    pkg_info = pkg_info,
+    outdir = tmp_path/'wheel' ) as wheel:
+    pass
+
+  with zipfile.ZipFile(wheel.outpath) as zf:
+    expected = {
+      name: zf.read(name)
+      for name in zf.namelist() }
+
+  with dist_binary_metadata(
+    pkg_info = pkg_info,
+    outdir = tmp_path/'metadata' ) as dist:
+
+    assert dist.exists(dist.dist_info_path/'top_level.txt') is False
+
+  files = {
+    path.relative_to(tmp_path/'metadata').as_posix(): path.read_bytes()
+    for path in (tmp_path/'metadata').rglob('*')
+    if path.is_file() }
+
+  assert files == expected
+  assert dist.record_hash == wheel.record_hash
+  assert not dist.outpath.exists()
+
+  # other entries are also written into the metadata directory
+  def add_files(dist):
+    info = dist.dist_info_path
+    dist.makedirs(info/'extra')
+    dist.copyfile(tmp_path/'license.rst', info/'extra'/'license.rst')
+    dist.write_link(info/'extra'/'link.rst', 'license.rst')
+
+  with dist_binary_wheel(
+    pkg_info = pkg_info,
+    outdir = tmp_path/'wheel_extra' ) as wheel:
+    add_files(wheel)
+
+  with dist_binary_metadata(
+    pkg_info = pkg_info,
+    outdir = tmp_path/'metadata_extra' ) as dist:
+    add_files(dist)
+
+    assert dist.exists(dist.dist_info_path/'extra'/'link.rst')
+
+  extra = tmp_path/'metadata_extra'/dist.dist_info_path/'extra'
+  assert (extra/'license.rst').read_text() == "my license"
+  assert os.readlink(extra/'link.rst') == 'license.rst'
+  assert dist.record_hash == wheel.record_hash
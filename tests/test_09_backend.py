@@ -55,3 +55,123 @@ def test_backend_basic():
 
   finally:
     os.chdir( cwd )
+
+#===============================================================================
+def test_backend_workers(monkeypatch):
+  root = osp.join(osp.dirname(osp.abspath(__file__)), 'pkg_base' )
+
+  assert backend_init(root = root).backend_settings.workers == 1
+
+  pyproj = backend_init(
+    root = root,
+    config_settings = {'pyproj.workers': '3'})
+
+  assert pyproj.backend_settings.workers == 3
+  # build targets are run concurrently only by a separate setting
+  assert pyproj.backend_settings.target_workers == 1
+
+  monkeypatch.setenv('PARTIS_PYPROJ_TARGET_WORKERS', '2')
+  assert backend_init(root = root).backend_settings.target_workers == 2
+  monkeypatch.delenv('PARTIS_PYPROJ_TARGET_WORKERS')
+
+  monkeypatch.setenv('PARTIS_PYPROJ_WORKERS', 'auto')
+  assert backend_init(root = root).backend_settings.workers >= 1
+
+  monkeypatch.setenv('PARTIS_PYPROJ_WORKERS', '0x')
+
+  with raises(ValueError):
+    backend_init(root = root)
+
+  monkeypatch.delenv('PARTIS_PYPROJ_WORKERS')
+
+  cwd = os.getcwd()
+
+  try:
+    os.chdir( root )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      outputs = []
+
+      for workers in ['1', '4']:
+        out_dir = osp.join(tmpdir, workers)
+        name = build_wheel(
+          wheel_directory = out_dir,
+          config_settings = {'pyproj.workers': workers})
+
+        with open(osp.join(out_dir, name), 'rb') as fp:
+          outputs.append(fp.read())
+
+      # parallel compression is identical to serial
+      assert outputs[0] == outputs[1]
+
+      out_dir = osp.join(tmpdir, 'sdist')
+      name = build_sdist(
+        dist_directory = out_dir,
+        config_settings = {'pyproj.workers': '4'})
+
+      import tarfile
+
+      with tarfile.open(osp.join(out_dir, name), 'r:gz') as tf:
+        assert any(n.endswith('PKG-INFO') for n in tf.getnames())
+
+  finally:
+    os.chdir( cwd )
+
+#===============================================================================
+def test_backend_hash_cache(tmp_path, monkeypatch):
+  from partis.pyproj import cache
+
+  monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path/'cache')
+  root = osp.join(osp.dirname(osp.abspath(__file__)), 'pkg_base' )
+
+  assert not backend_init(root = root).backend_settings.hash_cache
+
+  monkeypatch.setenv('PARTIS_PYPROJ_HASH_CACHE', 'true')
+  assert backend_init(root = root).backend_settings.hash_cache
+
+  cwd = os.getcwd()
+
+  try:
+    os.chdir( root )
+    outputs = []
+
+    for i in range(2):
+      out_dir = tmp_path/str(i)
+      name = build_wheel(wheel_directory = out_dir)
+      outputs.append((out_dir/name).read_bytes())
+
+    assert outputs[0] == outputs[1]
+    assert (tmp_path/'cache'/'hash'/'sha256.json').exists()
+
+  finally:
+    os.chdir( cwd )
+
+#===============================================================================
+def test_backend_scan_cache(tmp_path, monkeypatch):
+  from partis.pyproj import cache
+
+  monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path/'cache')
+  root = osp.join(osp.dirname(osp.abspath(__file__)), 'pkg_base' )
+
+  assert backend_init(root = root).scan_cache is None
+
+  monkeypatch.setenv('PARTIS_PYPROJ_SCAN_CACHE', 'trusted')
+  assert backend_init(root = root).scan_cache.trusted
+
+  cwd = os.getcwd()
+
+  try:
+    os.chdir( root )
+    outputs = []
+
+    for i in range(2):
+      out_dir = tmp_path/str(i)
+      build_sdist(out_dir)
+      name = build_wheel(wheel_directory = out_dir)
+      outputs.append((out_dir/name).read_bytes())
+
+    assert outputs[0] == outputs[1]
+    assert (tmp_path/'cache'/'scan'/'dirs.json').exists()
+
+  finally:
+    os.chdir( cwd )
@@ -37,3 +37,202 @@ def test_dist_iter_strip_and_replace(tmp_path):
   _, src_file, dst_file = items[0]
   assert src_file == file_path.relative_to(tmp_path)
   assert dst_file == PurePosixPath('dest') / 'original.dat'
+
+#===============================================================================
+def test_dist_iter_includes(tmp_path, monkeypatch):
+  from partis.pyproj.path import DirInfo
+
+  src = tmp_path / "source"
+
+  for d in ['a/b', 'c']:
+    (src/d).mkdir(parents=True)
+
+  for f in ['x.py', 'x.txt', 'a/y.py', 'a/y.txt', 'a/b/z.py', 'c/w.txt']:
+    (src/f).write_text("data")
+
+  copy_item = PyprojDistCopy({
+    'src': Path('source'),
+    'dst': Path('dest'),
+    'include': [
+      '**/*.txt',
+      {'glob': 'a/**/*.py', 'strip': 1},
+      'c/',
+      {'glob': '*.py', 'replace': '{0}.bak'}]})
+
+  calls = []
+  iglob_multi = DirInfo.iglob_multi
+
+  def _iglob_multi(self, includes, *args, **kwargs):
+    calls.append(len(includes))
+    return iglob_multi(self, includes, *args, **kwargs)
+
+  monkeypatch.setattr(DirInfo, 'iglob_multi', _iglob_multi)
+
+  items = list(dist_iter(
+    copy_items=[copy_item],
+    ignore=[],
+    root=tmp_path,
+    logger=logging.getLogger(__name__),
+  ))
+
+  # a single traversal for all includes
+  assert calls == [4]
+  assert {i for i, _, _ in items} == {0}
+
+  # in order of the includes
+  dst = [PurePosixPath(d).relative_to('dest') for _, _, d in items]
+  assert sorted(dst[:3]) == [
+    PurePosixPath(p) for p in ['a/y.txt', 'c/w.txt', 'x.txt']]
+
+  assert sorted(dst[3:5]) == [
+    PurePosixPath(p) for p in ['b/z.py', 'y.py']]
+
+  assert dst[5:] == [
+    PurePosixPath(p) for p in ['c/w.txt', 'x.py.bak', 'a/y.py.bak', 'a/b/z.py.bak']]
+
+#===============================================================================
+def test_dist_iter_scan_workers(tmp_path, monkeypatch):
+  import threading
+  from partis.pyproj.path import DirInfo
+  from partis.pyproj.path import scandir as _scandir
+
+  monkeypatch.setattr(_scandir, 'SCAN_SERIAL_MAX', 1)
+
+  for d in ['doc/a', 'doc/b', 'build/x/y', 'build/z']:
+    (tmp_path/d).mkdir(parents = True)
+    (tmp_path/d/'readme.md').write_text('data')
+
+  scanned = {}
+  _scan = DirInfo._scan
+
+  def _scan_record(self):
+    scanned[Path(self._path).relative_to(tmp_path).as_posix()] = threading.current_thread().name
+    return _scan(self)
+
+  monkeypatch.setattr(DirInfo, '_scan', _scan_record)
+
+  items = list(dist_iter(
+    copy_items = [PyprojDistCopy({
+      'src': Path('.'),
+      'dst': Path('dest'),
+      'include': ['*.md'],
+      'ignore': ['build/']})],
+    ignore = [],
+    root = tmp_path,
+    logger = logging.getLogger(__name__),
+    workers = 4))
+
+  assert len(items) == 2
+  # directories ignored by the copy item are never scanned
+  assert sorted(scanned) == ['.', 'doc', 'doc/a', 'doc/b']
+  assert scanned['doc/a'].startswith('scandir')
+
+#===============================================================================
+def test_dist_copy_workers(tmp_path, monkeypatch):
+  import zipfile
+  from partis.pyproj import dist_zip
+  from partis.pyproj.dist_file.dist_copy import (
+    dist_copy,
+    PREFETCH_MAX_SIZE)
+
+  monkeypatch.chdir(tmp_path)
+
+  src = tmp_path/'source'
+  src.mkdir()
+
+  for i in range(50):
+    (src/f'file_{i:02d}.txt').write_text(f"{i}\n"*i)
+
+  # too large to be read ahead
+  (src/'large.bin').write_bytes(b'x'*(PREFETCH_MAX_SIZE + 1))
+  (src/'link.txt').symlink_to('file_01.txt')
+
+  copy_items = [
+    PyprojDistCopy({'src': Path('source'), 'dst': Path('dest')})]
+
+  outputs = []
+
+  for workers in [1, 4]:
+    with dist_zip(
+      outname = f'out_{workers}.zip',
+      outdir = tmp_path/'out') as dist:
+
+      dist_copy(
+        base_path = PurePosixPath(),
+        copy_items = copy_items,
+        ignore = [],
+        dist = dist,
+        root = tmp_path,
+        workers = workers)
+
+    outputs.append(dist.outpath.read_bytes())
+
+    with zipfile.ZipFile(dist.outpath) as zf:
+      assert zf.read('dest/file_10.txt') == b"10\n"*10
+      assert zf.read('dest/large.bin') == (src/'large.bin').read_bytes()
+
+  # same order and content
+  assert outputs[0] == outputs[1]
+
+#===============================================================================
+def test_dist_copy_prefetch_budget(tmp_path, monkeypatch):
+  import sys
+  import threading
+  import zipfile
+  from partis.pyproj import dist_zip
+  # NOTE: the module is shadowed by the function of the same name
+  _dist_copy = sys.modules['partis.pyproj.dist_file.dist_copy']
+
+  monkeypatch.chdir(tmp_path)
+  monkeypatch.setattr(_dist_copy, 'PREFETCH_BUDGET', 5000)
+  monkeypatch.setattr(_dist_copy, 'PREFETCH_MIN_COST', 0)
+
+  src = tmp_path/'source'
+  src.mkdir()
+
+  for i in range(50):
+    (src/f'file_{i:02d}.txt').write_bytes(b'x'*1000)
+
+  # bytes read ahead but not yet written
+  lock = threading.Lock()
+  read = set()
+  written = set()
+  inflight = []
+  prefetch_file = _dist_copy.prefetch_file
+
+  def _prefetch_file(src, hash_cache = None):
+    with lock:
+      read.add(src.name)
+      inflight.append(1000*len(read - written))
+
+    return prefetch_file(src, hash_cache)
+
+  monkeypatch.setattr(_dist_copy, 'prefetch_file', _prefetch_file)
+
+  with dist_zip(
+    outname = 'out.zip',
+    outdir = tmp_path/'out') as dist:
+
+    write = dist.write
+
+    def _write(dst, *args, **kwargs):
+      with lock:
+        written.add(PurePosixPath(dst).name)
+
+      return write(dst, *args, **kwargs)
+
+    dist.write = _write
+
+    _dist_copy.dist_copy(
+      base_path = PurePosixPath(),
+      copy_items = [PyprojDistCopy({'src': Path('source'), 'dst': Path('dest')})],
+      ignore = [],
+      dist = dist,
+      root = tmp_path,
+      workers = 4)
+
+  assert len(read) == 50
+  assert max(inflight) <= 5000
+
+  with zipfile.ZipFile(dist.outpath) as zf:
+    assert zf.read('dest/file_49.txt') == b'x'*1000
@@ -1,3 +1,6 @@
+import os
+import json
+import shutil
 from pathlib import Path
 import logging
 
@@ -58,3 +61,632 @@ def test_process_branches(tmp_path):
     with pytest.raises(ValidPathError):
         process(None, logger, {}, work, src, build, prefix,
                 ["setup"], ["compile"], ["install"], True, DummyRunner())
+
+
+ENTRY_MODULE = '''
+def run(pyproj, logger, options, work_dir, src_dir, build_dir, prefix,
+  setup_args, compile_args, install_args, build_clean, runner):
+  runner.run(compile_args)
+'''
+
+def make_builder(root, targets, workers, **kwargs):
+  from types import SimpleNamespace
+  from partis.pyproj.builder import Builder
+  from partis.pyproj.pptoml import pyproj_targets
+
+  (root/'build_cmds.py').write_text(ENTRY_MODULE)
+
+  targets = pyproj_targets([
+    dict(
+      entry = 'build_cmds:run',
+      build_dir = f'build/tmp_{i}',
+      prefix = f'build/prefix_{i}',
+      build_clean = False)|target
+    for i, target in enumerate(targets)])
+
+  pyproj = SimpleNamespace(
+    project = SimpleNamespace(name = 'test-pkg'),
+    pptoml = {},
+    pyproj = {},
+    config_settings = {},
+    commit = '',
+    pptoml_checksum = '',
+    env_pkgs = [])
+
+  return Builder(
+    pyproj = pyproj,
+    root = root,
+    targets = targets,
+    logger = logging.getLogger("test"),
+    editable = False,
+    workers = workers,
+    **kwargs)
+
+
+def test_target_order():
+  from partis.pyproj.builder.builder import target_depends, target_order
+  from partis.pyproj.pptoml import pyproj_targets
+  from partis.pyproj.validate import ValidationError
+
+  targets = pyproj_targets([
+    dict(name = 'c', depends_on = ['a', 'b']),
+    dict(name = 'a'),
+    dict(name = 'b', depends_on = 'a'),
+    dict()])
+
+  depends = target_depends(targets)
+  assert depends == {0: {1, 2}, 1: set(), 2: {1}, 3: set()}
+  assert target_order(depends) == [1, 2, 0, 3]
+
+  with pytest.raises(ValidationError):
+    target_depends(pyproj_targets([dict(depends_on = ['x'])]))
+
+  with pytest.raises(ValidationError):
+    target_depends(pyproj_targets([dict(name = 'a'), dict(name = 'a')]))
+
+  with pytest.raises(ValidationError):
+    target_order(target_depends(pyproj_targets([
+      dict(name = 'a', depends_on = ['b']),
+      dict(name = 'b', depends_on = ['a'])])))
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_builder_depends(tmp_path, workers):
+  # each command fails unless its dependencies already ran, relative to work_dir
+  targets = [
+    dict(
+      name = 'c',
+      depends_on = ['a', 'b'],
+      compile_args = ['sh', '-c', 'test -f a.txt && test -f b.txt && touch c.txt']),
+    dict(
+      name = 'a',
+      compile_args = ['sh', '-c', 'sleep 0.2 && touch a.txt']),
+    dict(
+      name = 'b',
+      compile_args = ['sh', '-c', 'touch b.txt']),
+    dict(
+      name = 'd',
+      depends_on = ['c'],
+      compile_args = ['sh', '-c', 'test -f c.txt && touch d.txt'])]
+
+  cwd = os.getcwd()
+
+  with make_builder(tmp_path, targets, workers) as builder:
+    builder.build_targets()
+
+  assert os.getcwd() == cwd
+
+  for name in 'abcd':
+    assert (tmp_path/f'{name}.txt').exists()
+
+  # each target has its own log files
+  logs = sorted(p.name for p in (tmp_path/'build'/'logs').iterdir())
+  assert logs == [f"target_{i:02d}.sh.00.log" for i in range(4)]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_builder_relative_command(tmp_path, workers):
+  # executable relative to work_dir, not the working directory of the process
+  tools = tmp_path/'sub'/'tools'
+  tools.mkdir(parents = True)
+  (tools/'build.sh').write_text('#!/bin/sh\ntouch "$1"\n')
+  (tools/'build.sh').chmod(0o755)
+
+  targets = [
+    dict(work_dir = 'sub', compile_args = ['tools/build.sh', f'{name}.txt'])
+    for name in 'ab']
+
+  with make_builder(tmp_path, targets, workers) as builder:
+    builder.build_targets()
+
+  for name in 'ab':
+    assert (tmp_path/'sub'/f'{name}.txt').exists()
+
+
+def test_builder_depends_disabled(tmp_path):
+  # dependency on a disabled target is still ordered after its dependencies
+  targets = [
+    dict(
+      name = 'c',
+      depends_on = ['b'],
+      compile_args = ['sh', '-c', 'test -f a.txt && touch c.txt']),
+    dict(
+      name = 'b',
+      enabled = False,
+      depends_on = ['a']),
+    dict(
+      name = 'a',
+      compile_args = ['sh', '-c', 'sleep 0.2 && touch a.txt'])]
+
+  with make_builder(tmp_path, targets, 2) as builder:
+    builder.build_targets()
+
+  assert (tmp_path/'c.txt').exists()
+  assert not (tmp_path/'b.txt').exists()
+
+
+def test_builder_concurrent_dirs(tmp_path):
+  targets = [
+    dict(name = 'a', prefix = 'build/shared', compile_args = ['sh', '-c', 'touch a.txt']),
+    dict(name = 'b', prefix = 'build/shared', compile_args = ['sh', '-c', 'touch b.txt'])]
+
+  # targets that may run concurrently cannot share a prefix
+  with pytest.raises(ValidPathError):
+    with make_builder(tmp_path, targets, 2) as builder:
+      builder.build_targets()
+
+  assert not (tmp_path/'a.txt').exists()
+
+  # unless run one after the other
+  with make_builder(tmp_path, targets, 1) as builder:
+    builder.build_targets()
+
+  targets[1]['depends_on'] = ['a']
+
+  with make_builder(tmp_path, targets, 2) as builder:
+    builder.build_targets()
+
+  assert (tmp_path/'b.txt').exists()
+
+
+def test_builder_fail_fast(tmp_path):
+  import time
+  from partis.pyproj.builder.builder import BuildCommandError
+
+  targets = [
+    dict(
+      name = 'slow',
+      compile_args = ['sh', '-c', 'sleep 30 && touch slow.txt']),
+    dict(
+      name = 'fail',
+      compile_args = ['sh', '-c', 'sleep 0.2 && exit 1']),
+    dict(
+      name = 'after',
+      depends_on = ['slow'],
+      compile_args = ['sh', '-c', 'touch after.txt'])]
+
+  start = time.monotonic()
+
+  with pytest.raises(BuildCommandError):
+    with make_builder(tmp_path, targets, 2) as builder:
+      builder.build_targets()
+
+  # running command was terminated, and dependent never started
+  assert time.monotonic() - start < 10
+  assert not (tmp_path/'slow.txt').exists()
+  assert not (tmp_path/'after.txt').exists()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_builder_cache(tmp_path, workers):
+  from partis.pyproj.cache import BuildCache
+
+  root = tmp_path/'root'
+  (root/'src').mkdir(parents = True)
+  (root/'src'/'input.txt').write_text('a')
+
+  build_cache = BuildCache(tmp_path/'cache')
+
+  # count.txt is not an input, only in work_dir
+  def build(**kwargs):
+    targets = [
+      dict(
+        name = 'x',
+        src_dir = 'src',
+        compile_args = ['sh', '-c',
+          'echo x >> count.txt && mkdir -p build/prefix_0/lib'
+          ' && cat src/input.txt > build/prefix_0/lib/out.txt'
+          ' && ln -sf out.txt build/prefix_0/lib/link.txt'],
+        **kwargs),
+      dict(
+        depends_on = ['x'],
+        src_dir = 'src',
+        compile_args = ['sh', '-c',
+          'echo y >> count.txt && cat build/prefix_0/lib/out.txt > build/prefix_1/out.txt'])]
+
+    with make_builder(root, targets, workers, build_cache = build_cache) as builder:
+      builder.build_targets()
+
+    return (root/'count.txt').read_text().split()
+
+  assert build() == ['x', 'y']
+  assert (root/'build'/'prefix_0'/'lib'/'out.txt').read_text() == 'a'
+
+  # unchanged inputs are restored from the cache, without running the target
+  shutil.rmtree(root/'build')
+  assert build() == ['x', 'y']
+  assert (root/'build'/'prefix_0'/'lib'/'out.txt').read_text() == 'a'
+  assert (root/'build'/'prefix_1'/'out.txt').read_text() == 'a'
+  assert os.readlink(root/'build'/'prefix_0'/'lib'/'link.txt') == 'out.txt'
+
+  # modified restored files do not change the cached files
+  (root/'build'/'prefix_0'/'lib'/'out.txt').write_text('b')
+  assert build() == ['x', 'y']
+  assert (root/'build'/'prefix_0'/'lib'/'out.txt').read_text() == 'a'
+
+  # change of source files, or target configuration, re-runs the target and
+  # those that depend on it
+  (root/'src'/'input.txt').write_text('c')
+  assert build() == ['x', 'y', 'x', 'y']
+  assert (root/'build'/'prefix_1'/'out.txt').read_text() == 'c'
+
+  assert build(options = {'opt': 1}) == ['x', 'y', 'x', 'y', 'x', 'y']
+  assert build(options = {'opt': 1}) == ['x', 'y', 'x', 'y', 'x', 'y']
+
+
+def test_builder_cache_layout(tmp_path):
+  from partis.pyproj.cache import BuildCache
+
+  root = tmp_path/'root'
+  (root/'src').mkdir(parents = True)
+  (root/'src'/'input.txt').write_text('a')
+
+  build_cache = BuildCache(tmp_path/'cache')
+
+  def build(targets):
+    with make_builder(root, targets, 1, build_cache = build_cache) as builder:
+      builder.build_targets()
+
+    return (root/'count.txt').read_text().split()
+
+  def entry_files():
+    if not (tmp_path/'cache').exists():
+      return []
+
+    return sorted(
+      rel
+      for entry in (tmp_path/'cache').iterdir()
+      for rel, _ in json.loads((entry/'manifest.json').read_text())['files'])
+
+  # default layout, with build_dir and logs inside the prefix
+  targets = [dict(
+    src_dir = 'src',
+    build_dir = 'build/tmp',
+    prefix = 'build',
+    compile_args = ['sh', '-c',
+      'echo x >> count.txt && echo obj > build/tmp/obj.o'
+      ' && mkdir -p build/lib && cat src/input.txt > build/lib/out.txt'])]
+
+  assert build(targets) == ['x']
+  assert entry_files() == ['lib/out.txt']
+
+  shutil.rmtree(root/'build')
+  assert build(targets) == ['x']
+  assert (root/'build'/'lib'/'out.txt').read_text() == 'a'
+  assert not (root/'build'/'tmp'/'obj.o').exists()
+
+  # files already installed (up-to-date) by a previous build are also cached
+  shutil.rmtree(tmp_path/'cache')
+  targets = [dict(
+    src_dir = 'src',
+    compile_args = ['sh', '-c',
+      'echo y >> count.txt && mkdir -p build/prefix_0'
+      ' && { [ -e build/prefix_0/out.txt ] || cat src/input.txt > build/prefix_0/out.txt; }'])]
+
+  with make_builder(root, targets, 1) as builder:
+    builder.build_targets()
+
+  assert build(targets) == ['x', 'y', 'y']
+  assert entry_files() == ['out.txt']
+
+  shutil.rmtree(root/'build')
+  assert build(targets) == ['x', 'y', 'y']
+  assert (root/'build'/'prefix_0'/'out.txt').read_text() == 'a'
+
+  # nothing installed (e.g. only downloaded into build_dir) is not a cache hit
+  shutil.rmtree(root/'build')
+  shutil.rmtree(tmp_path/'cache')
+  targets = [dict(
+    src_dir = 'src',
+    compile_args = ['sh', '-c', 'echo z >> count.txt && echo a > build/tmp_0/download'])]
+
+  assert build(targets) == ['x', 'y', 'y', 'z']
+  assert entry_files() == []
+  assert build(targets) == ['x', 'y', 'y', 'z', 'z']
+
+  # targets sharing a prefix are not cached
+  shutil.rmtree(root/'build')
+  targets = [
+    dict(src_dir = 'src', prefix = 'build/shared', compile_args = ['sh', '-c', 'echo u >> count.txt']),
+    dict(src_dir = 'src', prefix = 'build/shared', compile_args = ['sh', '-c',
+      'echo v >> count.txt && echo a > build/shared/out.txt'])]
+
+  assert build(targets)[-2:] == ['u', 'v']
+  assert build(targets)[-4:] == ['u', 'v', 'u', 'v']
+  assert entry_files() == []
+
+
+def test_builder_cache_remote(tmp_path):
+  from partis.pyproj.cache import BuildCache, SharedDirCache
+
+  remote = SharedDirCache(tmp_path/'shared')
+
+  targets = [
+    dict(
+      src_dir = 'src',
+      compile_args = ['sh', '-c',
+        'echo x >> count.txt && mkdir -p build/prefix_0/bin'
+        ' && cat src/input.txt > build/prefix_0/bin/out && chmod +x build/prefix_0/bin/out'])]
+
+  def build(name):
+    # same project at a different location, with its own local cache
+    root = tmp_path/name
+
+    if not root.exists():
+      (root/'src').mkdir(parents = True)
+      (root/'src'/'input.txt').write_text('a')
+
+    build_cache = BuildCache(tmp_path/f'cache_{name}', remote = remote)
+
+    with make_builder(root, targets, 1, build_cache = build_cache) as builder:
+      builder.build_targets()
+
+    out = root/'build'/'prefix_0'/'bin'/'out'
+    assert out.read_text() == 'a'
+    assert os.access(out, os.X_OK)
+
+    return (root/'count.txt').exists()
+
+  assert build('a')
+  assert len(list((tmp_path/'shared'/'entries').iterdir())) == 1
+  assert not list((tmp_path/'shared'/'leases').iterdir())
+
+  # pulled from the shared cache instead of being run
+  assert not build('b')
+  assert (tmp_path/'cache_b').exists()
+
+  # a corrupted blob is not used
+  blob, = [p for p in (tmp_path/'shared'/'blobs').rglob('*') if p.is_file()]
+  blob.write_text('corrupt')
+  assert build('c')
+
+
+def test_builder_cache_platform(tmp_path, monkeypatch):
+  from partis.pyproj.builder import builder as _builder
+  from partis.pyproj.cache import BuildCache
+
+  root = tmp_path/'root'
+  (root/'src').mkdir(parents = True)
+  (root/'src'/'input.txt').write_text('a')
+
+  build_cache = BuildCache(tmp_path/'cache')
+  targets = [dict(
+    src_dir = 'src',
+    compile_args = ['sh', '-c', 'echo x > build/prefix_0/out.so'])]
+
+  def build(abi):
+    monkeypatch.setattr(_builder, 'platform_abi', lambda: abi)
+
+    with make_builder(root, targets, 1, build_cache = build_cache) as builder:
+      builder.build_targets()
+
+    return builder._keys[0]
+
+  # same sys.platform, but a different architecture
+  key = build('linux-x86_64, x86_64, soabi=cpython-311-x86_64-linux-gnu')
+  assert build('linux-x86_64, x86_64, soabi=cpython-311-x86_64-linux-gnu') == key
+  assert build('linux-aarch64, aarch64, soabi=cpython-311-aarch64-linux-gnu') != key
+  assert len(list((tmp_path/'cache').iterdir())) == 2
+
+
+def test_shared_dir_cache_blobs(tmp_path):
+  import time
+  from partis.pyproj.cache import SharedDirCache
+
+  remote = SharedDirCache(tmp_path/'shared')
+
+  def entry(name):
+    entry = tmp_path/name
+    (entry/'files').mkdir(parents = True)
+    (entry/'files'/'out.txt').write_text('a')
+    (entry/'manifest.json').write_text(json.dumps({'version': 1, 'files': [['out.txt', None]]}))
+    return entry
+
+  remote.push('k1', entry('e1'))
+  blob, = [p for p in (tmp_path/'shared'/'blobs').rglob('*') if p.is_file()]
+
+  # reusing an old blob marks it as recent, so it is not pruned
+  os.utime(blob, (0, 0))
+  remote.push('k2', entry('e2'))
+  assert blob.stat().st_mtime > time.time() - 60
+  remote.prune()
+  assert blob.exists()
+
+  # an entry whose blob was removed is discarded, and may be published again
+  blob.unlink()
+  assert not remote.pull('k1', tmp_path/'p1')
+  assert not (tmp_path/'shared'/'entries'/'k1.json').exists()
+
+  remote.push('k1', entry('e3'))
+  assert remote.pull('k1', tmp_path/'p2')
+  assert (tmp_path/'p2'/'files'/'out.txt').read_text() == 'a'
+
+
+def test_shared_dir_cache_lease(tmp_path):
+  from partis.pyproj.cache import SharedDirCache
+
+  remote = SharedDirCache(tmp_path/'shared')
+
+  assert remote._acquire('key')
+  # held by another build
+  assert not remote._acquire('key')
+
+  # abandoned lease may be taken
+  lease = tmp_path/'shared'/'leases'/'key'
+  os.utime(lease, (0, 0))
+  assert remote._acquire('key')
+
+  remote._release('key')
+  assert not lease.exists()
+
+
+def test_jobserver(tmp_path):
+  from partis.pyproj.builder import JobServer
+
+  server = JobServer.create(3, tmp_path)
+  assert server.makeflags('k -j8 --jobserver-auth=3,4') == (
+    f"k -j3 --jobserver-auth=fifo:{server.path}")
+
+  # a client of the same jobserver shares the tokens
+  client = JobServer.from_makeflags(server.makeflags())
+  assert client is not None and client.fds == ()
+
+  assert server.acquire(0.1)
+  assert client.acquire(0.1)
+  assert not server.acquire(0.1)
+  assert not client.acquire(0.1)
+
+  client.release()
+  assert server.acquire(0.1)
+
+  client.close()
+  server.close()
+  assert not server.path.exists()
+
+  # anonymous pipe, with file descriptors inherited by commands
+  server = JobServer.create(2, tmp_path, style = 'pipe')
+  assert server.path is None
+  assert server.makeflags() == f"-j2 --jobserver-auth={server.fds[0]},{server.fds[1]}"
+  assert server.acquire(0.1)
+  assert not server.acquire(0.1)
+  server.close()
+
+  assert JobServer.from_makeflags('') is None
+  assert JobServer.from_makeflags('-j4') is None
+  # file descriptors not inherited
+  assert JobServer.from_makeflags('--jobserver-auth=1000,1001') is None
+
+
+def test_builder_jobs(tmp_path):
+  # number of targets running at once, as seen by each target
+  cmd = (
+    'echo "$MAKEFLAGS" > makeflags_{0}.txt && mkdir -p running && touch running/{0}'
+    ' && ls running | wc -l >> count.txt && sleep 0.3 && rm running/{0}')
+
+  targets = [
+    dict(compile_args = ['sh', '-c', cmd.format(i)])
+    for i in range(4)]
+
+  with make_builder(tmp_path, targets, 4, jobs = 2) as builder:
+    builder.build_targets()
+    assert builder.jobserver is None
+
+  counts = [int(v) for v in (tmp_path/'count.txt').read_text().split()]
+  assert len(counts) == 4
+  assert max(counts) <= 2
+
+  makeflags = (tmp_path/'makeflags_0.txt').read_text()
+  assert '-j2' in makeflags.split()
+  assert '--jobserver-auth=' in makeflags
+
+
+@pytest.mark.skipif(not shutil.which('make'), reason = "requires make")
+def test_builder_jobs_make(tmp_path):
+  # all jobs of make (in both targets) share the jobserver
+  (tmp_path/'Makefile').write_text(''.join([
+    'all: a b c\n',
+    *[
+      f"{v}:\n\t@touch running/$(NAME)_{v} && ls running | wc -l >> count.txt"
+      f" && sleep 0.3 && rm running/$(NAME)_{v}\n"
+      for v in 'abc']]))
+
+  (tmp_path/'running').mkdir()
+
+  targets = [
+    dict(compile_args = ['make', '-s', f'NAME={i}'])
+    for i in range(2)]
+
+  with make_builder(tmp_path, targets, 2, jobs = 3) as builder:
+    builder.build_targets()
+
+  counts = [int(v) for v in (tmp_path/'count.txt').read_text().split()]
+  assert len(counts) == 6
+  assert 1 < max(counts) <= 3
+
+
+def test_runner_output(tmp_path, caplog):
+  from partis.pyproj.builder.builder import ProcessRunner, BuildCommandError
+
+  runner = ProcessRunner(
+    logger = logging.getLogger("test"),
+    log_dir = tmp_path,
+    target_name = 'target_00',
+    env = dict(os.environ),
+    progress_interval = 0.0)
+
+  # lines 0..99, with errors on lines 10 and 95, and a (partially scanned) long line
+  script = (
+    'for i in $(seq 0 99); do'
+    ' if [ $i = 10 ] || [ $i = 95 ]; then echo "line $i error: bad"; else echo "line $i"; fi;'
+    ' done;'
+    ' head -c 100000 /dev/zero | tr "\\0" "x"; echo;'
+    ' echo "last"; exit 3')
+
+  with caplog.at_level(logging.INFO, logger = "test"):
+    with pytest.raises(BuildCommandError) as exc:
+      runner.run(['sh', '-c', script])
+
+  log_file = tmp_path/'target_00.sh.00.log'
+  lines = log_file.read_text().splitlines()
+  assert len(lines) == 102
+  assert len(lines[100]) == 100000
+
+  extra = exc.value.extra
+  assert 'returned non-zero exit status 3' in str(exc.value)
+  # windows of 5 lines starting at each error
+  assert '  10| line 10 error: bad\n  11| line 11\n' in extra
+  assert '  14| line 14\n    ⋮' in extra
+  assert '  99| line 99' in extra
+  # last lines after the last error
+  assert 'Last 7 lines of command output:' in extra
+  assert ' 101| last' in extra
+  assert str(log_file) in extra
+
+  # every line is forwarded to the logger with zero interval
+  assert sum('target_00.sh.00: line' in r.message for r in caplog.records) == 100
+
+
+def test_runner_cancel(tmp_path, monkeypatch):
+  import time
+  import threading
+  from partis.pyproj.builder import builder
+  from partis.pyproj.builder.builder import ProcessRunner, BuildCommandError
+
+  monkeypatch.setattr(builder, 'TERMINATE_TIMEOUT', 0.2)
+  cancel = threading.Event()
+
+  runner = ProcessRunner(
+    logger = logging.getLogger("test"),
+    log_dir = tmp_path,
+    target_name = 'target_00',
+    env = dict(os.environ),
+    cancel = cancel)
+
+  # ignores the request to terminate, and the output is held open by a child
+  timer = threading.Timer(0.3, cancel.set)
+  timer.start()
+  start = time.monotonic()
+
+  with pytest.raises(BuildCommandError, match = 'Cancelled'):
+    runner.run(['sh', '-c', 'trap "" TERM; echo started; sleep 5; echo done'])
+
+  assert time.monotonic() - start < 3
+  assert (tmp_path/'target_00.sh.00.log').read_text() == 'started\n'
+
+
+def test_output_monitor():
+  from partis.pyproj.builder.builder import OutputMonitor
+
+  monitor = OutputMonitor(num_lines = 3, window_size = 2, num_windows = 2)
+
+  for i in range(10):
+    monitor.feed(f"{i} error: x" if i % 3 == 0 else str(i))
+
+  # only the last windows and lines are kept
+  assert monitor.num_errors == 4
+  assert list(monitor.windows) == [[(6, '6 error: x'), (7, '7')], [(9, '9 error: x')]]
+  assert list(monitor.lines) == [(7, '7'), (8, '8'), (9, '9 error: x')]
+
+  report = monitor.report('log.txt')
+  assert '[2 earlier lines matching' in report
+  assert 'Last 1 lines of command output:' in report